@@ -0,0 +1,149 @@
+"""
+Compact storage encoding for ActionSequences.
+
+The agent's plans are lists of strings like
+    "Tool: ChangeSkybox, Similarity: 0.8123, Input: 'stormy', Observation: 'Observation: Skybox changed to 'stormy'.'"
+Stored as JSON, every entry repeats the boilerplate and tool names. encode_actions() parses each
+string into an ActionStep (tool, input, observation, score), interns tool names into a per-entry
+table, lays the steps out column-wise and deflates the result when that is smaller. decode_actions()
+reproduces the original strings exactly, so callers keep working with ActionSequence = List[str].
+Strings that are not tool steps ("Direct Answer: ...") are stored verbatim.
+
+Stored value: "<tag>:<payload>" in the actions_z metadata field
+    j1  compact columnar JSON
+    z1  the same JSON, raw-deflated (with a preset dictionary) and base85-encoded
+Entries written before this encoding only have actions_json; decode_actions() reads both.
+"""
+from typing import List, Optional, Dict, Any, TypedDict, Union
+import base64
+import json
+import re
+import sys
+import zlib
+
+ACTIONS_FIELD = "actions_z" # Metadata key for encoded actions
+LEGACY_ACTIONS_FIELD = "actions_json" # Metadata key used before ACTIONS_FIELD
+ZLIB_LEVEL = 9 # Payloads are tiny; the best level costs microseconds
+
+_ACTION_STEP_RE = re.compile(
+    r"Tool: (?P<tool>.*?), (?:Similarity: (?P<score>.*?), )?Input: '(?P<input>.*)', Observation: '(?P<observation>.*)'",
+    re.DOTALL
+)
+_LITERAL = -1 # Tool column value for steps kept verbatim
+
+# Preset deflate dictionary for z1: boilerplate and tool names common across entries, so even a
+# one-step plan compresses well. Never edit it: z1 entries need these exact bytes to decode.
+# A different dictionary needs a new tag (z2) with z1 kept for reading.
+_ZDICT_V1 = (
+    b'"Direct Answer: ","Agent Error: ","Defined and registered new tool: ","N/A (Tool dynamically created)",'
+    b'["ToolDefinitionAgent","SetPlayerAttribute","SpawnEntity","ChangeSkybox","PlaySoundEffect"],[0,1,2],'
+    b'["Observation: Error - ","Observation: Player attribute \'","\' set to \'","Observation: Entity \'",'
+    b'"\' spawned at coordinates (","Observation: Skybox changed to \'","Observation: Sound effect \'","\' played."'
+)
+
+
+class ActionStep(TypedDict):
+    tool: str
+    input: str
+    observation: str
+    score: Optional[Union[float, str]] # Tool similarity; a float when it was a plain 4-decimal number
+
+
+def format_action_step(tool: str, tool_input: Any, observation: Any, score: Any = None) -> str:
+    """The ActionSequence string for one tool step (score is omitted when None)."""
+    if score is None:
+        return f"Tool: {tool}, Input: '{tool_input}', Observation: '{observation}'"
+    if isinstance(score, float):
+        score = f"{score:.4f}"
+    return f"Tool: {tool}, Similarity: {score}, Input: '{tool_input}', Observation: '{observation}'"
+
+
+def parse_action_step(action: str) -> Optional[ActionStep]:
+    """Structured form of an action string, or None if it does not round-trip through format_action_step."""
+    match = _ACTION_STEP_RE.fullmatch(action)
+    if match is None:
+        return None
+    score: Optional[Union[float, str]] = match.group("score")
+    if score is not None:
+        try:
+            if f"{float(score):.4f}" == score:
+                score = float(score)
+        except ValueError:
+            pass
+    step = ActionStep(tool=match.group("tool"), input=match.group("input"), observation=match.group("observation"), score=score)
+    # Inputs or observations containing the separators can parse ambiguously; keep those verbatim
+    if format_action_step(step["tool"], step["input"], step["observation"], step["score"]) != action:
+        return None
+    return step
+
+
+def plan_signature(actions: List[str]) -> tuple:
+    """What a plan does, ignoring the per-prompt similarity score: (tool, input, observation) per step."""
+    signature = []
+    for action in actions:
+        step = parse_action_step(action)
+        signature.append((step["tool"], step["input"], step["observation"]) if step is not None else action)
+    return tuple(signature)
+
+
+def encode_actions(actions: List[str]) -> str:
+    """Encodes an ActionSequence for the ACTIONS_FIELD metadata value."""
+    tool_names: List[str] = []
+    tool_ids: Dict[str, int] = {}
+    tool_column, input_column, observation_column, score_column = [], [], [], []
+    for action in actions:
+        step = parse_action_step(action)
+        if step is None:
+            tool_column.append(_LITERAL)
+            input_column.append(action)
+            observation_column.append("")
+            score_column.append(None)
+            continue
+        if step["tool"] not in tool_ids:
+            tool_ids[step["tool"]] = len(tool_names)
+            tool_names.append(step["tool"])
+        tool_column.append(tool_ids[step["tool"]])
+        input_column.append(step["input"])
+        observation_column.append(step["observation"])
+        score_column.append(step["score"])
+
+    columns = [tool_names, tool_column, input_column, observation_column]
+    if any(score is not None for score in score_column):
+        columns.append(score_column)
+    plain = json.dumps(columns, separators=(",", ":"), ensure_ascii=False)
+
+    compressor = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -15, zdict=_ZDICT_V1)
+    packed = base64.b85encode(compressor.compress(plain.encode("utf-8")) + compressor.flush()).decode("ascii")
+    if len(packed) < len(plain.encode("utf-8")):
+        return "z1:" + packed
+    return "j1:" + plain
+
+
+def _decode_payload(value: str) -> List[str]:
+    tag, _, payload = value.partition(":")
+    if tag == "z1":
+        decompressor = zlib.decompressobj(-15, zdict=_ZDICT_V1)
+        payload = (decompressor.decompress(base64.b85decode(payload)) + decompressor.flush()).decode("utf-8")
+    elif tag != "j1":
+        raise ValueError(f"Unknown actions encoding tag '{tag}'")
+
+    columns = json.loads(payload)
+    tool_names = [sys.intern(name) for name in columns[0]]
+    tool_column, input_column, observation_column = columns[1], columns[2], columns[3]
+    score_column = columns[4] if len(columns) > 4 else [None] * len(tool_column)
+
+    actions = []
+    for tool_id, tool_input, observation, score in zip(tool_column, input_column, observation_column, score_column):
+        if tool_id == _LITERAL:
+            actions.append(tool_input)
+        else:
+            actions.append(format_action_step(tool_names[tool_id], tool_input, observation, score))
+    return actions
+
+
+def decode_actions(metadata: Dict[str, Any]) -> List[str]:
+    """ActionSequence from entry metadata, new (ACTIONS_FIELD) or legacy (LEGACY_ACTIONS_FIELD) format.
+    Raises ValueError (json.JSONDecodeError included) or zlib.error on corrupt values."""
+    if ACTIONS_FIELD in metadata:
+        return _decode_payload(metadata[ACTIONS_FIELD])
+    return json.loads(metadata.get(LEGACY_ACTIONS_FIELD, "[]"))
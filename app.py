@@ -7,28 +7,81 @@ from typing import Optional, List, Dict, Tuple
 import re
 
 # Core application imports
-from memory_cache import MemoryCache, ActionSequence, LookupResult
+from memory_cache import AsyncMemoryCache, ActionSequence, LookupResult, REWARD_FLUSH_INTERVAL_S, MERGE_SIMILARITY_THRESHOLD, DEFAULT_BACKEND
 from llm_module.llm import ChatLLM
 # from llm_module.custom_tools import WeatherTool, InventoryCheckTool, MessageHandlerTool # Old tools
 from llm_module.custom_tools import SetPlayerAttributeTool, SpawnEntityTool, ChangeSkyboxTool, PlaySoundTool # New game-specific tools
 from llm_module.capturing_agent import CapturingAgent, DEFAULT_AGENT_PROMPT_TEMPLATE
+from llm_module.embeddings import get_embedding_service
+from llm_module.completion_cache import get_completion_cache
+from request_pipeline import RequestPipeline, PipelineResult, actions_from_run
 
 # --- Initialization of Agent and Cache (using Streamlit caching) ---
 @st.cache_resource # Cache the resource across reruns
 def get_memory_cache():
     print("Initializing MemoryCache...")
-    return MemoryCache()
+    # Set MEMORY_CACHE_PATH to keep learned plans and scores across restarts.
+    # Votes are buffered in memory and flushed every REWARD_FLUSH_INTERVAL_S (and at exit).
+    # MEMORY_CACHE_MAX_ENTRIES bounds the cache size (lowest score/hits/recency evicted first);
+    # MEMORY_CACHE_TTL_S expires plans older than that many seconds.
+    # Paraphrases of a stored prompt with the same plan are merged into it instead of inserted.
+    # MEMORY_CACHE_BACKEND=mmap shares one store (and its memory) between all worker processes
+    # using the same MEMORY_CACHE_PATH.
+    max_entries = os.getenv("MEMORY_CACHE_MAX_ENTRIES")
+    ttl_s = os.getenv("MEMORY_CACHE_TTL_S")
+    return AsyncMemoryCache(persist_path=os.getenv("MEMORY_CACHE_PATH"), backend=os.getenv("MEMORY_CACHE_BACKEND", DEFAULT_BACKEND),
+                            reward_flush_interval_s=REWARD_FLUSH_INTERVAL_S,
+                            max_entries=int(max_entries) if max_entries else None,
+                            default_ttl_s=float(ttl_s) if ttl_s else None,
+                            merge_threshold=MERGE_SIMILARITY_THRESHOLD)
 
 @st.cache_resource
 def get_capturing_agent():
     print("Initializing CapturingAgent...")
-    llm = ChatLLM()
+    # Identical temperature-0 prompts (e.g. on the downvote-retry path) are answered from the
+    # completion cache; set LLM_COMPLETION_CACHE_PATH to keep it across restarts.
+    llm = ChatLLM(completion_cache=get_completion_cache())
     # tools = [WeatherTool(), InventoryCheckTool(), MessageHandlerTool()] # Old tools instantiation
     tools = [SetPlayerAttributeTool(), SpawnEntityTool(), ChangeSkyboxTool(), PlaySoundTool()] # New tools
     agent_prompt = DEFAULT_AGENT_PROMPT_TEMPLATE
-    agent = CapturingAgent(llm=llm, tools=tools, prompt_template=agent_prompt)
+    # One JSON LLM call decides tool, definition and input for prompts that match no tool
+    agent = CapturingAgent(llm=llm, tools=tools, prompt_template=agent_prompt, structured_decision=True)
     return agent
 
+@st.cache_resource
+def get_request_pipeline():
+    # Overlaps cache lookup, tool matching and tool-input generation on misses
+    return RequestPipeline(get_memory_cache(), get_capturing_agent())
+
+def describe_agent_event(event) -> str:
+    """One progress line for a streamed agent step (see CapturingAgent.run_stream)."""
+    if event["event"] == "tool_defined":
+        return f"🛠️ {event['observation']}"
+    if event["event"] == "tool_chosen":
+        return f"🔧 Using tool `{event['tool_name']}` (Similarity: {event['similarity_score']})"
+    if event["event"] == "tool_input":
+        return f"➡️ Input: `{event['tool_input']}`"
+    if event["event"] == "observation":
+        return f"👁️ {event['observation']}"
+    return ""
+
+def run_pipeline_streaming(pipeline: RequestPipeline, prompt: str, placeholder,
+                           exclude_tool_names: Optional[List[str]] = None, use_cache: bool = True) -> PipelineResult:
+    """Runs the pipeline, rendering agent steps and direct-answer tokens into placeholder as they arrive."""
+    progress_lines: List[str] = ["🧠 Agent thinking..."]
+    streamed_answer = ""
+    pipeline_result: Optional[PipelineResult] = None
+    for event in pipeline.process_stream(prompt, exclude_tool_names=exclude_tool_names, use_cache=use_cache):
+        if event["event"] == "result":
+            pipeline_result = event["result"]
+            continue
+        if event["event"] == "answer_delta":
+            streamed_answer += event["text"]
+        else:
+            progress_lines.append(describe_agent_event(event))
+        placeholder.markdown("\n\n".join(progress_lines + ([streamed_answer + " ▌"] if streamed_answer else [])))
+    return pipeline_result
+
 def main():
     st.set_page_config(page_title="AI Agent with Memory Cache", page_icon="🧠")
     st.title("🧠 AI Agent with Memory Cache")
@@ -41,6 +94,7 @@ def main():
     # Get (or create) cached instances of agent and memory cache
     cache = get_memory_cache()
     agent = get_capturing_agent()
+    pipeline = get_request_pipeline()
 
     # Initialize chat history and other session variables
     if "messages" not in st.session_state:
@@ -80,6 +134,27 @@ def main():
     else:
         st.sidebar.markdown("No tools available for the agent.")
 
+    # Embedding cache counters (shared by the cache and the agent)
+    with st.sidebar.expander("Embedding Cache Stats"):
+        embedding_stats = get_embedding_service().stats()
+        st.markdown(
+            f"Hits: {embedding_stats['memory_hits'] + embedding_stats['disk_hits']} "
+            f"(disk: {embedding_stats['disk_hits']}), Misses: {embedding_stats['misses']}  \n"
+            f"Hit rate: {embedding_stats['hit_rate']:.0%}, "
+            f"Est. API time saved: {embedding_stats['saved_seconds_estimate']:.2f}s"
+        )
+        decoded_stats = cache.decoded_cache_stats()
+        st.markdown(
+            f"Decoded hits: {decoded_stats['hits']}, misses: {decoded_stats['misses']} "
+            f"({decoded_stats['hit_rate']:.0%}, {decoded_stats['cached_entries']} entries)"
+        )
+        completion_stats = get_completion_cache().stats()
+        st.markdown(
+            f"LLM completion hits: {completion_stats['memory_hits'] + completion_stats['disk_hits']}, "
+            f"misses: {completion_stats['misses']} ({completion_stats['hit_rate']:.0%}), "
+            f"LLM time saved: {completion_stats['saved_seconds']:.2f}s"
+        )
+
     # --- Placeholder Prompts ---
     placeholder_prompts = [
         "Make the skybox stormy",
@@ -139,9 +214,12 @@ def main():
                 print(f"Agent retry triggered for prompt: '{prompt}' with exclusions: {st.session_state.agent_retry_info['exclude_tool_names']}")
                 agent_excluded_tools = st.session_state.agent_retry_info['exclude_tool_names']
                 st.session_state.agent_retry_info = None # Consume retry info
-                lookup_result = None # Force agent run, skip cache
+                pipeline_result = run_pipeline_streaming(pipeline, prompt, message_placeholder,
+                                                         exclude_tool_names=agent_excluded_tools, use_cache=False) # Force agent run, skip cache
             else:
-                lookup_result: Optional[LookupResult] = cache.lookup(prompt)
+                # Agent steps and direct-answer tokens are shown as they arrive, not after the whole run
+                pipeline_result = run_pipeline_streaming(pipeline, prompt, message_placeholder)
+            lookup_result: Optional[LookupResult] = pipeline_result["lookup_result"]
 
             if lookup_result:
                 entry_id_for_this_interaction = lookup_result['entry_id']
@@ -155,29 +233,19 @@ def main():
                 response_summary = f"Retrieved from cache (Similarity: {similarity_score_for_display:.2f}):"
             else:
                 response_summary = "🧠 Generating new response with agent:"
-                # Pass agent_excluded_tools if this is a retry
-                final_answer_from_agent, tool_history_dicts = agent.run(prompt, exclude_tool_names=agent_excluded_tools)
+                # The pipeline already ran the agent (with agent_excluded_tools if this is a retry)
+                final_answer_from_agent, tool_history_dicts = pipeline_result["final_answer"], pipeline_result["history"]
                 st.session_state.current_tool_history_for_feedback = tool_history_dicts # Store for potential feedback
                 st.session_state.is_last_action_from_cache = False
 
+                actions_to_display_and_store = actions_from_run(final_answer_from_agent, tool_history_dicts)
                 if tool_history_dicts:
-                    for step in tool_history_dicts:
-                        if step.get("tool_name") == "ToolDefinitionAgent":
-                            new_tool_defined_this_turn = True
-                        action_str = f"Tool: {step.get('tool_name', 'N/A')}, " \
-                                     f"Similarity: {step.get('similarity_score', 'N/A')}, " \
-                                     f"Input: '{step.get('tool_input', 'N/A')}', " \
-                                     f"Observation: '{step.get('observation', 'N/A')}'"
-                        actions_to_display_and_store.append(action_str)
+                    new_tool_defined_this_turn = any(step.get("tool_name") == "ToolDefinitionAgent" for step in tool_history_dicts)
                     response_summary += f"\nLLM Final Answer: {final_answer_from_agent}"
-                elif not final_answer_from_agent.startswith("Error:"):
-                    actions_to_display_and_store = [f"Direct Answer: {final_answer_from_agent}"]
-                else: # Error from agent
-                    actions_to_display_and_store = [f"Agent Error: {final_answer_from_agent}"]
                 
                 # Store in cache if actions were generated (even direct answers)
                 if actions_to_display_and_store and not final_answer_from_agent.startswith("Error: Agent reached maximum loops") : # Avoid caching agent errors from loop exhaustion
-                    new_entry_id = cache.store(prompt, actions_to_display_and_store)
+                    new_entry_id = cache.store(prompt, actions_to_display_and_store, embedding=pipeline_result["prompt_embedding"])
                     if new_entry_id:
                         entry_id_for_this_interaction = new_entry_id
                         print(f"Stored new entry {new_entry_id} for prompt \'{prompt}\'")
@@ -0,0 +1,101 @@
+"""
+Bytes-per-entry benchmark for the ActionSequence storage encoding (action_codec.py).
+
+Builds a corpus shaped like what app.py stores: 1-3 tool steps per plan produced by running the
+real game tools from llm_module/custom_tools.py (with similarity scores, occasional dynamically
+defined tools), plus direct answers. Compares the legacy actions_json value with actions_z and
+checks that every entry decodes back to the original strings. Standard library + pydantic only.
+
+    python3 -m benchmarks.bench_action_encoding --entries 20000
+"""
+import argparse
+import json
+import random
+import time
+
+from action_codec import ACTIONS_FIELD, LEGACY_ACTIONS_FIELD, encode_actions, decode_actions, format_action_step
+from llm_module.custom_tools import SetPlayerAttributeTool, SpawnEntityTool, ChangeSkyboxTool, PlaySoundTool
+
+ATTRIBUTES = ["health", "speed", "mana", "stamina", "armor", "jump_height", "gravity"]
+ENTITIES = ["dog", "zombie", "dragon", "chest", "villager", "skeleton_archer", "treasure_goblin"]
+SKYBOXES = ["stormy", "sunset", "starry night", "overcast", "blood moon", "aurora borealis"]
+SOUNDS = ["explosion", "player_jump", "door_open", "victory_fanfare", "thunder", "coin_pickup"]
+DIRECT_ANSWERS = [
+    "The current skybox theme cannot be queried directly; try changing it instead.",
+    "Entities are spawned relative to the world origin unless coordinates are given.",
+    "I can set player attributes, spawn entities, change the skybox or play sound effects.",
+]
+
+
+def random_step(rng: random.Random, tools) -> str:
+    tool = rng.choice(tools)
+    if isinstance(tool, SetPlayerAttributeTool):
+        tool_input = f"{rng.choice(ATTRIBUTES)}={rng.randint(1, 200)}"
+    elif isinstance(tool, SpawnEntityTool):
+        tool_input = f"{rng.choice(ENTITIES)},{rng.randint(-50, 50)},{rng.randint(0, 20)},{rng.randint(-50, 50)}"
+    elif isinstance(tool, ChangeSkyboxTool):
+        tool_input = rng.choice(SKYBOXES)
+    else:
+        tool_input = rng.choice(SOUNDS)
+    return format_action_step(tool.name, tool_input, tool(tool_input), f"{rng.uniform(0.4, 0.95):.4f}")
+
+
+def build_corpus(entries: int, seed: int = 7):
+    rng = random.Random(seed)
+    tools = [SetPlayerAttributeTool(), SpawnEntityTool(), ChangeSkyboxTool(), PlaySoundTool()]
+    corpus = []
+    for _ in range(entries):
+        roll = rng.random()
+        if roll < 0.15:
+            corpus.append([f"Direct Answer: {rng.choice(DIRECT_ANSWERS)}"])
+            continue
+        actions = []
+        if roll < 0.25:
+            # A turn that first defined a new tool (see CapturingAgent.run)
+            name = f"Set{rng.choice(ATTRIBUTES).title().replace('_', '')}Weather"
+            actions.append(format_action_step(
+                "ToolDefinitionAgent", "make the weather match the player's mood",
+                f"Defined and registered new tool: {name} - Changes the weather based on player state.",
+                "N/A (Tool dynamically created)"
+            ))
+        actions.extend(random_step(rng, tools) for _ in range(rng.randint(1, 3)))
+        corpus.append(actions)
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=20000)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.entries)
+
+    started = time.perf_counter()
+    legacy = [json.dumps(actions) for actions in corpus]
+    legacy_encode_s = time.perf_counter() - started
+    started = time.perf_counter()
+    encoded = [encode_actions(actions) for actions in corpus]
+    encode_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for value in legacy:
+        decode_actions({LEGACY_ACTIONS_FIELD: value})
+    legacy_decode_s = time.perf_counter() - started
+    started = time.perf_counter()
+    decoded = [decode_actions({ACTIONS_FIELD: value}) for value in encoded]
+    decode_s = time.perf_counter() - started
+    assert decoded == corpus, "round trip mismatch"
+
+    legacy_bytes = sum(len(value.encode("utf-8")) for value in legacy)
+    encoded_bytes = sum(len(value.encode("utf-8")) for value in encoded)
+    compressed = sum(1 for value in encoded if value.startswith("z1:"))
+    n = len(corpus)
+    print(f"{n} entries, {sum(len(a) for a in corpus) / n:.2f} actions/entry, {100.0 * compressed / n:.0f}% stored deflated")
+    print(f"{'format':>12} {'bytes/entry':>12} {'encode us':>10} {'decode us':>10}")
+    print(f"{'actions_json':>12} {legacy_bytes / n:>12.1f} {1e6 * legacy_encode_s / n:>10.1f} {1e6 * legacy_decode_s / n:>10.1f}")
+    print(f"{'actions_z':>12} {encoded_bytes / n:>12.1f} {1e6 * encode_s / n:>10.1f} {1e6 * decode_s / n:>10.1f}")
+    print(f"Reduction: {100.0 * (1 - encoded_bytes / legacy_bytes):.1f}%")
+
+
+if __name__ == "__main__":
+    main()
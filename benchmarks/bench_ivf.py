@@ -0,0 +1,76 @@
+"""
+Recall and latency benchmark for the IVF backend against the exact flat scan.
+
+Fills NumpyFlatBackend and IVFBackend with the same synthetic clustered, normalized embeddings
+(prompts about the same thing land close together, as they do with real embeddings), trains the
+IVF centroids, then queries both with perturbed copies of stored vectors. Reports recall@TOP_K
+of IVF against the exact results and per-query latency for several nprobe values.
+
+    python3 -m benchmarks.bench_ivf --entries 200000 --dim 1536 --nprobe 4,8,16,32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from memory_cache import TOP_K_RESULTS
+from vector_backends import NumpyFlatBackend, IVFBackend
+
+ADD_BATCH = 10000
+
+
+def clustered_embeddings(n: int, dim: int, topics: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, topics, size=n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def timed_queries(backend, queries: np.ndarray, k: int):
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append([entry_id for entry_id, _, _ in backend.query(query, k)])
+        latencies.append(time.perf_counter() - started)
+    return results, 1e3 * np.asarray(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--topics", type=int, default=2000, help="Synthetic prompt clusters")
+    parser.add_argument("--nprobe", default="4,8,16,32", help="Comma-separated nprobe values")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = clustered_embeddings(args.entries, args.dim, args.topics, rng)
+    ids = [str(i) for i in range(args.entries)]
+    flat, ivf = NumpyFlatBackend(), IVFBackend()
+    for start in range(0, args.entries, ADD_BATCH):
+        batch_ids = ids[start:start + ADD_BATCH]
+        metadatas = [{}] * len(batch_ids)
+        flat.add(batch_ids, vectors[start:start + ADD_BATCH], metadatas)
+        ivf.add(batch_ids, vectors[start:start + ADD_BATCH], metadatas)
+
+    started = time.perf_counter()
+    ivf.compact()
+    print(f"{args.entries} entries x {args.dim} dims; IVF trained in {time.perf_counter() - started:.1f}s "
+          f"({len(ivf._lists)} lists)")
+
+    picks = rng.integers(0, args.entries, size=args.queries)
+    queries = vectors[picks] + 0.05 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    exact, flat_ms = timed_queries(flat, queries, TOP_K_RESULTS)
+    print(f"{'index':>12} {'recall@' + str(TOP_K_RESULTS):>10} {'mean ms':>9} {'p99 ms':>9}")
+    print(f"{'flat':>12} {1.0:>10.3f} {flat_ms.mean():>9.2f} {np.percentile(flat_ms, 99):>9.2f}")
+    for nprobe in [int(value) for value in args.nprobe.split(",")]:
+        ivf.nprobe = nprobe
+        approximate, ivf_ms = timed_queries(ivf, queries, TOP_K_RESULTS)
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approximate, exact)])
+        print(f"{'ivf/' + str(nprobe):>12} {recall:>10.3f} {ivf_ms.mean():>9.2f} {np.percentile(ivf_ms, 99):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Warm-start benchmark for MemoryCache persistent mode.
+
+Fills a persistent store (ChromaDB, or the shared mmap backend with --backend mmap) with N random
+(normalized) entries, then measures how long a fresh MemoryCache takes to open it and answer its
+first lookup, i.e. the warm-up a restarted Streamlit process pays, and when the background
+exact-match/eviction index load finishes. No OpenAI calls are made: lookups use a random-vector embedder.
+
+    python3 -m benchmarks.bench_warm_start --sizes 10000,100000,1000000 --dim 1536 [--backend mmap]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import chromadb
+import numpy as np
+
+from memory_cache import MemoryCache, DEFAULT_COLLECTION_NAME
+from vector_backends import MmapBackend
+
+
+class RandomEmbedder:
+    """Stands in for EmbeddingService so the benchmark measures storage, not the network."""
+
+    def __init__(self, dim: int, seed: int = 0):
+        self._rng = np.random.default_rng(seed)
+        self._dim = dim
+
+    def embed(self, text: str, model: str = None):
+        vec = self._rng.standard_normal(self._dim)
+        return (vec / np.linalg.norm(vec)).tolist()
+
+
+def populate(path: str, size: int, dim: int, backend: str = "chroma"):
+    if backend == "mmap":
+        collection = MmapBackend(collection_name=DEFAULT_COLLECTION_NAME, persist_path=path)
+        batch_size = 5000
+    else:
+        client = chromadb.PersistentClient(path=path)
+        collection = client.get_or_create_collection(name=DEFAULT_COLLECTION_NAME)
+        batch_size = min(5000, client.get_max_batch_size())
+    rng = np.random.default_rng(42)
+    now_iso = datetime.now(timezone.utc).isoformat()
+    for start in range(0, size, batch_size):
+        count = min(batch_size, size - start)
+        vectors = rng.standard_normal((count, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(
+            ids=[str(uuid.uuid4()) for _ in range(count)],
+            embeddings=vectors.tolist(),
+            metadatas=[{
+                "prompt_raw": f"benchmark prompt {start + i}",
+                "actions_json": json.dumps([f"Tool: Benchmark, Input: '{start + i}'"]),
+                "score": 1.0,
+                "created_at_iso": now_iso,
+                "updated_at_iso": now_iso,
+            } for i in range(count)]
+        )
+    del collection
+
+
+def measure(path: str, dim: int, backend: str = "chroma"):
+    started = time.perf_counter()
+    cache = MemoryCache(embedding_service=RandomEmbedder(dim), persist_path=path, backend=backend)
+    opened = time.perf_counter()
+    cache.lookup("first lookup after restart")
+    first_lookup = time.perf_counter()
+    cache.lookup("second lookup after restart")
+    second_lookup = time.perf_counter()
+    cache.wait_until_ready()
+    index_ready = time.perf_counter()
+    cache.close()
+    return opened - started, first_lookup - opened, second_lookup - first_lookup, index_ready - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated entry counts")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension (text-embedding-3-small is 1536)")
+    parser.add_argument("--backend", default="chroma", choices=["chroma", "mmap"], help="Persistent backend to measure")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated stores instead of deleting them")
+    args = parser.parse_args()
+
+    print(f"{'entries':>10} {'populate s':>11} {'open s':>8} {'1st lookup s':>13} {'2nd lookup s':>13} {'index s':>8} {'disk MB':>8}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        path = tempfile.mkdtemp(prefix=f"memory_cache_warm_{size}_")
+        try:
+            started = time.perf_counter()
+            populate(path, size, args.dim, args.backend)
+            populate_s = time.perf_counter() - started
+            open_s, first_s, second_s, index_s = measure(path, args.dim, args.backend)
+            disk_mb = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files) / 1e6
+            print(f"{size:>10} {populate_s:>11.1f} {open_s:>8.3f} {first_s:>13.4f} {second_s:>13.4f} {index_s:>8.2f} {disk_mb:>8.1f}")
+        finally:
+            if not args.keep:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Local load test for service.py against a stub OpenAI server.
+
+Starts a stub of the OpenAI embeddings and chat-completions endpoints (fixed artificial latency,
+deterministic bag-of-words embeddings) and the cache service, each in its own uvicorn process,
+then drives the service with concurrent HTTP clients for a fixed duration: /run with prompts
+drawn from a small vocabulary (repeats and paraphrases become cache hits), /lookup and /reward.
+Reports throughput, latency percentiles and the status codes seen (429 = backpressure), then
+stops the service with SIGTERM (graceful shutdown).
+
+    python3 -m benchmarks.load_test_service --clients 64 --seconds 20
+    python3 -m benchmarks.load_test_service --clients 512 --max-concurrency 32 --max-queued 64
+"""
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import signal
+import time
+
+import httpx
+import numpy as np
+import uvicorn
+
+STUB_DIM = 1536
+VERBS = ["spawn", "summon", "create", "place"]
+ENTITIES = ["dragon", "zombie", "chest", "villager", "skeleton", "goblin", "wolf", "golem"]
+SKYBOXES = ["stormy", "sunset", "starry", "overcast", "aurora", "foggy"]
+SOUNDS = ["explosion", "thunder", "fanfare", "footsteps", "coin", "door"]
+
+
+def stub_embedding(text: str) -> list:
+    vector = np.zeros(STUB_DIM, dtype=np.float32)
+    for word in text.lower().split():
+        vector[int(hashlib.blake2b(word.encode(), digest_size=4).hexdigest(), 16) % STUB_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+class StubOpenAI:
+    """Minimal ASGI stand-in for /v1/embeddings and /v1/chat/completions."""
+
+    def __init__(self, embedding_latency_s: float, chat_latency_s: float):
+        self.embedding_latency_s = embedding_latency_s
+        self.chat_latency_s = chat_latency_s
+        self.calls = collections.Counter()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        request = json.loads(body or b"{}")
+        if scope["path"] == "/stats":
+            payload = dict(self.calls)
+        elif scope["path"].endswith("/embeddings"):
+            self.calls["embeddings"] += 1
+            await asyncio.sleep(self.embedding_latency_s)
+            texts = request.get("input", [])
+            texts = texts if isinstance(texts, list) else [texts]
+            payload = {"object": "list", "model": request.get("model", "stub"),
+                       "data": [{"object": "embedding", "index": i, "embedding": stub_embedding(t)} for i, t in enumerate(texts)],
+                       "usage": {"prompt_tokens": 5 * len(texts), "total_tokens": 5 * len(texts)}}
+        else:
+            self.calls["chat"] += 1
+            await asyncio.sleep(self.chat_latency_s)
+            payload = {"id": "stub", "object": "chat.completion", "created": int(time.time()), "model": request.get("model", "stub"),
+                       "choices": [{"index": 0, "finish_reason": "stop",
+                                    "message": {"role": "assistant", "content": random.choice(SKYBOXES)}}],
+                       "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11}}
+        data = json.dumps(payload).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": data})
+
+
+def run_stub(port: int, embedding_latency_s: float, chat_latency_s: float):
+    uvicorn.run(StubOpenAI(embedding_latency_s, chat_latency_s), host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+
+
+def run_service(port: int, stub_port: int, backend: str, max_concurrency: int, max_queued: int):
+    # The OpenAI clients created by the service read these when they are constructed
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{stub_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["MEMORY_CACHE_BACKEND"] = backend
+    os.environ.pop("MEMORY_CACHE_PATH", None)
+    from service import CacheService
+    uvicorn.run(CacheService(max_concurrency=max_concurrency, max_queued=max_queued),
+                host="127.0.0.1", port=port, log_level="warning")
+
+
+def wait_until_up(url: str, timeout_s: float = 60.0):
+    deadline = time.perf_counter() + timeout_s
+    while time.perf_counter() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout_s:.0f}s")
+
+
+def random_prompt(rng: random.Random) -> str:
+    roll = rng.random()
+    if roll < 0.5:
+        return f"{rng.choice(VERBS)} a {rng.choice(ENTITIES)} near the player"
+    if roll < 0.8:
+        return f"change the skybox to {rng.choice(SKYBOXES)}"
+    return f"play the {rng.choice(SOUNDS)} sound effect"
+
+
+async def client_loop(client: httpx.AsyncClient, base_url: str, deadline: float, seed: int, results: list, entry_ids: list):
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        roll = rng.random()
+        if roll < 0.6 or not entry_ids:
+            endpoint, body = "/run", {"prompt": random_prompt(rng)}
+        elif roll < 0.8:
+            endpoint, body = "/lookup", {"prompt": random_prompt(rng)}
+        else:
+            endpoint, body = "/reward", {"entry_id": rng.choice(entry_ids), "success": rng.random() < 0.8}
+        started = time.perf_counter()
+        try:
+            response = await client.post(base_url + endpoint, json=body)
+            status = response.status_code
+            if endpoint == "/run" and status == 200 and response.json().get("entry_id"):
+                entry_ids.append(response.json()["entry_id"])
+        except httpx.HTTPError:
+            status = 0
+        results.append((endpoint, status, time.perf_counter() - started))
+        if status == 429:
+            await asyncio.sleep(0.05)
+
+
+async def drive(base_url: str, clients: int, seconds: float) -> list:
+    results, entry_ids = [], []
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=60.0) as client:
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(*(client_loop(client, base_url, deadline, seed, results, entry_ids) for seed in range(clients)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    parser.add_argument("--max-queued", type=int, default=None)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0)
+    parser.add_argument("--backend", default="numpy")
+    parser.add_argument("--stub-port", type=int, default=18001)
+    parser.add_argument("--port", type=int, default=18000)
+    args = parser.parse_args()
+
+    from service import SERVICE_MAX_CONCURRENCY, SERVICE_MAX_QUEUED
+    max_concurrency = args.max_concurrency or SERVICE_MAX_CONCURRENCY
+    max_queued = args.max_queued or SERVICE_MAX_QUEUED
+    base_url = f"http://127.0.0.1:{args.port}"
+    stub = multiprocessing.Process(target=run_stub, args=(args.stub_port, args.embedding_latency_ms / 1000.0, args.chat_latency_ms / 1000.0))
+    service = multiprocessing.Process(target=run_service, args=(args.port, args.stub_port, args.backend, max_concurrency, max_queued))
+    stub.start()
+    service.start()
+    try:
+        wait_until_up(f"http://127.0.0.1:{args.stub_port}/stats")
+        wait_until_up(base_url + "/health")
+        results = asyncio.run(drive(base_url, args.clients, args.seconds))
+        stub_calls = httpx.get(f"http://127.0.0.1:{args.stub_port}/stats").json()
+    finally:
+        os.kill(service.pid, signal.SIGTERM) # Graceful: drain, flush, exit
+        service.join()
+        stub.terminate()
+        stub.join()
+
+    print(f"{args.clients} clients, {args.seconds:.0f}s, max_concurrency={max_concurrency}, max_queued={max_queued}, "
+          f"stub latency {args.embedding_latency_ms:.0f} ms embeddings / {args.chat_latency_ms:.0f} ms chat")
+    print(f"Total {len(results)} requests, {len(results) / args.seconds:.1f} req/s; "
+          f"status {dict(collections.Counter(status for _, status, _ in results))}; stub calls {stub_calls}")
+    print(f"{'endpoint':>10} {'ok':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for endpoint in ("/run", "/lookup", "/reward"):
+        latencies = np.asarray([1e3 * seconds for e, status, seconds in results if e == endpoint and status in (200, 404)])
+        if len(latencies):
+            print(f"{endpoint:>10} {len(latencies):>7} {len(latencies) / args.seconds:>8.1f} "
+                  f"{np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 99):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Streaming bulk import of historic (prompt, ActionSequence) logs into a persistent MemoryCache.
+
+Reads a JSONL file line by line, embeds and stores records in bounded batches through
+MemoryCache.store_many, and writes a checkpoint (byte offset) after every batch so an
+interrupted import resumes where it stopped. Memory use depends on --batch-size, not file size.
+
+    python3 -m cache_import plans.jsonl --persist-path ./chroma_db_data
+    python3 -m cache_import requests.jsonl --prompt-field title --actions-field body --persist-path ./chroma_db_data
+
+Each record's actions field may be a list of action strings or a single string.
+Entry ids are derived from the file path and line offset, so re-importing a batch after a
+crash does not create duplicates: records whose id is already stored are counted as
+already_imported and are not embedded again.
+"""
+from typing import Iterator, List, Optional, Tuple, Dict, Any
+import argparse
+import json
+import os
+import time
+import uuid
+
+from memory_cache import MemoryCache, ActionSequence, DEFAULT_COLLECTION_NAME
+
+IMPORT_BATCH_SIZE = 1000 # Records per store_many call (ChromaDB caps a single add at a few thousand)
+
+Record = Tuple[int, int, Dict[str, Any]] # (line start offset, line end offset, parsed JSON)
+
+
+def iter_jsonl_records(path: str, start_offset: int = 0) -> Iterator[Record]:
+    """Yields parsed records from start_offset on, skipping blank and malformed lines."""
+    with open(path, "rb") as f:
+        f.seek(start_offset)
+        offset = start_offset
+        for line in f:
+            line_start, offset = offset, offset + len(line)
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Warning: Skipping malformed JSON at byte {line_start}: {e}")
+                continue
+            if isinstance(record, dict):
+                yield line_start, offset, record
+
+
+def iter_batches(records: Iterator[Record], batch_size: int) -> Iterator[List[Record]]:
+    batch: List[Record] = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def to_entry(record: Dict[str, Any], prompt_field: str, actions_field: str) -> Optional[Tuple[str, ActionSequence]]:
+    prompt = record.get(prompt_field)
+    actions = record.get(actions_field)
+    if not isinstance(prompt, str) or not prompt.strip() or actions is None:
+        return None
+    if isinstance(actions, str):
+        actions = [actions]
+    elif isinstance(actions, list):
+        actions = [a if isinstance(a, str) else json.dumps(a) for a in actions]
+    else:
+        return None
+    return prompt, actions
+
+
+def load_checkpoint(checkpoint_path: str) -> Dict[str, int]:
+    if not os.path.exists(checkpoint_path):
+        return {"offset": 0, "imported": 0, "skipped": 0, "already_imported": 0}
+    with open(checkpoint_path) as f:
+        state = json.load(f)
+    state.setdefault("already_imported", 0) # Checkpoints written before the counter existed
+    return state
+
+
+def save_checkpoint(checkpoint_path: str, state: Dict[str, int]):
+    """Writes the checkpoint atomically so a crash mid-write never corrupts it."""
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, checkpoint_path)
+
+
+def import_jsonl(cache: MemoryCache, path: str, prompt_field: str = "prompt", actions_field: str = "actions",
+                 batch_size: int = IMPORT_BATCH_SIZE, checkpoint_path: Optional[str] = None) -> Dict[str, int]:
+    """Imports path into cache, resuming from checkpoint_path if present. Returns the final counters."""
+    checkpoint_path = checkpoint_path or path + ".import_checkpoint"
+    state = load_checkpoint(checkpoint_path)
+    if state["offset"]:
+        print(f"Resuming import of '{path}' at byte {state['offset']} ({state['imported']} entries already imported).")
+
+    total_bytes = os.path.getsize(path)
+    id_namespace = uuid.uuid5(uuid.NAMESPACE_URL, os.path.abspath(path))
+    started = time.perf_counter()
+    imported_this_run = 0
+
+    for batch in iter_batches(iter_jsonl_records(path, state["offset"]), batch_size):
+        entries, entry_ids = [], []
+        for line_start, _, record in batch:
+            entry = to_entry(record, prompt_field, actions_field)
+            if entry is None:
+                state["skipped"] += 1
+                continue
+            entries.append(entry)
+            entry_ids.append(uuid.uuid5(id_namespace, str(line_start)))
+
+        stored = cache.store_many(entries, entry_ids=entry_ids)
+        stored_count = sum(1 for entry_id in stored if entry_id is not None)
+        # store_many returns None for ids that were already stored as well as for failures; tell them apart
+        not_stored = [entry_id for entry_id, stored_id in zip(entry_ids, stored) if stored_id is None]
+        already_count = len(cache.existing_ids(not_stored)) if not_stored else 0
+        if entries and stored_count == 0 and already_count == 0:
+            print("Error: No entries from this batch could be stored. Stopping; rerun to resume from the last checkpoint.")
+            break
+        state["skipped"] += len(entries) - stored_count - already_count
+        state["already_imported"] += already_count
+        state["imported"] += stored_count
+        state["offset"] = batch[-1][1]
+        imported_this_run += stored_count
+        save_checkpoint(checkpoint_path, state)
+
+        elapsed = time.perf_counter() - started
+        rate = imported_this_run / elapsed if elapsed > 0 else 0.0
+        print(f"Imported {state['imported']} entries (already imported {state['already_imported']}, skipped {state['skipped']}), "
+              f"{100.0 * state['offset'] / max(total_bytes, 1):.1f}% of file, {rate:.0f} entries/s")
+
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="JSONL file with one record per line")
+    parser.add_argument("--prompt-field", default="prompt")
+    parser.add_argument("--actions-field", default="actions")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <path>.import_checkpoint)")
+    parser.add_argument("--persist-path", default=os.getenv("MEMORY_CACHE_PATH"), help="Persistent cache directory (default: $MEMORY_CACHE_PATH)")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION_NAME)
+    args = parser.parse_args()
+
+    if not args.persist_path:
+        parser.error("--persist-path (or MEMORY_CACHE_PATH) is required; an in-memory import would be lost on exit.")
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    cache = MemoryCache(persist_path=args.persist_path, collection_name=args.collection)
+    state = import_jsonl(cache, args.path, args.prompt_field, args.actions_field, args.batch_size, args.checkpoint)
+    print(f"Import finished: {state['imported']} entries imported, {state['already_imported']} already imported, {state['skipped']} skipped. "
+          f"Cache now holds {cache.count()} entries.")
+
+
+if __name__ == "__main__":
+    main()
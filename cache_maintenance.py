@@ -0,0 +1,174 @@
+"""
+Background maintenance for MemoryCache: capacity-bounded eviction, TTL expiry and compaction.
+
+MemoryCache keeps a small in-process stats record per entry (reward score, hit count, last use,
+estimated bytes, expiry time). Each tick of CacheMaintenanceWorker does a bounded amount of work:
+    - expiry: scans the next MAINTENANCE_SWEEP_BATCH entries of the current pass over the cache
+      and deletes the expired ones (lookups already skip them before the sweeper gets there);
+    - eviction: when over the max_entries or max_bytes budget (totals kept up to date by MemoryCache),
+      ranks a random sample of EVICTION_SAMPLE_SIZE entries by a blend of score, hits and recency
+      and deletes at most MAINTENANCE_MAX_EVICTIONS_PER_TICK of the lowest-valued, so a tick costs
+      the same at 1M entries as at 10k;
+    - compaction: once the backend reports more than COMPACTION_DELETED_FRACTION of its index
+      taken by deleted entries, or otherwise asks for a rebuild (IVF re-training), rebuilds it
+      from live entries (VectorBackend.compact()).
+"""
+from typing import Dict, List, Optional, TYPE_CHECKING
+import math
+import threading
+import time
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from memory_cache import MemoryCache
+
+MAINTENANCE_INTERVAL_S = 1.0 # Seconds between maintenance ticks
+MAINTENANCE_MAX_EVICTIONS_PER_TICK = 256 # Upper bound on capacity evictions per tick
+MAINTENANCE_SWEEP_BATCH = 1000 # Entries checked for expiry per tick
+COMPACTION_DELETED_FRACTION = 0.3 # Rebuild the vector index once this share of it is deleted entries
+EVICTION_SCORE_WEIGHT = 0.5 # Eviction value: reward score (0..1)...
+EVICTION_HITS_WEIGHT = 0.3 # ...plus log-scaled hit count relative to the most-hit entry...
+EVICTION_RECENCY_WEIGHT = 0.2 # ...plus recency of the last hit or store, decaying with...
+EVICTION_RECENCY_HALF_LIFE_S = 24 * 3600.0 # ...this half-life
+EVICTION_SAMPLE_SIZE = 4096 # Entries ranked per eviction tick (approximate lowest-value eviction)
+
+
+class EntryStats:
+    """What eviction needs to know about one entry, kept in memory so ranking never touches the backend."""
+    __slots__ = ("score", "hits", "last_used", "nbytes", "exact_keys", "expires_at")
+
+    def __init__(self, score: float, last_used: float, nbytes: int, exact_keys: List[str], hits: int = 0,
+                 expires_at: Optional[float] = None):
+        self.score = score
+        self.hits = hits
+        self.last_used = last_used
+        self.nbytes = nbytes
+        self.exact_keys = exact_keys # Exact-match keys of the prompt and its merged aliases
+        self.expires_at = expires_at # Epoch seconds; None never expires
+
+
+def eviction_values(stats: List[EntryStats], now: float, max_hits: Optional[int] = None) -> np.ndarray:
+    """Higher is more worth keeping. max_hits scales the hit term (default: the most-hit of stats)."""
+    scores = np.fromiter((s.score for s in stats), dtype=np.float64, count=len(stats))
+    hits = np.fromiter((s.hits for s in stats), dtype=np.float64, count=len(stats))
+    ages = np.fromiter((now - s.last_used for s in stats), dtype=np.float64, count=len(stats))
+    max_hits = max(max_hits or 0, hits.max()) if len(stats) else 0
+    hit_term = np.log1p(hits) / math.log1p(max_hits) if max_hits > 0 else np.zeros_like(hits)
+    recency_term = np.power(0.5, np.maximum(ages, 0.0) / EVICTION_RECENCY_HALF_LIFE_S)
+    return EVICTION_SCORE_WEIGHT * scores + EVICTION_HITS_WEIGHT * hit_term + EVICTION_RECENCY_WEIGHT * recency_term
+
+
+class CacheMaintenanceWorker:
+    """Daemon thread that runs run_once() every interval_s seconds until stop()."""
+
+    def __init__(self, cache: "MemoryCache", interval_s: float = MAINTENANCE_INTERVAL_S,
+                 max_evictions_per_tick: int = MAINTENANCE_MAX_EVICTIONS_PER_TICK,
+                 sweep_batch: int = MAINTENANCE_SWEEP_BATCH,
+                 compaction_threshold: Optional[float] = COMPACTION_DELETED_FRACTION,
+                 eviction_sample_size: int = EVICTION_SAMPLE_SIZE):
+        self._cache = cache
+        self.interval_s = interval_s
+        self.max_evictions_per_tick = max_evictions_per_tick
+        self.sweep_batch = sweep_batch
+        self.eviction_sample_size = eviction_sample_size
+        self.compaction_threshold = compaction_threshold # None disables compaction
+        self._sweep_ids: List[str] = [] # Entry ids of the current expiry pass
+        self._sweep_position = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._ticks = 0
+        self._evicted = 0
+        self._expired = 0
+        self._compactions = 0
+        self._last_tick_seconds = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="memory-cache-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error during cache maintenance: {e}") # Keep error
+
+    def run_once(self) -> Dict[str, int]:
+        """One bounded maintenance pass. Returns what it did."""
+        started = time.perf_counter()
+        if not self._cache._entry_index_ready.is_set():
+            # Eviction ranks and TTLs need the entry stats, and the start-up scan must not race a compaction
+            return {"expired": 0, "evicted": 0, "compacted": 0}
+        expired = self._sweep_expired()
+        evicted = self._evict_over_capacity()
+        compacted = self._compact_if_fragmented()
+        with self._lock:
+            self._ticks += 1
+            self._expired += expired
+            self._evicted += evicted
+            self._compactions += int(compacted)
+            self._last_tick_seconds = time.perf_counter() - started
+        return {"expired": expired, "evicted": evicted, "compacted": int(compacted)}
+
+    def _sweep_expired(self) -> int:
+        cache = self._cache
+        if self._sweep_position >= len(self._sweep_ids):
+            self._sweep_ids, _ = cache._entry_stats_snapshot()
+            self._sweep_position = 0
+        batch = self._sweep_ids[self._sweep_position:self._sweep_position + self.sweep_batch]
+        self._sweep_position += len(batch)
+
+        now = time.time()
+        expired = [entry_id_str for entry_id_str in batch if cache._is_expired(entry_id_str, now)]
+        cache._delete_entries(expired)
+        # print(f"DEBUG: TTL sweep removed {len(expired)} of {len(batch)} scanned entries.") # Reduced verbosity
+        return len(expired)
+
+    def _compact_if_fragmented(self) -> bool:
+        if self.compaction_threshold is None:
+            return False
+        backend = self._cache._backend
+        if not backend.needs_compaction(self.compaction_threshold):
+            return False
+        started = time.perf_counter()
+        compacted = backend.compact()
+        if compacted:
+            print(f"MemoryCache index compacted in {time.perf_counter() - started:.2f}s ({backend.count()} live entries).")
+        return compacted
+
+    def _evict_over_capacity(self) -> int:
+        cache = self._cache
+        if cache.max_entries is None and cache.max_bytes is None:
+            return 0
+        entries, total_bytes = cache._entry_totals()
+        excess_entries = entries - cache.max_entries if cache.max_entries is not None else 0
+        excess_bytes = total_bytes - cache.max_bytes if cache.max_bytes is not None else 0
+        if excess_entries <= 0 and excess_bytes <= 0:
+            return 0
+
+        # Evicting the lowest-valued of a random sample approximates evicting the lowest overall
+        entry_ids, stats = cache._sample_entry_stats(max(self.eviction_sample_size, self.max_evictions_per_tick))
+        order = np.argsort(eviction_values(stats, time.time(), cache._max_hits), kind="stable")
+        n_evict = max(excess_entries, 0)
+        if excess_bytes > 0:
+            freed = np.cumsum([stats[i].nbytes for i in order])
+            n_evict = max(n_evict, int(np.searchsorted(freed, excess_bytes)) + 1)
+        n_evict = min(n_evict, self.max_evictions_per_tick, len(order))
+
+        victims = [entry_ids[i] for i in order[:n_evict]]
+        cache._delete_entries(victims)
+        # print(f"DEBUG: Capacity eviction removed {len(victims)} entries.") # Reduced verbosity
+        return len(victims)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"ticks": self._ticks, "expired": self._expired, "evicted": self._evicted,
+                    "compactions": self._compactions, "last_tick_seconds": self._last_tick_seconds}
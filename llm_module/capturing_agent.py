@@ -1,10 +1,14 @@
-from typing import List, Dict, Tuple, Any, Optional, Type
+from typing import List, Dict, Tuple, Any, Optional, Type, TypedDict, Iterator, AsyncIterator
+import asyncio
+import json
 import re
+import threading
 
-from openai import OpenAI
-import numpy as np
+from openai import OpenAI, AsyncOpenAI
 
 from .llm import ChatLLM
+from .embeddings import EmbeddingService, get_embedding_service
+from .tool_index import ToolEmbeddingIndex
 from .tools.base import Tool as BaseTool
 from .agent import Agent
 
@@ -43,6 +47,42 @@ Tool Name: [A short, descriptive, CamelCase name for the tool, e.g., QueryDataba
 Tool Description: [A brief explanation of what the tool does and what its input should generally be]
 """
 
+# Prompt template for the single-call structured decision (tool choice, definition and input in one JSON answer)
+STRUCTURED_DECISION_PROMPT_TEMPLATE = """
+You are an AI assistant that controls a game through tools. The user's request is: "{user_prompt}"
+Available tools:
+{tool_descriptions}
+
+Decide how to handle the request and reply with a single JSON object, and nothing else:
+{{"decision": "use_existing" | "define_new" | "answer_directly",
+ "tool_name": "<for use_existing: one of the available tool names; for define_new: a short, descriptive, CamelCase name>",
+ "tool_description": "<for define_new only: a brief explanation of what the tool does and what its input should generally be>",
+ "tool_input": "<for use_existing and define_new: the precise, concise input string for the tool>",
+ "answer": "<for answer_directly only: a helpful and direct answer to the request>"}}
+Use "define_new" only when no available tool fits and a new tool would be useful for similar future requests.
+Use "answer_directly" when the request is a question that no tool is needed for."""
+
+STRUCTURED_DECISIONS = ("use_existing", "define_new", "answer_directly")
+_TOOL_NAME_RE = re.compile(r"[A-Za-z][A-Za-z0-9_]*")
+
+class StructuredDecision(TypedDict):
+    decision: str # One of STRUCTURED_DECISIONS
+    tool_name: str
+    tool_description: str
+    tool_input: str
+    answer: str
+
+class AgentEvent(TypedDict, total=False):
+    """A step reported by run_stream()/arun_stream(); which keys are set depends on event."""
+    event: str # "tool_defined", "tool_chosen", "tool_input", "observation", "answer_delta" or "done"
+    tool_name: str
+    tool_input: str
+    observation: str
+    similarity_score: str
+    text: str # answer_delta: the next piece of a direct answer
+    final_answer: str # done: the effective answer, as returned by run()
+    history: List[Dict[str, str]] # done: the step history, as returned by run()
+
 # Default agent prompt (less critical now, for fallback)
 DEFAULT_AGENT_PROMPT_TEMPLATE = """
 Today is {today_date}.
@@ -56,42 +96,47 @@ class CapturingAgent(Agent):
     """
     An agent that captures the history of tool calls (name, input, observation)
     during its run.
+
+    With structured_decision=True, a prompt that matches no tool costs one LLM call returning JSON
+    (use an existing tool / define a new one / answer directly, plus the tool input) instead of
+    separate definition, input and direct-answer calls. Responses that fail validation fall back
+    to the multi-call flow.
     """
-    
-    def __init__(self, llm: ChatLLM, tools: List[BaseTool], prompt_template: str = DEFAULT_AGENT_PROMPT_TEMPLATE, **kwargs: Any):
+    structured_decision: bool = False
+
+    def __init__(self, llm: ChatLLM, tools: List[BaseTool], prompt_template: str = DEFAULT_AGENT_PROMPT_TEMPLATE,
+                 embedding_service: Optional[EmbeddingService] = None, client: Optional[OpenAI] = None,
+                 async_client: Optional[AsyncOpenAI] = None, **kwargs: Any):
+        """client / async_client: OpenAI clients for tool embeddings when no embedding_service is given
+        (a private EmbeddingService is built around them); default is the shared pooled service."""
         super().__init__(llm=llm, tools=tools, prompt_template=prompt_template, **kwargs)
-        self._openai_client = OpenAI()
+        # Shared with MemoryCache so a prompt embedded for the cache lookup is not re-embedded here
+        if embedding_service is None and (client is not None or async_client is not None):
+            embedding_service = EmbeddingService(client=client, async_client=async_client)
+        self._embedder = embedding_service if embedding_service is not None else get_embedding_service()
+        self._tool_index = ToolEmbeddingIndex() # float32 matrix of all tool embeddings for one-matmul matching
+        # Concurrent misses (service threads, arun's to_thread) may define the same tool; name check and append go together
+        self._tool_registration_lock = threading.Lock()
         self._initialize_tool_primary_embeddings()
 
     def _generate_embedding(self, text: str) -> Optional[List[float]]:
-        """Helper function to generate embedding using OpenAI."""
-        try:
-            response = self._openai_client.embeddings.create(
-                input=text,
-                model=OPENAI_EMBEDDING_MODEL_FOR_TOOLS
-            )
-            return response.data[0].embedding
-        except Exception as e:
-            print(f"Error generating OpenAI embedding for text '{text}': {e}")
-            return None
-
-    def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Calculate cosine similarity between two L2-normalized vectors."""
-        return np.dot(np.array(vec1), np.array(vec2))
+        """Helper function to generate embedding using OpenAI (memoized by the embedding service)."""
+        return self._embedder.embed(text, model=OPENAI_EMBEDDING_MODEL_FOR_TOOLS)
 
     def _initialize_tool_primary_embeddings(self, specific_tool: Optional[BaseTool] = None):
-        """Generates and stores the primary embedding on tool instances."""
+        """Generates and stores the primary embedding on tool instances (one batched API request)."""
         tools_to_process = [specific_tool] if specific_tool else self.tools
+        tools_to_process = [tool_instance for tool_instance in tools_to_process if tool_instance is not None]
         # print(f"Initializing primary embeddings for {'specific tool' if specific_tool else str(len(tools_to_process)) + ' tools'}...")
-        for tool_instance in tools_to_process:
-            if tool_instance is None: continue
-            text_to_embed = f"Tool: {tool_instance.name}, Description: {tool_instance.description}"
-            embedding = self._generate_embedding(text_to_embed)
+        texts_to_embed = [f"Tool: {tool_instance.name}, Description: {tool_instance.description}" for tool_instance in tools_to_process]
+        embeddings = self._embedder.embed_many(texts_to_embed, model=OPENAI_EMBEDDING_MODEL_FOR_TOOLS)
+        for tool_instance, embedding in zip(tools_to_process, embeddings):
             if embedding:
                 tool_instance.primary_embedding = embedding
                 # print(f"  Initialized primary embedding for tool: {tool_instance.name}")
             else:
                 print(f"  Failed to generate primary embedding for tool: {tool_instance.name}")
+            self._tool_index.set_tool_embeddings(tool_instance.name, tool_instance.get_all_embeddings())
         # print("Tool primary embeddings initialization complete.")
 
     def _find_best_tool_by_similarity(self, user_prompt: str, exclude_tool_names: Optional[List[str]] = None) -> Optional[Tuple[BaseTool, float]]:
@@ -100,48 +145,31 @@ class CapturingAgent(Agent):
         if not prompt_embedding:
             print("Error: Could not generate embedding for user prompt.")
             return None
+        return self._find_best_tool_by_embedding(prompt_embedding, exclude_tool_names=exclude_tool_names)
 
-        best_tool_match: Optional[BaseTool] = None
-        highest_overall_similarity: float = -1.0
-        exclude_tool_names_set = set(exclude_tool_names) if exclude_tool_names else set()
-
+    def _find_best_tool_by_embedding(self, prompt_embedding: List[float], exclude_tool_names: Optional[List[str]] = None) -> Optional[Tuple[BaseTool, float]]:
+        """Scores every tool embedding against the prompt in one pass over the tool index."""
         if not self.tools:
             # print("Warning: No tools available for similarity search.")
-            return None # Added return here
-            
-        for tool_instance in self.tools:
-            if tool_instance.name in exclude_tool_names_set:
-                # print(f"Skipping tool '{tool_instance.name}' due to exclusion list.")
-                continue
-
-            tool_specific_max_similarity = -1.0
-            all_tool_embeddings = tool_instance.get_all_embeddings()
-            if not all_tool_embeddings:
-                # print(f"Warning: Tool '{tool_instance.name}' has no embeddings to compare.")
-                continue
-
-            for tool_emb in all_tool_embeddings:
-                similarity = self._cosine_similarity(prompt_embedding, tool_emb)
-                if similarity > tool_specific_max_similarity:
-                    tool_specific_max_similarity = similarity
-            
-            # print(f"  Tool '{tool_instance.name}', Max Similarity for this tool: {tool_specific_max_similarity:.4f}")
-            if tool_specific_max_similarity > highest_overall_similarity:
-                highest_overall_similarity = tool_specific_max_similarity
-                best_tool_match = tool_instance
-        
+            return None
+
+        index_match = self._tool_index.best_match(prompt_embedding, exclude_tool_names=exclude_tool_names)
+        if index_match is None:
+            # print(f"No existing tool met threshold ({TOOL_SIMILARITY_THRESHOLD}) (exclusions: {exclude_tool_names}). No tools to compare or embeddings failed.")
+            return None
+        best_tool_name, highest_overall_similarity = index_match
+        best_tool_match = self._find_tool(best_tool_name)
+
         if best_tool_match and highest_overall_similarity >= TOOL_SIMILARITY_THRESHOLD:
             # print(f"Best tool match (considering exclusions): '{best_tool_match.name}' with overall similarity: {highest_overall_similarity:.4f}")
             return best_tool_match, highest_overall_similarity
         else:
             if best_tool_match: 
                  print(f"No existing tool met threshold ({TOOL_SIMILARITY_THRESHOLD}) (exclusions: {exclude_tool_names}). Best was '{best_tool_match.name}' ({highest_overall_similarity:.4f}).")
-            # else: 
-                 # print(f"No existing tool met threshold ({TOOL_SIMILARITY_THRESHOLD}) (exclusions: {exclude_tool_names}). No tools to compare or embeddings failed.")
             return None
 
     def _create_and_register_new_tool(self, llm_defined_name: str, llm_defined_description: str) -> Optional[BaseTool]:
-        """Dynamically creates a new tool class and instance, and registers it."""
+        """Dynamically creates a new tool class and instance, and registers it. Caller holds _tool_registration_lock."""
         tool_name = llm_defined_name
         tool_description = llm_defined_description
 
@@ -179,85 +207,165 @@ class CapturingAgent(Agent):
 
         prompt_embedding = self._generate_embedding(user_prompt_text)
         if prompt_embedding:
-            target_tool.add_representative_prompt_embedding(prompt_embedding)
+            prototype_count = len(target_tool.additional_prompt_embeddings)
+            if target_tool.add_representative_prompt_embedding(prompt_embedding):
+                if len(target_tool.additional_prompt_embeddings) > prototype_count:
+                    self._tool_index.add_embedding(target_tool.name, prompt_embedding)
+                else: # Prototypes were merged at the cap; re-sync this tool's (bounded) rows
+                    self._tool_index.set_tool_embeddings(target_tool.name, target_tool.get_all_embeddings())
             # print(f"Upvote feedback processed for tool '{tool_name}'. Prompt embedding added.")
         # else:
             # print(f"Error recording feedback: Could not generate embedding for prompt '{user_prompt_text}'.")
 
-    def run(self, input_str: str, agent_scratchpad_content: str = "", exclude_tool_names: Optional[List[str]] = None) -> Tuple[str, List[Dict[str, str]]]:
-        history: List[Dict[str, str]] = []
-        final_answer: str = "Error: Agent did not produce a final answer."
-
-        tool_match_result = self._find_best_tool_by_similarity(input_str, exclude_tool_names=exclude_tool_names)
+    def _register_tool_from_definition(self, llm_tool_definition_str: str, input_str: str, history: List[Dict[str, str]]) -> Optional[BaseTool]:
+        """Parses the LLM's 'Tool Name:/Tool Description:' answer and registers the new tool if it is valid and unique."""
         selected_tool: Optional[BaseTool] = None
-        similarity_score: float = 0.0
-
-        if tool_match_result:
-            selected_tool, similarity_score = tool_match_result
-        else: # No suitable existing tool found (considering exclusions)
-            print(f"No suitable existing tool found for prompt: '{input_str}' (exclusions: {exclude_tool_names}). Attempting to define a new tool.")
-            new_tool_def_prompt = NEW_TOOL_DEFINITION_PROMPT_TEMPLATE.format(user_prompt=input_str)
-            llm_tool_definition_str = self.llm.generate(new_tool_def_prompt).strip()
-            
-            parsed_name, parsed_desc = None, None
-            name_match = re.search(r"Tool Name:\s*(.*?)(?:\n|$)", llm_tool_definition_str, re.IGNORECASE)
-            desc_match = re.search(r"Tool Description:\s*(.*?)(?:\n|$)", llm_tool_definition_str, re.IGNORECASE)
-
-            if name_match and desc_match:
-                parsed_name = name_match.group(1).strip()
-                parsed_desc = desc_match.group(1).strip()
-                if parsed_name and parsed_desc and parsed_name not in [t.name for t in self.tools]:
-                    print(f"LLM defined new tool - Name: '{parsed_name}', Desc: '{parsed_desc}'")
-                    selected_tool = self._create_and_register_new_tool(parsed_name, parsed_desc)
-                    if selected_tool:
-                        similarity_score = 1.0 
-                        history.append({
-                            "tool_name": "ToolDefinitionAgent", "tool_input": input_str,
-                            "observation": f"Defined and registered new tool: {selected_tool.name} - {selected_tool.description}",
-                            "similarity_score": "N/A (Tool dynamically created)",
-                            "original_user_prompt_for_feedback": input_str
-                        })
-                    else: print("Failed to instantiate or register the new dynamic tool.")
-                elif parsed_name in [t.name for t in self.tools]:
-                    print(f"LLM tried to define a tool '{parsed_name}' which already exists. Skipping creation.")
-                else: print(f"LLM failed to provide valid name/description. Response: {llm_tool_definition_str}")        
-            else: print(f"LLM output for new tool definition did not match expected format. Response: {llm_tool_definition_str}")
-
-        if selected_tool: # This can be an existing tool or a newly created one
-            tool_input_prompt_formatted = TOOL_INPUT_GENERATION_PROMPT_TEMPLATE.format(
-                user_prompt=input_str,
-                tool_name=selected_tool.name,
-                tool_description=selected_tool.description
-            )
-            tool_input_str = self.llm.generate(tool_input_prompt_formatted).strip()
-
-            if "error" in tool_input_str.lower() and len(tool_input_str) > 100: # Heuristic
-                final_answer_prompt = DIRECT_ANSWER_PROMPT_TEMPLATE.format(user_prompt=input_str)
-                final_answer = self.llm.generate(final_answer_prompt).strip()
-                history.append({
-                    "tool_name": "DirectAnswer", "tool_input": input_str, "observation": final_answer,
-                    "similarity_score": "N/A (Fallback from tool input gen error)",
-                    "original_user_prompt_for_feedback": input_str
-                })
-            else:
-                observation = selected_tool(tool_input_str)
-                history.append({
-                    "tool_name": selected_tool.name, "tool_input": tool_input_str, "observation": observation,
-                    "similarity_score": f"{similarity_score:.4f}",
-                    "original_user_prompt_for_feedback": input_str
-                })
-                final_answer = f"Executed {selected_tool.name}. See observation."
-        else:
-            # Fallback: No tool found or created, generate direct answer
-            print(f"Failed to find or create a suitable tool for: '{input_str}' (exclusions: {exclude_tool_names}). Generating direct answer.")
-            direct_answer_prompt_formatted = DIRECT_ANSWER_PROMPT_TEMPLATE.format(user_prompt=input_str)
-            final_answer = self.llm.generate(direct_answer_prompt_formatted).strip()
+        parsed_name, parsed_desc = None, None
+        name_match = re.search(r"Tool Name:\s*(.*?)(?:\n|$)", llm_tool_definition_str, re.IGNORECASE)
+        desc_match = re.search(r"Tool Description:\s*(.*?)(?:\n|$)", llm_tool_definition_str, re.IGNORECASE)
+
+        if name_match and desc_match:
+            parsed_name = name_match.group(1).strip()
+            parsed_desc = desc_match.group(1).strip()
+            if parsed_name and parsed_desc and parsed_name not in [t.name for t in self.tools]:
+                print(f"LLM defined new tool - Name: '{parsed_name}', Desc: '{parsed_desc}'")
+                selected_tool = self._register_defined_tool(parsed_name, parsed_desc, input_str, history)
+            elif parsed_name in [t.name for t in self.tools]:
+                print(f"LLM tried to define a tool '{parsed_name}' which already exists. Skipping creation.")
+            else: print(f"LLM failed to provide valid name/description. Response: {llm_tool_definition_str}")        
+        else: print(f"LLM output for new tool definition did not match expected format. Response: {llm_tool_definition_str}")
+        return selected_tool
+
+    def _register_defined_tool(self, tool_name: str, tool_description: str, input_str: str, history: List[Dict[str, str]]) -> Optional[BaseTool]:
+        """
+        Creates and registers an LLM-defined tool and records the definition step in history. Returns
+        None if the tool could not be created or a tool with that name exists (e.g. another request
+        registered it first).
+        """
+        with self._tool_registration_lock:
+            if self._find_tool(tool_name) is not None:
+                print(f"LLM tried to define a tool '{tool_name}' which already exists. Skipping creation.")
+                return None
+            selected_tool = self._create_and_register_new_tool(tool_name, tool_description)
+        if selected_tool:
             history.append({
-                "tool_name": "DirectAnswer", "tool_input": input_str, "observation": final_answer,
-                "similarity_score": "N/A (No tool selected/created)",
+                "tool_name": "ToolDefinitionAgent", "tool_input": input_str,
+                "observation": f"Defined and registered new tool: {selected_tool.name} - {selected_tool.description}",
+                "similarity_score": "N/A (Tool dynamically created)",
                 "original_user_prompt_for_feedback": input_str
             })
-        
+        else: print("Failed to instantiate or register the new dynamic tool.")
+        return selected_tool
+
+    def _structured_decision_prompt(self, input_str: str, exclude_tool_names: Optional[List[str]] = None) -> str:
+        excluded = set(exclude_tool_names or [])
+        tool_descriptions = "\n".join(f"- {tool.name}: {tool.description}" for tool in self.tools if tool.name not in excluded)
+        return STRUCTURED_DECISION_PROMPT_TEMPLATE.format(user_prompt=input_str, tool_descriptions=tool_descriptions or "(none)")
+
+    def _parse_structured_decision(self, response: str, exclude_tool_names: Optional[List[str]] = None) -> Optional[StructuredDecision]:
+        """Validates the JSON decision; None means the caller should use the multi-call flow."""
+        start, end = response.find("{"), response.rfind("}")
+        if start == -1 or end < start:
+            print(f"Structured decision was not JSON, using multi-call flow. Response: {response}")
+            return None
+        try:
+            data = json.loads(response[start:end + 1])
+        except json.JSONDecodeError:
+            print(f"Structured decision was not valid JSON, using multi-call flow. Response: {response}")
+            return None
+        if not isinstance(data, dict):
+            return None
+        fields = {key: data.get(key) if isinstance(data.get(key), str) else "" for key in StructuredDecision.__annotations__}
+        decision = StructuredDecision(**{key: value.strip() for key, value in fields.items()})
+
+        excluded = set(exclude_tool_names or [])
+        existing_tool = self._find_tool(decision["tool_name"]) if decision["tool_name"] else None
+        if decision["decision"] == "define_new" and existing_tool is not None:
+            decision["decision"] = "use_existing" # "New" tool that already exists: just use it
+        if decision["decision"] == "answer_directly":
+            valid = bool(decision["answer"])
+        elif decision["decision"] == "use_existing":
+            valid = existing_tool is not None and existing_tool.name not in excluded and bool(decision["tool_input"])
+        elif decision["decision"] == "define_new":
+            valid = (bool(_TOOL_NAME_RE.fullmatch(decision["tool_name"])) and bool(decision["tool_description"])
+                     and bool(decision["tool_input"]))
+        else:
+            valid = False
+        if not valid or (decision["tool_input"] and self._is_tool_input_error(decision["tool_input"])):
+            print(f"Structured decision failed validation, using multi-call flow. Response: {response}")
+            return None
+        return decision
+
+    def _apply_structured_decision(self, input_str: str, decision: StructuredDecision, history: List[Dict[str, str]]) -> Optional[str]:
+        """Carries out a validated decision and returns the final answer (None if a new tool could not be registered)."""
+        if decision["decision"] == "answer_directly":
+            history.append(self._direct_answer_step(input_str, decision["answer"], "N/A (Structured decision: direct answer)"))
+            return decision["answer"]
+        if decision["decision"] == "define_new":
+            print(f"LLM defined new tool - Name: '{decision['tool_name']}', Desc: '{decision['tool_description']}'")
+            selected_tool = self._register_defined_tool(decision["tool_name"], decision["tool_description"], input_str, history)
+            similarity_note = None
+            similarity_score = 1.0
+            if not selected_tool:
+                selected_tool = self._find_tool(decision["tool_name"]) # Registered meanwhile by a concurrent request
+                if not selected_tool:
+                    return None
+                similarity_note = "N/A (Structured decision: existing tool)"
+                similarity_score = 0.0
+        else:
+            selected_tool = self._find_tool(decision["tool_name"])
+            similarity_note = "N/A (Structured decision: existing tool)" # Below the embedding threshold, chosen by the LLM
+            similarity_score = 0.0
+        history.append(self._execute_tool_step(input_str, selected_tool, decision["tool_input"], similarity_score, similarity_note))
+        return f"Executed {selected_tool.name}. See observation."
+
+    @staticmethod
+    def _history_events(steps: List[Dict[str, str]]) -> List[AgentEvent]:
+        """Events for steps that were completed in one go (tool definition, structured decisions)."""
+        events: List[AgentEvent] = []
+        for step in steps:
+            if step["tool_name"] == "ToolDefinitionAgent":
+                events.append(AgentEvent(event="tool_defined", tool_name=step["tool_name"], observation=step["observation"]))
+            elif step["tool_name"] == "DirectAnswer":
+                events.append(AgentEvent(event="answer_delta", text=step["observation"]))
+            else:
+                events.append(AgentEvent(event="tool_chosen", tool_name=step["tool_name"], similarity_score=step["similarity_score"]))
+                events.append(AgentEvent(event="tool_input", tool_name=step["tool_name"], tool_input=step["tool_input"]))
+                events.append(AgentEvent(event="observation", tool_name=step["tool_name"], observation=step["observation"]))
+        return events
+
+    @staticmethod
+    def _tool_input_prompt(input_str: str, selected_tool: BaseTool) -> str:
+        return TOOL_INPUT_GENERATION_PROMPT_TEMPLATE.format(
+            user_prompt=input_str,
+            tool_name=selected_tool.name,
+            tool_description=selected_tool.description
+        )
+
+    @staticmethod
+    def _is_tool_input_error(tool_input_str: str) -> bool:
+        return "error" in tool_input_str.lower() and len(tool_input_str) > 100 # Heuristic
+
+    @staticmethod
+    def _direct_answer_step(input_str: str, answer: str, similarity_note: str) -> Dict[str, str]:
+        return {
+            "tool_name": "DirectAnswer", "tool_input": input_str, "observation": answer,
+            "similarity_score": similarity_note,
+            "original_user_prompt_for_feedback": input_str
+        }
+
+    @staticmethod
+    def _execute_tool_step(input_str: str, selected_tool: BaseTool, tool_input_str: str, similarity_score: float,
+                           similarity_note: Optional[str] = None) -> Dict[str, str]:
+        observation = selected_tool(tool_input_str)
+        return {
+            "tool_name": selected_tool.name, "tool_input": tool_input_str, "observation": observation,
+            "similarity_score": similarity_note if similarity_note is not None else f"{similarity_score:.4f}",
+            "original_user_prompt_for_feedback": input_str
+        }
+
+    @staticmethod
+    def _effective_answer(final_answer: str, history: List[Dict[str, str]]) -> str:
         effective_answer = final_answer # Default to final_answer
         if history and "observation" in history[-1]:
             # This logic attempts to make the 'effective_answer' more descriptive
@@ -274,9 +382,166 @@ class CapturingAgent(Agent):
             # The actual execution of the new tool would be in a subsequent history entry if this `run` call included that.
             # For now, if the very last thing was ToolDef, the `final_answer` might be the best we have from this specific `run` call.
             # The test script handles iterative calls, so a subsequent call would use the new tool.
+        return effective_answer
+
+    def run(self, input_str: str, agent_scratchpad_content: str = "", exclude_tool_names: Optional[List[str]] = None) -> Tuple[str, List[Dict[str, str]]]:
+        """Runs run_stream() to its "done" event and returns the effective answer and the step history."""
+        for event in self.run_stream(input_str, agent_scratchpad_content, exclude_tool_names):
+            pass
+        return event["final_answer"], event["history"]
+
+    async def arun(self, input_str: str, agent_scratchpad_content: str = "", exclude_tool_names: Optional[List[str]] = None,
+                   prompt_embedding: Optional[List[float]] = None,
+                   speculative_tool_input: Optional[Tuple[str, "asyncio.Task[str]"]] = None) -> Tuple[str, List[Dict[str, str]]]:
+        """Async counterpart of run(): drains arun_stream(), which takes the same arguments."""
+        async for event in self.arun_stream(input_str, agent_scratchpad_content, exclude_tool_names,
+                                            prompt_embedding=prompt_embedding, speculative_tool_input=speculative_tool_input):
+            pass
+        return event["final_answer"], event["history"]
+
+    def run_stream(self, input_str: str, agent_scratchpad_content: str = "", exclude_tool_names: Optional[List[str]] = None) -> Iterator[AgentEvent]:
+        """
+        Streaming counterpart of run(): same steps, yielded as AgentEvents while they happen, with
+        direct answers streamed token by token. The last event is "done" with run()'s results.
+        """
+        history: List[Dict[str, str]] = []
+        final_answer: str = "Error: Agent did not produce a final answer."
+
+        tool_match_result = self._find_best_tool_by_similarity(input_str, exclude_tool_names=exclude_tool_names)
+        selected_tool: Optional[BaseTool] = None
+        similarity_score: float = 0.0
+
+        if tool_match_result:
+            selected_tool, similarity_score = tool_match_result
+        else: # No suitable existing tool found (considering exclusions)
+            print(f"No suitable existing tool found for prompt: '{input_str}' (exclusions: {exclude_tool_names}). Attempting to define a new tool.")
+            if self.structured_decision:
+                decision = self._parse_structured_decision(
+                    self.llm.generate(self._structured_decision_prompt(input_str, exclude_tool_names)), exclude_tool_names)
+                if decision is not None:
+                    structured_answer = self._apply_structured_decision(input_str, decision, history)
+                    if structured_answer is not None:
+                        yield from self._history_events(history)
+                        yield AgentEvent(event="done", final_answer=self._effective_answer(structured_answer, history), history=history)
+                        return
+            new_tool_def_prompt = NEW_TOOL_DEFINITION_PROMPT_TEMPLATE.format(user_prompt=input_str)
+            llm_tool_definition_str = self.llm.generate(new_tool_def_prompt).strip()
+            selected_tool = self._register_tool_from_definition(llm_tool_definition_str, input_str, history)
+            if selected_tool:
+                similarity_score = 1.0
+                yield from self._history_events(history)
+
+        if selected_tool: # This can be an existing tool or a newly created one
+            yield AgentEvent(event="tool_chosen", tool_name=selected_tool.name, similarity_score=f"{similarity_score:.4f}")
+            tool_input_str = self.llm.generate(self._tool_input_prompt(input_str, selected_tool)).strip()
+
+            if self._is_tool_input_error(tool_input_str):
+                answer_prompt, similarity_note = DIRECT_ANSWER_PROMPT_TEMPLATE.format(user_prompt=input_str), "N/A (Fallback from tool input gen error)"
+            else:
+                yield AgentEvent(event="tool_input", tool_name=selected_tool.name, tool_input=tool_input_str)
+                step = self._execute_tool_step(input_str, selected_tool, tool_input_str, similarity_score)
+                history.append(step)
+                yield AgentEvent(event="observation", tool_name=selected_tool.name, observation=step["observation"])
+                final_answer = f"Executed {selected_tool.name}. See observation."
+                answer_prompt = None
+        else:
+            print(f"Failed to find or create a suitable tool for: '{input_str}' (exclusions: {exclude_tool_names}). Generating direct answer.")
+            answer_prompt, similarity_note = DIRECT_ANSWER_PROMPT_TEMPLATE.format(user_prompt=input_str), "N/A (No tool selected/created)"
+
+        if answer_prompt is not None:
+            answer_parts: List[str] = []
+            for delta in self.llm.generate_stream(answer_prompt):
+                answer_parts.append(delta)
+                yield AgentEvent(event="answer_delta", text=delta)
+            final_answer = "".join(answer_parts).strip()
+            history.append(self._direct_answer_step(input_str, final_answer, similarity_note))
+
+        yield AgentEvent(event="done", final_answer=self._effective_answer(final_answer, history), history=history)
+
+    async def arun_stream(self, input_str: str, agent_scratchpad_content: str = "", exclude_tool_names: Optional[List[str]] = None,
+                          prompt_embedding: Optional[List[float]] = None,
+                          speculative_tool_input: Optional[Tuple[str, "asyncio.Task[str]"]] = None) -> AsyncIterator[AgentEvent]:
+        """
+        Async counterpart of run_stream(), with LLM and embedding calls awaited. prompt_embedding
+        skips re-embedding the prompt. speculative_tool_input is a (tool name, task) pair whose task
+        is already generating the tool input; it is used if that tool is selected and cancelled
+        otherwise (see request_pipeline.RequestPipeline).
+        """
+        history: List[Dict[str, str]] = []
+        final_answer: str = "Error: Agent did not produce a final answer."
+
+        tool_match_result = None
+        if prompt_embedding is None:
+            prompt_embedding = await self._embedder.aembed(input_str, model=OPENAI_EMBEDDING_MODEL_FOR_TOOLS)
+        if prompt_embedding:
+            tool_match_result = self._find_best_tool_by_embedding(prompt_embedding, exclude_tool_names=exclude_tool_names)
+        else:
+            print("Error: Could not generate embedding for user prompt.")
+        selected_tool: Optional[BaseTool] = None
+        similarity_score: float = 0.0
+
+        if tool_match_result:
+            selected_tool, similarity_score = tool_match_result
+        else: # No suitable existing tool found (considering exclusions)
+            print(f"No suitable existing tool found for prompt: '{input_str}' (exclusions: {exclude_tool_names}). Attempting to define a new tool.")
+            if self.structured_decision:
+                decision = self._parse_structured_decision(
+                    await self.llm.agenerate(self._structured_decision_prompt(input_str, exclude_tool_names)), exclude_tool_names)
+                if decision is not None:
+                    if speculative_tool_input:
+                        speculative_tool_input[1].cancel() # The decision carries its own tool input
+                        speculative_tool_input = None
+                    if decision["decision"] == "define_new": # Registration embeds the description; keep it off the event loop
+                        structured_answer = await asyncio.to_thread(self._apply_structured_decision, input_str, decision, history)
+                    else:
+                        structured_answer = self._apply_structured_decision(input_str, decision, history)
+                    if structured_answer is not None:
+                        for event in self._history_events(history):
+                            yield event
+                        yield AgentEvent(event="done", final_answer=self._effective_answer(structured_answer, history), history=history)
+                        return
+            new_tool_def_prompt = NEW_TOOL_DEFINITION_PROMPT_TEMPLATE.format(user_prompt=input_str)
+            llm_tool_definition_str = (await self.llm.agenerate(new_tool_def_prompt)).strip()
+            # Registration embeds the new tool's description (rare path); keep it off the event loop
+            selected_tool = await asyncio.to_thread(self._register_tool_from_definition, llm_tool_definition_str, input_str, history)
+            if selected_tool:
+                similarity_score = 1.0
+                for event in self._history_events(history):
+                    yield event
+
+        if speculative_tool_input and (not selected_tool or speculative_tool_input[0] != selected_tool.name):
+            speculative_tool_input[1].cancel()
+            speculative_tool_input = None
+
+        if selected_tool:
+            yield AgentEvent(event="tool_chosen", tool_name=selected_tool.name, similarity_score=f"{similarity_score:.4f}")
+            if speculative_tool_input:
+                tool_input_str = (await speculative_tool_input[1]).strip()
+            else:
+                tool_input_str = (await self.llm.agenerate(self._tool_input_prompt(input_str, selected_tool))).strip()
+
+            if self._is_tool_input_error(tool_input_str):
+                answer_prompt, similarity_note = DIRECT_ANSWER_PROMPT_TEMPLATE.format(user_prompt=input_str), "N/A (Fallback from tool input gen error)"
+            else:
+                yield AgentEvent(event="tool_input", tool_name=selected_tool.name, tool_input=tool_input_str)
+                step = self._execute_tool_step(input_str, selected_tool, tool_input_str, similarity_score)
+                history.append(step)
+                yield AgentEvent(event="observation", tool_name=selected_tool.name, observation=step["observation"])
+                final_answer = f"Executed {selected_tool.name}. See observation."
+                answer_prompt = None
+        else:
+            print(f"Failed to find or create a suitable tool for: '{input_str}' (exclusions: {exclude_tool_names}). Generating direct answer.")
+            answer_prompt, similarity_note = DIRECT_ANSWER_PROMPT_TEMPLATE.format(user_prompt=input_str), "N/A (No tool selected/created)"
 
-        return effective_answer, history
+        if answer_prompt is not None:
+            answer_parts: List[str] = []
+            async for delta in self.llm.agenerate_stream(answer_prompt):
+                answer_parts.append(delta)
+                yield AgentEvent(event="answer_delta", text=delta)
+            final_answer = "".join(answer_parts).strip()
+            history.append(self._direct_answer_step(input_str, final_answer, similarity_note))
 
+        yield AgentEvent(event="done", final_answer=self._effective_answer(final_answer, history), history=history)
 
 if __name__ == '__main__':
     from dotenv import load_dotenv
@@ -0,0 +1,126 @@
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# Configuration Constants
+COMPLETION_CACHE_MAX_ENTRIES = 4096 # In-process LRU size
+COMPLETION_CACHE_PATH_ENV_VAR = "LLM_COMPLETION_CACHE_PATH" # Optional sqlite file for the shared cache
+
+CachedCompletion = Tuple[str, float] # (response text, seconds the API call took)
+
+
+class CompletionCache:
+    """
+    Memo of deterministic ChatLLM completions, keyed by (model, temperature, prompt, stop).
+
+    Same two tiers as EmbeddingService: a bounded in-process LRU and, if persist_path is given,
+    a sqlite file so answers survive restarts. Only temperature-0 calls are cached (ChatLLM
+    bypasses the cache otherwise) and "Error:" responses are never stored. Each entry remembers
+    how long its API call took, so stats() can report the LLM time the hits saved.
+    """
+
+    def __init__(self, max_entries: int = COMPLETION_CACHE_MAX_ENTRIES, persist_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[str, CachedCompletion]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._db: Optional[sqlite3.Connection] = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, api_seconds REAL NOT NULL)"
+            )
+            self._db.commit()
+
+        # Counters exposed through stats()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._bypassed = 0
+        self._saved_seconds = 0.0
+
+    @staticmethod
+    def key(model: str, temperature: float, prompt: str, stop: Optional[List[str]]) -> str:
+        return hashlib.sha256(json.dumps([model, temperature, prompt, stop]).encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, entry: CachedCompletion):
+        """Inserts into the LRU, evicting the least recently used entry if full. Caller holds the lock."""
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """Checks the memory tier, then the disk tier. Counts a miss when neither has the key."""
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+                self._memory_hits += 1
+            elif self._db is not None:
+                row = self._db.execute("SELECT response, api_seconds FROM completions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], row[1])
+                    self._remember(key, entry)
+                    self._disk_hits += 1
+            if entry is None:
+                self._misses += 1
+                return None
+            self._saved_seconds += entry[1]
+            return entry[0]
+
+    def put(self, key: str, response: str, api_seconds: float):
+        if response.startswith("Error:"):
+            return # Transient failures must not be replayed
+        with self._lock:
+            self._remember(key, (response, api_seconds))
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO completions (key, response, api_seconds) VALUES (?, ?, ?)",
+                                     (key, response, api_seconds))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"Warning: Could not persist completion to disk cache: {e}")
+
+    def record_bypass(self):
+        with self._lock:
+            self._bypassed += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and the API seconds the hits would have cost."""
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            lookups = hits + self._misses
+            return {
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "bypassed": self._bypassed,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "saved_seconds": self._saved_seconds,
+                "cached_entries": len(self._lru),
+            }
+
+    def clear(self):
+        """Drops the in-process LRU (the disk tier is left untouched)."""
+        with self._lock:
+            self._lru.clear()
+
+
+_shared_cache: Optional[CompletionCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> CompletionCache:
+    """Returns the process-wide CompletionCache, creating it on first use."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = CompletionCache(persist_path=os.getenv(COMPLETION_CACHE_PATH_ENV_VAR))
+        return _shared_cache
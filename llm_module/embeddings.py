@@ -0,0 +1,381 @@
+from typing import List, Optional, Dict, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future
+from array import array
+import asyncio
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from openai import OpenAI, AsyncOpenAI
+
+from .openai_client import get_openai_client, get_async_openai_client, EMBEDDING_REQUEST_TIMEOUT
+
+# Configuration Constants
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_MAX_ENTRIES = 10000 # In-process LRU size (one ~6KB vector per entry)
+EMBEDDING_CACHE_PATH_ENV_VAR = "EMBEDDING_CACHE_PATH" # Optional sqlite file for the shared service
+EMBEDDING_BATCH_SIZE = 256 # Max texts per embeddings.create request (API limit is 2048)
+EMBEDDING_COALESCE_WINDOW_S = 0.0 # How long single-text misses wait for company; 0 disables coalescing
+EMBEDDING_COALESCE_WINDOW_ENV_VAR = "EMBEDDING_COALESCE_WINDOW_MS" # Enables coalescing for the shared service
+EMBEDDING_DISK_LOOKUP_CHUNK = 500 # Text hashes per disk-tier SELECT (stays under sqlite's parameter limit)
+
+EmbeddingKey = Tuple[str, str] # (model, sha256 of text)
+
+
+class EmbeddingService:
+    """
+    Memoizing wrapper around the OpenAI embeddings endpoint.
+
+    Embeddings are kept in a bounded LRU keyed by (model, text hash) and, if a
+    persist_path is given, in a sqlite file so they survive restarts. A single
+    instance is shared by MemoryCache and CapturingAgent (see get_embedding_service),
+    so a prompt is sent to the API at most once no matter how many components need it.
+    """
+
+    def __init__(self, client: Optional[OpenAI] = None, model: str = DEFAULT_EMBEDDING_MODEL,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES, persist_path: Optional[str] = None,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, coalesce_window_s: float = EMBEDDING_COALESCE_WINDOW_S,
+                 async_client: Optional[AsyncOpenAI] = None):
+        # Default: the process-wide pooled clients (see openai_client.py)
+        self._openai_client = client if client is not None else get_openai_client()
+        self._async_openai_client = async_client # Created on first aembed()/aembed_many() call
+        self.model = model
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self._lru: "OrderedDict[EmbeddingKey, List[float]]" = OrderedDict()
+        self._lock = threading.Lock() # LRU and counters; never held during sqlite I/O
+        self._db_lock = threading.Lock() # The sqlite connection is shared across threads
+
+        self._db: Optional[sqlite3.Connection] = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            self._db.commit()
+
+        # Counters exposed through stats()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._api_calls = 0
+        self._api_texts = 0
+        self._api_seconds = 0.0
+        self._api_tokens = 0
+
+        self._coalescer: Optional[_EmbeddingCoalescer] = None
+        if coalesce_window_s > 0:
+            self._coalescer = _EmbeddingCoalescer(self, coalesce_window_s, batch_size)
+
+    @staticmethod
+    def _key(text: str, model: str) -> EmbeddingKey:
+        return model, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: EmbeddingKey, embedding: List[float]):
+        """Inserts into the LRU, evicting the least recently used entry if full. Caller holds the lock."""
+        self._lru[key] = embedding
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def _get_memory(self, key: EmbeddingKey) -> Optional[List[float]]:
+        """Checks the memory tier only. Updates the hit counter."""
+        with self._lock:
+            embedding = self._lru.get(key)
+            if embedding is not None:
+                self._lru.move_to_end(key)
+                self._memory_hits += 1
+            return embedding
+
+    def _get_disk_many(self, keys: List[EmbeddingKey]) -> Dict[EmbeddingKey, List[float]]:
+        """Looks keys up in the disk tier (outside _lock) and promotes the hits into the LRU."""
+        found: Dict[EmbeddingKey, List[float]] = {}
+        if self._db is None or not keys:
+            return found
+        hashes_by_model: Dict[str, List[str]] = {}
+        for model, text_hash in keys:
+            hashes_by_model.setdefault(model, []).append(text_hash)
+        try:
+            with self._db_lock:
+                for model, hashes in hashes_by_model.items():
+                    for start in range(0, len(hashes), EMBEDDING_DISK_LOOKUP_CHUNK):
+                        chunk = hashes[start:start + EMBEDDING_DISK_LOOKUP_CHUNK]
+                        rows = self._db.execute(
+                            f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                            [model, *chunk]
+                        ).fetchall()
+                        for text_hash, vector in rows:
+                            found[(model, text_hash)] = array("f", vector).tolist()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read embeddings from disk cache: {e}")
+        if found:
+            with self._lock:
+                for key, embedding in found.items():
+                    self._remember(key, embedding)
+                self._disk_hits += len(found)
+        return found
+
+    def _get_cached(self, key: EmbeddingKey) -> Optional[List[float]]:
+        """Checks the memory tier, then the disk tier. Updates hit counters."""
+        embedding = self._get_memory(key)
+        if embedding is None:
+            embedding = self._get_disk_many([key]).get(key)
+        return embedding
+
+    def _persist(self, entries: List[Tuple[EmbeddingKey, List[float]]]):
+        """Writes entries to the disk tier, if any, in one transaction."""
+        if self._db is None or not entries:
+            return
+        with self._db_lock:
+            try:
+                with self._db: # Commits once at the end (rolls back on error)
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                        [(key[0], key[1], array("f", embedding).tobytes()) for key, embedding in entries]
+                    )
+            except sqlite3.Error as e:
+                print(f"Warning: Could not persist embeddings to disk cache: {e}")
+
+    def _record_response(self, texts: List[str], model: str, response, elapsed: float) -> Tuple[List[Optional[List[float]]], List[Tuple[EmbeddingKey, List[float]]]]:
+        """
+        Updates counters and puts an embeddings.create response for texts into the LRU. Returns the
+        embeddings in input order and the (key, embedding) entries for the caller to _persist().
+        """
+        with self._lock:
+            self._api_calls += 1
+            self._api_texts += len(texts)
+            self._api_seconds += elapsed
+            usage = getattr(response, "usage", None)
+            self._api_tokens += getattr(usage, "total_tokens", 0) or 0
+
+        # OpenAI embeddings are already normalized; data items carry the index of their input
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        entries: List[Tuple[EmbeddingKey, List[float]]] = []
+        for position, item in enumerate(response.data):
+            index = getattr(item, "index", position)
+            embeddings[index] = item.embedding
+            entries.append((self._key(texts[index], model), item.embedding))
+        with self._lock:
+            for key, embedding in entries:
+                self._remember(key, embedding)
+        return embeddings, entries
+
+    @staticmethod
+    def _report_failure(texts: List[str], error: Exception):
+        preview = texts[0] if len(texts) == 1 else f"{len(texts)} texts"
+        print(f"Error generating OpenAI embedding for '{preview}': {error}")
+
+    def _fetch_batch(self, texts: List[str], model: str) -> List[Optional[List[float]]]:
+        """Embeds texts with a single API request and caches the results. Entries are None on failure."""
+        try:
+            started = time.perf_counter()
+            response = self._openai_client.embeddings.create(input=texts, model=model, timeout=EMBEDDING_REQUEST_TIMEOUT)
+            elapsed = time.perf_counter() - started
+        except Exception as e:
+            self._report_failure(texts, e)
+            return [None] * len(texts)
+        embeddings, entries = self._record_response(texts, model, response, elapsed)
+        self._persist(entries)
+        return embeddings
+
+    async def _afetch_batch(self, texts: List[str], model: str) -> List[Optional[List[float]]]:
+        """Async counterpart of _fetch_batch, using AsyncOpenAI."""
+        if self._async_openai_client is None:
+            self._async_openai_client = get_async_openai_client()
+        try:
+            started = time.perf_counter()
+            response = await self._async_openai_client.embeddings.create(input=texts, model=model, timeout=EMBEDDING_REQUEST_TIMEOUT)
+            elapsed = time.perf_counter() - started
+        except Exception as e:
+            self._report_failure(texts, e)
+            return [None] * len(texts)
+        embeddings, entries = self._record_response(texts, model, response, elapsed)
+        if entries and self._db is not None:
+            await asyncio.to_thread(self._persist, entries) # Keep the sqlite write off the event loop
+        return embeddings
+
+    def embed(self, text: str, model: Optional[str] = None) -> Optional[List[float]]:
+        """Returns the embedding for text, calling the API only if it is not cached. None on failure."""
+        model = model or self.model
+        key = self._key(text, model)
+        embedding = self._get_cached(key)
+        if embedding is not None:
+            return embedding
+
+        with self._lock:
+            self._misses += 1
+        if self._coalescer is not None:
+            # Waits briefly so concurrent misses from other sessions share one request
+            return self._coalescer.submit(text, model).result()
+        return self._fetch_batch([text], model)[0]
+
+    def _split_memory(self, texts: List[str], model: str) -> Tuple[List[Optional[List[float]]], Dict[str, List[int]]]:
+        """Fills embeddings from the memory tier into a result list and groups the remaining positions by text."""
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        pending: Dict[str, List[int]] = {} # text -> positions still needing an embedding
+
+        for position, text in enumerate(texts):
+            if text in pending:
+                pending[text].append(position)
+                continue
+            embedding = self._get_memory(self._key(text, model))
+            if embedding is not None:
+                results[position] = embedding
+            else:
+                pending[text] = [position]
+        return results, pending
+
+    def _fill_from_disk(self, results: List[Optional[List[float]]], pending: Dict[str, List[int]], model: str):
+        """Serves pending texts from the disk tier in one lookup; what is left in pending counts as misses."""
+        keys = {text: self._key(text, model) for text in pending}
+        found = self._get_disk_many(list(keys.values()))
+        for text, key in keys.items():
+            embedding = found.get(key)
+            if embedding is not None:
+                for position in pending.pop(text):
+                    results[position] = embedding
+        with self._lock:
+            self._misses += len(pending)
+
+    def _split_cached(self, texts: List[str], model: str) -> Tuple[List[Optional[List[float]]], Dict[str, List[int]]]:
+        """Fills cached embeddings into a result list and groups the remaining positions by text."""
+        results, pending = self._split_memory(texts, model)
+        self._fill_from_disk(results, pending, model)
+        return results, pending
+
+    def embed_many(self, texts: List[str], model: Optional[str] = None) -> List[Optional[List[float]]]:
+        """
+        Returns embeddings for texts in order. Cached texts are served locally; the rest are
+        de-duplicated and sent in chunks of batch_size, one API request per chunk.
+        """
+        model = model or self.model
+        results, pending = self._split_cached(texts, model)
+        missing = list(pending)
+        for start in range(0, len(missing), self.batch_size):
+            chunk = missing[start:start + self.batch_size]
+            for text, embedding in zip(chunk, self._fetch_batch(chunk, model)):
+                for position in pending[text]:
+                    results[position] = embedding
+        return results
+
+    async def aembed(self, text: str, model: Optional[str] = None) -> Optional[List[float]]:
+        """Async counterpart of embed(); shares the same LRU, disk tier and counters."""
+        return (await self.aembed_many([text], model=model))[0]
+
+    async def aembed_many(self, texts: List[str], model: Optional[str] = None) -> List[Optional[List[float]]]:
+        """Async counterpart of embed_many(); chunks are requested concurrently."""
+        model = model or self.model
+        results, pending = self._split_memory(texts, model)
+        if pending and self._db is not None: # Disk reads stay off the event loop, like the writes
+            await asyncio.to_thread(self._fill_from_disk, results, pending, model)
+        else:
+            self._fill_from_disk(results, pending, model)
+        missing = list(pending)
+        chunks = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        chunk_results = await asyncio.gather(*(self._afetch_batch(chunk, model) for chunk in chunks))
+        for chunk, embeddings in zip(chunks, chunk_results):
+            for text, embedding in zip(chunk, embeddings):
+                for position in pending[text]:
+                    results[position] = embedding
+        return results
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters plus an estimate of the API latency and tokens saved by the cache."""
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            lookups = hits + self._misses
+            avg_seconds = self._api_seconds / self._api_calls if self._api_calls else 0.0
+            avg_tokens = self._api_tokens / self._api_calls if self._api_calls else 0.0
+            return {
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "api_calls": self._api_calls,
+                "api_texts": self._api_texts,
+                "api_seconds": self._api_seconds,
+                "saved_seconds_estimate": hits * avg_seconds,
+                "saved_tokens_estimate": hits * avg_tokens,
+                "cached_entries": len(self._lru),
+            }
+
+    def clear(self):
+        """Drops the in-process LRU (the disk tier is left untouched)."""
+        with self._lock:
+            self._lru.clear()
+
+
+class _EmbeddingCoalescer:
+    """
+    Micro-batcher for single-text embedding requests. Misses submitted from different threads
+    within coalesce_window_s of each other are sent together in one embeddings.create call.
+    """
+
+    def __init__(self, service: EmbeddingService, window_s: float, max_batch: int):
+        self._service = service
+        self._window_s = window_s
+        self._max_batch = max_batch
+        self._queue: "queue.Queue[Tuple[str, str, Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-coalescer", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str, model: str) -> Future:
+        future: Future = Future()
+        self._queue.put((text, model, future))
+        return future
+
+    def _collect_batch(self) -> List[Tuple[str, str, Future]]:
+        """Blocks for the first request, then gathers more until the window closes or the batch is full."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._window_s
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            by_model: Dict[str, Dict[str, List[Future]]] = {}
+            for text, model, future in batch:
+                by_model.setdefault(model, {}).setdefault(text, []).append(future)
+
+            for model, futures_by_text in by_model.items():
+                texts = list(futures_by_text)
+                try:
+                    embeddings = self._service._fetch_batch(texts, model)
+                except Exception as e:
+                    print(f"Error in embedding coalescer: {e}")
+                    embeddings = [None] * len(texts)
+                for text, embedding in zip(texts, embeddings):
+                    for future in futures_by_text[text]:
+                        future.set_result(embedding)
+
+
+_shared_service: Optional[EmbeddingService] = None
+_shared_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Returns the process-wide EmbeddingService, creating it on first use."""
+    global _shared_service
+    with _shared_service_lock:
+        if _shared_service is None:
+            coalesce_window_ms = float(os.getenv(EMBEDDING_COALESCE_WINDOW_ENV_VAR, "0") or 0)
+            _shared_service = EmbeddingService(
+                persist_path=os.getenv(EMBEDDING_CACHE_PATH_ENV_VAR),
+                coalesce_window_s=coalesce_window_ms / 1000.0
+            )
+        return _shared_service
@@ -1,11 +1,15 @@
 import openai
 import os
+import time
 
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional, Dict, Iterator, AsyncIterator
 
 # Import the new OpenAI client
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+
+from .openai_client import get_openai_client, get_async_openai_client, CHAT_REQUEST_TIMEOUT
+from .completion_cache import CompletionCache
 
 
 class ChatLLM(BaseModel):
@@ -19,10 +23,34 @@ class ChatLLM(BaseModel):
     # A cleaner way for Pydantic is to use a private attribute or a context manager.
     # Let's try making it a private attribute to avoid Pydantic validation issues.
     _client: OpenAI = None # Field for the client instance
+    _async_client: AsyncOpenAI = None # Shared pooled client fetched on first agenerate() call unless injected
+    _completion_cache: Optional[CompletionCache] = None # Opt-in memo of temperature-0 completions
 
-    def __init__(self, **data):
+    def __init__(self, client: Optional[OpenAI] = None, async_client: Optional[AsyncOpenAI] = None,
+                 completion_cache: Optional[CompletionCache] = None, **data):
+        """completion_cache: e.g. get_completion_cache(); repeated identical temperature-0 prompts are then answered from it."""
         super().__init__(**data)
-        self._client = OpenAI() # Initialize client using env var OPENAI_API_KEY
+        # Default: the process-wide pooled client (see openai_client.py), which reads OPENAI_API_KEY
+        self._client = client if client is not None else get_openai_client()
+        self._async_client = async_client
+        self._completion_cache = completion_cache
+
+    def _cache_key(self, prompt: str, stop: Optional[List[str]]) -> Optional[str]:
+        """Completion cache key, or None when the call must reach the API (no cache, or sampling)."""
+        if self._completion_cache is None:
+            return None
+        if self.temperature != 0:
+            self._completion_cache.record_bypass()
+            return None
+        return CompletionCache.key(self.model, self.temperature, prompt, stop)
+
+    def _remember_completion(self, cache_key: Optional[str], response: Optional[str], started: float):
+        if cache_key is not None and isinstance(response, str):
+            self._completion_cache.put(cache_key, response, time.perf_counter() - started)
+
+    def cache_stats(self) -> Optional[Dict[str, float]]:
+        """CompletionCache.stats(), or None when no completion cache is configured."""
+        return self._completion_cache.stats() if self._completion_cache is not None else None
 
     def generate(self, prompt: str, stop: List[str] = None) -> str: # Added return type hint
         # response = openai.ChatCompletion.create( # Old API call
@@ -39,21 +67,139 @@ class ChatLLM(BaseModel):
             # For now, let's assume __init__ sets it.
             raise RuntimeError("OpenAI client not initialized.")
 
+        cache_key = self._cache_key(prompt, stop)
+        if cache_key is not None:
+            cached = self._completion_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
         messages = [{"role": "user", "content": prompt}]
         
         try:
+            started = time.perf_counter()
             response = self._client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=self.temperature,
-                stop=stop
+                stop=stop,
+                timeout=CHAT_REQUEST_TIMEOUT
             )
-            return response.choices[0].message.content
+            content = response.choices[0].message.content
+            self._remember_completion(cache_key, content, started)
+            return content
         except Exception as e:
             print(f"Error during OpenAI API call: {e}")
             # Decide on how to handle the error, e.g., return a default string, None, or re-raise
             return "Error: Could not get response from LLM."
 
+    async def agenerate(self, prompt: str, stop: List[str] = None) -> str:
+        """Async counterpart of generate(), using AsyncOpenAI. Same arguments, result and error handling."""
+        if self._async_client is None:
+            self._async_client = get_async_openai_client()
+
+        cache_key = self._cache_key(prompt, stop)
+        if cache_key is not None:
+            cached = self._completion_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        messages = [{"role": "user", "content": prompt}]
+
+        try:
+            started = time.perf_counter()
+            response = await self._async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                stop=stop,
+                timeout=CHAT_REQUEST_TIMEOUT
+            )
+            content = response.choices[0].message.content
+            self._remember_completion(cache_key, content, started)
+            return content
+        except Exception as e:
+            print(f"Error during OpenAI API call: {e}")
+            return "Error: Could not get response from LLM."
+
+    def generate_stream(self, prompt: str, stop: List[str] = None) -> Iterator[str]:
+        """
+        Streaming counterpart of generate(): yields the completion in deltas as they arrive (the API
+        ends the stream at a stop sequence). A cached completion is yielded as one delta; a complete
+        stream is added to the completion cache. Errors yield generate()'s error string if nothing
+        was streamed yet.
+        """
+        if self._client is None:
+            raise RuntimeError("OpenAI client not initialized.")
+
+        cache_key = self._cache_key(prompt, stop)
+        if cache_key is not None:
+            cached = self._completion_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        messages = [{"role": "user", "content": prompt}]
+        parts: List[str] = []
+
+        try:
+            started = time.perf_counter()
+            with self._client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                stop=stop,
+                stream=True,
+                timeout=CHAT_REQUEST_TIMEOUT
+            ) as stream:
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+        except Exception as e:
+            print(f"Error during OpenAI API call: {e}")
+            if not parts:
+                yield "Error: Could not get response from LLM."
+            return
+        self._remember_completion(cache_key, "".join(parts), started)
+
+    async def agenerate_stream(self, prompt: str, stop: List[str] = None) -> AsyncIterator[str]:
+        """Async counterpart of generate_stream(), using AsyncOpenAI."""
+        if self._async_client is None:
+            self._async_client = get_async_openai_client()
+
+        cache_key = self._cache_key(prompt, stop)
+        if cache_key is not None:
+            cached = self._completion_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        messages = [{"role": "user", "content": prompt}]
+        parts: List[str] = []
+
+        try:
+            started = time.perf_counter()
+            async with await self._async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                stop=stop,
+                stream=True,
+                timeout=CHAT_REQUEST_TIMEOUT
+            ) as stream:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+        except Exception as e:
+            print(f"Error during OpenAI API call: {e}")
+            if not parts:
+                yield "Error: Could not get response from LLM."
+            return
+        self._remember_completion(cache_key, "".join(parts), started)
+
 
 if __name__ == '__main__':
     # Ensure OPENAI_API_KEY is set in your environment for this test to run
@@ -0,0 +1,68 @@
+"""
+Process-wide OpenAI clients sharing one HTTP connection pool.
+
+Every component that talks to OpenAI (EmbeddingService, ChatLLM, and through them MemoryCache
+and CapturingAgent) uses get_openai_client() / get_async_openai_client() unless a client is
+injected, so connections are kept alive and reused across components instead of each client
+opening (and TLS-handshaking) its own pool. The pool size is bounded, which also caps the number
+of concurrent OpenAI requests per process.
+
+Timeouts are per call: pass EMBEDDING_REQUEST_TIMEOUT or CHAT_REQUEST_TIMEOUT as timeout= so a
+slow completion does not make embedding calls wait just as long, and vice versa.
+"""
+from typing import Optional
+import os
+import threading
+
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+OPENAI_MAX_CONNECTIONS = 64 # Pool size per client (sync and async each); env OPENAI_MAX_CONNECTIONS
+OPENAI_MAX_CONNECTIONS_ENV_VAR = "OPENAI_MAX_CONNECTIONS"
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 32 # Idle connections kept open for reuse
+OPENAI_KEEPALIVE_EXPIRY_S = 60.0
+OPENAI_CONNECT_TIMEOUT_S = 5.0
+OPENAI_MAX_RETRIES = 2
+EMBEDDING_TIMEOUT_S = 15.0 # Whole-request timeout for embeddings calls
+CHAT_TIMEOUT_S = 60.0 # Whole-request timeout for chat completions
+
+EMBEDDING_REQUEST_TIMEOUT = httpx.Timeout(EMBEDDING_TIMEOUT_S, connect=OPENAI_CONNECT_TIMEOUT_S)
+CHAT_REQUEST_TIMEOUT = httpx.Timeout(CHAT_TIMEOUT_S, connect=OPENAI_CONNECT_TIMEOUT_S)
+
+_shared_client: Optional[OpenAI] = None
+_shared_async_client: Optional[AsyncOpenAI] = None
+_shared_client_lock = threading.Lock()
+
+
+def _pool_limits() -> httpx.Limits:
+    max_connections = int(os.getenv(OPENAI_MAX_CONNECTIONS_ENV_VAR, "0") or 0) or OPENAI_MAX_CONNECTIONS
+    return httpx.Limits(max_connections=max_connections,
+                        max_keepalive_connections=min(OPENAI_MAX_KEEPALIVE_CONNECTIONS, max_connections),
+                        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY_S)
+
+
+def get_openai_client() -> OpenAI:
+    """Returns the process-wide OpenAI client, creating it on first use (reads OPENAI_API_KEY / OPENAI_BASE_URL)."""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = OpenAI(
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=DefaultHttpxClient(limits=_pool_limits(), timeout=CHAT_REQUEST_TIMEOUT)
+            )
+        return _shared_client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Returns the process-wide AsyncOpenAI client, creating it on first use. Its pool belongs to
+    the event loop it first runs on, so use it from one long-lived loop (see RequestPipeline).
+    """
+    global _shared_async_client
+    with _shared_client_lock:
+        if _shared_async_client is None:
+            _shared_async_client = AsyncOpenAI(
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=DefaultAsyncHttpxClient(limits=_pool_limits(), timeout=CHAT_REQUEST_TIMEOUT)
+            )
+        return _shared_async_client
@@ -0,0 +1,116 @@
+from typing import List, Optional, Dict, Tuple
+import threading
+
+import numpy as np
+
+INITIAL_INDEX_CAPACITY = 64 # Rows allocated up front; capacity doubles when full
+COMPACTION_DEAD_ROW_FRACTION = 0.5 # Rebuild the matrix once this share of rows is stale
+
+
+class ToolEmbeddingIndex:
+    """
+    Contiguous float32 matrix of every tool embedding (primary + representative prompts)
+    with a row -> tool id index, so tool matching is one matmul plus a per-tool max.
+
+    Rows are appended as tools gain embeddings. Replacing a tool's embeddings marks its old
+    rows dead (tool id -1); the matrix is compacted once dead rows dominate.
+    """
+
+    def __init__(self, initial_capacity: int = INITIAL_INDEX_CAPACITY):
+        self._initial_capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None # (capacity, dim), allocated on first add
+        self._row_tool = np.full(initial_capacity, -1, dtype=np.int32)
+        self._size = 0 # Rows in use (live + dead)
+        self._dead_rows = 0
+        self._tool_ids: Dict[str, int] = {}
+        self._tool_names: List[str] = []
+        self._lock = threading.Lock()
+
+    def _tool_id(self, tool_name: str) -> int:
+        tool_id = self._tool_ids.get(tool_name)
+        if tool_id is None:
+            tool_id = len(self._tool_names)
+            self._tool_ids[tool_name] = tool_id
+            self._tool_names.append(tool_name)
+        return tool_id
+
+    def _ensure_capacity(self, extra_rows: int, dim: int):
+        if self._matrix is None:
+            capacity = max(self._initial_capacity, extra_rows)
+            self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+            self._row_tool = np.full(capacity, -1, dtype=np.int32)
+            return
+        needed = self._size + extra_rows
+        if needed <= self._matrix.shape[0]:
+            return
+        capacity = max(needed, 2 * self._matrix.shape[0])
+        matrix = np.zeros((capacity, dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        row_tool = np.full(capacity, -1, dtype=np.int32)
+        row_tool[:self._size] = self._row_tool[:self._size]
+        self._matrix, self._row_tool = matrix, row_tool
+
+    def _append_rows(self, tool_id: int, embeddings: List[List[float]]):
+        """Appends rows for tool_id. Caller holds the lock."""
+        if not embeddings:
+            return
+        rows = np.asarray(embeddings, dtype=np.float32)
+        if self._matrix is not None and rows.shape[1] != self._matrix.shape[1]:
+            print(f"Error: Embedding dimension {rows.shape[1]} does not match tool index dimension {self._matrix.shape[1]}. Skipping.")
+            return
+        self._ensure_capacity(len(rows), rows.shape[1])
+        self._matrix[self._size:self._size + len(rows)] = rows
+        self._row_tool[self._size:self._size + len(rows)] = tool_id
+        self._size += len(rows)
+
+    def _compact(self):
+        """Drops dead rows so the matrix stays contiguous. Caller holds the lock."""
+        live = self._row_tool[:self._size] >= 0
+        live_count = int(live.sum())
+        self._matrix[:live_count] = self._matrix[:self._size][live]
+        self._row_tool[:live_count] = self._row_tool[:self._size][live]
+        self._row_tool[live_count:self._size] = -1
+        self._size = live_count
+        self._dead_rows = 0
+
+    def add_embedding(self, tool_name: str, embedding: List[float]):
+        """Appends one embedding (e.g. a newly upvoted prompt) to tool_name's rows."""
+        with self._lock:
+            self._append_rows(self._tool_id(tool_name), [embedding])
+
+    def set_tool_embeddings(self, tool_name: str, embeddings: List[List[float]]):
+        """Replaces all rows of tool_name with embeddings (used on registration and re-sync)."""
+        with self._lock:
+            tool_id = self._tool_id(tool_name)
+            old_rows = self._row_tool[:self._size] == tool_id
+            self._dead_rows += int(old_rows.sum())
+            self._row_tool[:self._size][old_rows] = -1
+            self._append_rows(tool_id, embeddings)
+            if self._size and self._dead_rows / self._size > COMPACTION_DEAD_ROW_FRACTION:
+                self._compact()
+
+    def best_match(self, query_embedding: List[float], exclude_tool_names: Optional[List[str]] = None) -> Optional[Tuple[str, float]]:
+        """
+        Returns (tool_name, similarity) of the tool whose best embedding is most similar to the query,
+        ignoring excluded tools. Embeddings are L2-normalized, so similarity is the dot product.
+        """
+        with self._lock:
+            if self._matrix is None or self._size == 0:
+                return None
+            query = np.asarray(query_embedding, dtype=np.float32)
+            scores = self._matrix[:self._size] @ query
+            row_tool = self._row_tool[:self._size]
+            live = row_tool >= 0
+
+            # Segmented max: best score per tool id
+            tool_max = np.full(len(self._tool_names), -np.inf, dtype=np.float32)
+            np.maximum.at(tool_max, row_tool[live], scores[live])
+            for tool_name in exclude_tool_names or []:
+                tool_id = self._tool_ids.get(tool_name)
+                if tool_id is not None:
+                    tool_max[tool_id] = -np.inf
+
+            best_id = int(np.argmax(tool_max))
+            if not np.isfinite(tool_max[best_id]):
+                return None
+            return self._tool_names[best_id], float(tool_max[best_id])
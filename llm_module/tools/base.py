@@ -1,24 +1,95 @@
+from collections import OrderedDict
 from pydantic import BaseModel
 from typing import List, Optional, Any
 
+import numpy as np
+
+# Upvoted prompt embeddings kept per tool; beyond this, near-duplicates are merged into centroids
+MAX_PROMPT_EMBEDDINGS_PER_TOOL = 64
+SEEN_EMBEDDING_HASHES_PER_PROTOTYPE = 8 # Exact-duplicate memory per tool is this many times max_prompt_embeddings
+
+
+def _embedding_hash(embedding: List[float]) -> int:
+    return hash(tuple(embedding))
+
+
 class Tool(BaseModel):
     name: str
     description: str
     primary_embedding: Optional[List[float]] = None
     additional_prompt_embeddings: List[List[float]] = []
-    
+    max_prompt_embeddings: int = MAX_PROMPT_EMBEDDINGS_PER_TOOL
+
+    # Prototype bookkeeping: an LRU of hashes of every embedding seen (exact-duplicate check, kept
+    # even after the embedding is merged into a centroid) and how many prompts each prototype stands for.
+    _seen_hashes: "OrderedDict[int, None]" = OrderedDict()
+    _prototype_weights: List[int] = []
+
     def __init__(self, **data: Any):
         super().__init__(**data)
         if 'additional_prompt_embeddings' not in data:
             self.additional_prompt_embeddings = []
+        self._seen_hashes = OrderedDict((_embedding_hash(emb), None) for emb in self.additional_prompt_embeddings)
+        self._prototype_weights = [1] * len(self.additional_prompt_embeddings)
 
     def __call__(self, action_input: str) -> str:
         raise NotImplementedError("__call__() method not implemented in subclass")
 
-    def add_representative_prompt_embedding(self, embedding: List[float]):
-        if embedding not in self.additional_prompt_embeddings:
+    def add_representative_prompt_embedding(self, embedding: List[float]) -> bool:
+        """
+        Adds an upvoted prompt embedding to the tool's prototype set. Exact duplicates are ignored;
+        once max_prompt_embeddings is reached, the closest pair of prototypes is merged into its
+        weighted centroid to make room. Returns True if the stored embeddings changed.
+        """
+        embedding_hash = _embedding_hash(embedding)
+        if embedding_hash in self._seen_hashes:
+            self._seen_hashes.move_to_end(embedding_hash)
+            return False
+        self._seen_hashes[embedding_hash] = None
+        if len(self._seen_hashes) > SEEN_EMBEDDING_HASHES_PER_PROTOTYPE * self.max_prompt_embeddings:
+            self._seen_hashes.popitem(last=False)
+
+        if len(self.additional_prompt_embeddings) < self.max_prompt_embeddings:
             self.additional_prompt_embeddings.append(embedding)
-            print(f"Added representative prompt embedding to tool '{self.name}'. Count: {len(self.additional_prompt_embeddings)}")
+            self._prototype_weights.append(1)
+            # print(f"DEBUG: Added representative prompt embedding to tool '{self.name}'. Count: {len(self.additional_prompt_embeddings)}") # Reduced verbosity
+        else:
+            self._consolidate_prototypes(embedding)
+            # print(f"DEBUG: Merged representative prompt embedding into tool '{self.name}' prototypes. Count: {len(self.additional_prompt_embeddings)}") # Reduced verbosity
+        return True
+
+    def _consolidate_prototypes(self, embedding: List[float]):
+        """Keeps the prototype set at its cap by merging the most similar pair (the new embedding included)."""
+        prototypes = np.asarray(self.additional_prompt_embeddings, dtype=np.float64)
+        new_vec = np.asarray(embedding, dtype=np.float64)
+
+        new_similarities = prototypes @ new_vec
+        nearest = int(np.argmax(new_similarities))
+        if len(prototypes) > 1:
+            gram = prototypes @ prototypes.T
+            np.fill_diagonal(gram, -np.inf)
+            i, j = np.unravel_index(int(np.argmax(gram)), gram.shape)
+            closest_pair_similarity = gram[i, j]
+        else:
+            closest_pair_similarity = -np.inf
+
+        if new_similarities[nearest] >= closest_pair_similarity:
+            self._merge_into(nearest, new_vec, 1)
+        else:
+            # Two stored prototypes are closer to each other than the new one is to anything: merge them
+            self._merge_into(int(i), prototypes[j], self._prototype_weights[j])
+            self.additional_prompt_embeddings[j] = embedding
+            self._prototype_weights[j] = 1
+
+    def _merge_into(self, slot: int, vec: np.ndarray, weight: int):
+        """Replaces prototype `slot` with the L2-normalized weighted centroid of itself and vec."""
+        slot_weight = self._prototype_weights[slot]
+        centroid = slot_weight * np.asarray(self.additional_prompt_embeddings[slot]) + weight * vec
+        norm = np.linalg.norm(centroid)
+        if norm > 0:
+            centroid = centroid / norm
+        self.additional_prompt_embeddings[slot] = centroid.tolist()
+        self._prototype_weights[slot] = slot_weight + weight
 
     def get_all_embeddings(self) -> List[List[float]]:
         all_embs = []
@@ -1,11 +1,23 @@
-from typing import List, Optional, Dict, TypedDict, Tuple
-from openai import OpenAI # P2-T1: Switched to OpenAI
+from typing import List, Optional, Dict, TypedDict, Tuple, Union, Iterable, Set
+from collections import OrderedDict
 import os # For API Key
+import random
+import asyncio
+import atexit
+import re
+import hashlib
+import threading
+import time
 import uuid # P2-T2
 from datetime import datetime, timezone # P2-T2
 import numpy as np # P2-T3
-import chromadb # Added import
 import json # Added for P3-T3
+import zlib
+from openai import OpenAI, AsyncOpenAI
+from llm_module.embeddings import EmbeddingService, get_embedding_service
+from vector_backends import VectorBackend, create_backend
+from action_codec import ACTIONS_FIELD, encode_actions, decode_actions, plan_signature
+from cache_maintenance import CacheMaintenanceWorker, EntryStats, MAINTENANCE_INTERVAL_S, COMPACTION_DELETED_FRACTION
 
 # P1-T6: Define ActionSequence Type (List[str])
 ActionSequence = List[str]
@@ -18,12 +30,52 @@ class LookupResult(TypedDict):
     # We could also include the original prompt stored if needed for context
     # stored_prompt: str 
 
+# Parsed form of a stored entry, cached per entry id so hot hits skip json/UUID parsing.
+# actions is shared between callers: treat it as read-only.
+class DecodedEntry(TypedDict):
+    entry_id: uuid.UUID
+    actions: ActionSequence
+    score: float
+
 # Configuration Constants
 OPENAI_EMBEDDING_MODEL = "text-embedding-3-small" # P2-T1
 SIMILARITY_THRESHOLD_TAU = 0.60 # P2-T3 - Lowered further to 0.70 for testing, NOW 0.60 based on P3-T4 testing
 SCORE_THRESHOLD_EPSILON = 0.2 # For P2-T4, but good to have for lookup logic
 REWARD_ALPHA = 0.3 # P2-T4 EMA factor
 TOP_K_RESULTS = 3 # For ChromaDB queries
+DEFAULT_COLLECTION_NAME = "memory_cache_collection"
+DEFAULT_BACKEND = "chroma" # See vector_backends.BACKEND_NAMES
+REWARD_FLUSH_INTERVAL_S = 2.0 # Write-behind reward buffer: seconds between flushes (when enabled)
+REWARD_FLUSH_MAX_PENDING = 256 # Write-behind reward buffer: flush early once this many entries are dirty
+DECODED_ENTRY_CACHE_MAX_ENTRIES = 4096 # Parsed hit entries kept in process (see MemoryCache._decode_entry)
+MERGE_SIMILARITY_THRESHOLD = 0.95 # Suggested merge_threshold: paraphrases, not merely related prompts
+MAX_ALIAS_PROMPTS = 16 # Prompts remembered per merged entry (besides prompt_raw)
+EMBEDDING_DIM_ESTIMATE = 1536 # Vector size assumed for byte accounting of entries loaded from disk (text-embedding-3-small)
+
+# Punctuation touching a digit is kept: signs, decimal points and coordinate separators change the command
+_PUNCTUATION_RE = re.compile(r"(?<!\d)[^\w\s](?!\d)")
+_TRAILING_PUNCTUATION_RE = re.compile(r"[.!?]+$") # Sentence end, even right after a number ("set health to 75.")
+
+def _exact_match_key(prompt: str) -> str:
+    """Hash of the prompt case-folded, stripped of punctuation not touching a digit and whitespace-collapsed."""
+    normalized = _TRAILING_PUNCTUATION_RE.sub("", prompt.casefold().strip())
+    normalized = " ".join(_PUNCTUATION_RE.sub("", normalized).split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+def _alias_prompts(metadata: Dict) -> List[str]:
+    """Prompts folded into an entry by near-duplicate merging."""
+    try:
+        return json.loads(metadata.get("alias_prompts_json", "[]"))
+    except json.JSONDecodeError:
+        return []
+
+def _entry_exact_keys(metadata: Dict) -> List[str]:
+    return [_exact_match_key(p) for p in [metadata.get("prompt_raw", "")] + _alias_prompts(metadata)]
+
+def _stop_thread(stop: threading.Event, thread: threading.Thread):
+    stop.set()
+    if thread is not threading.current_thread():
+        thread.join()
 
 # P2-T2: Define CacheEntry structure
 class CacheEntry(TypedDict):
@@ -36,33 +88,325 @@ class CacheEntry(TypedDict):
     updated_at: datetime
 
 class MemoryCache:
-    def __init__(self):
-        self._openai_client = OpenAI()
+    def __init__(self, embedding_service: Optional[EmbeddingService] = None,
+                 persist_path: Optional[str] = None, collection_name: str = DEFAULT_COLLECTION_NAME,
+                 backend: Union[str, VectorBackend] = DEFAULT_BACKEND,
+                 reward_flush_interval_s: Optional[float] = None,
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 default_ttl_s: Optional[float] = None,
+                 maintenance_interval_s: float = MAINTENANCE_INTERVAL_S,
+                 compaction_threshold: Optional[float] = COMPACTION_DELETED_FRACTION,
+                 merge_threshold: Optional[float] = None,
+                 client: Optional[OpenAI] = None, async_client: Optional[AsyncOpenAI] = None):
+        """
+        persist_path: directory for a persistent ChromaDB store. Entries, scores and timestamps
+            survive restarts, so the cache warm-starts instead of relearning from zero. Chroma
+            commits every add/update/delete to its sqlite log before returning, so each call to
+            store() or update_reward() is durable on its own. None keeps the in-memory client.
+        collection_name: name of the collection inside the store.
+        backend: vector index behind lookup/store/update_reward. "chroma" (default), "numpy"
+            (exact flat scan, fastest for a few thousand entries), "hnsw" (approximate, for large
+            caches; needs hnswlib), "ivf" (clustered, for millions of entries; trained in the
+            background), "mmap" (memory-mapped files under persist_path shared by every process
+            that opens them; POSIX only), or a VectorBackend instance.
+        reward_flush_interval_s: enables the write-behind reward buffer. update_reward() then
+            applies the EMA to an in-memory score table (repeated votes on an entry coalesce) and
+            a background thread writes the table to the backend every reward_flush_interval_s
+            seconds, or sooner once REWARD_FLUSH_MAX_PENDING entries are dirty. Lookups see
+            buffered scores immediately. Call flush()/close() before shutdown; votes buffered
+            since the last flush are lost on a crash. None (default) writes every vote through.
+        max_entries / max_bytes: capacity budget (bytes = float32 vector + metadata, estimated).
+            When set, a background CacheMaintenanceWorker evicts the entries with the lowest blend
+            of reward score, hit count and recency, in bounded batches every maintenance_interval_s
+            seconds, so the cache can overshoot briefly but lookups never wait on eviction.
+            Hit counts live in memory and restart from zero; recency falls back to updated_at_iso.
+        default_ttl_s: entries older than this (by created_at_iso) expire; store(ttl_s=...) sets a
+            per-entry TTL instead. Expired entries are never returned by lookups and are deleted by
+            the maintenance worker's sweeper in batches. None (default) keeps entries indefinitely.
+        compaction_threshold: the maintenance worker rebuilds the vector index once this share of
+            it is taken by deleted entries (see VectorBackend.compact()). None disables compaction.
+        The maintenance worker starts with the cache when a capacity budget or default TTL is set,
+        otherwise on the first delete or per-entry TTL.
+        merge_threshold: when set (e.g. MERGE_SIMILARITY_THRESHOLD), store() folds a new prompt into
+            its nearest entry if that entry is at least this similar and holds the same plan (same
+            tools, inputs and observations). The merged entry's embedding becomes the centroid of its
+            prompts, the prompt is remembered as an alias (exact-match hits included) and the score
+            is pooled. None (default) always inserts.
+        client / async_client: OpenAI clients for embeddings when no embedding_service is given
+            (a private EmbeddingService is built around them). By default the cache uses the shared
+            EmbeddingService and its pooled clients (llm_module/openai_client.py).
+        """
+        # Shared, memoizing embedding service (one API call per distinct prompt across cache and agent)
+        if embedding_service is None and (client is not None or async_client is not None):
+            embedding_service = EmbeddingService(client=client, async_client=async_client)
+        self._embedder = embedding_service if embedding_service is not None else get_embedding_service()
         # self._cache: List[CacheEntry] = [] # Will be replaced by ChromaDB
         
-        # Initialize ChromaDB client and collection
-        self._chroma_client = chromadb.Client() # For in-memory client
-        # For persistent client:
-        # self._chroma_client = chromadb.PersistentClient(path="./chroma_db_data")
-        self._collection = self._chroma_client.get_or_create_collection(
-            name="memory_cache_collection",
-            # Optionally, specify the embedding function if not using OpenAI's default with Chroma
-            # metadata={"hnsw:space": "cosine"} # Ensure cosine distance if needed
-        )
-        print("ChromaDB client and collection initialized.")
+        if isinstance(backend, VectorBackend):
+            self._backend = backend
+        else:
+            self._backend = create_backend(backend, collection_name=collection_name, persist_path=persist_path)
+        if persist_path:
+            print(f"MemoryCache collection '{collection_name}' loaded from '{persist_path}' ({self._backend.count()} entries).")
+        else:
+            print(f"MemoryCache initialized with '{type(self._backend).__name__}'.")
 
-    def _generate_embedding(self, text: str) -> Optional[List[float]]:
-        """Helper function to generate embedding using OpenAI."""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl_s = default_ttl_s
+        self.merge_threshold = merge_threshold
+        self._maintenance_interval_s = maintenance_interval_s
+        self._compaction_threshold = compaction_threshold
+        self._maintenance: Optional[CacheMaintenanceWorker] = None
+        self._maintenance_lock = threading.Lock()
+        self._close_registered = False
+
+        # Exact-match fast path: normalized prompt hash -> entry id, checked before any embedding call
+        self._exact_index: Dict[str, str] = {}
+        self._exact_index_lock = threading.Lock()
+        # Per-entry eviction stats (score, hits, last use, size), see cache_maintenance.py
+        self._entry_stats: Dict[str, EntryStats] = {}
+        self._entry_stats_lock = threading.Lock()
+        # The same ids in a swap-remove list, so eviction can sample entries without copying them all
+        self._entry_ids: List[str] = []
+        self._entry_positions: Dict[str, int] = {}
+        self._total_bytes = 0 # Sum of EntryStats.nbytes, kept up to date under _entry_stats_lock
+        self._max_hits = 0 # Highest hit count seen; scales the hit term of eviction values
+        # Both indexes are rebuilt from the backend's metadata by a background thread, so opening a
+        # large persistent cache does not wait for a full scan. Until it finishes, exact repeats of
+        # older prompts take the embedding path and the maintenance worker skips eviction/TTL sweeps.
+        self._entry_index_ready = threading.Event()
+        self._entry_index_stop = threading.Event()
+        self._deleted_while_loading: Set[str] = set()
+        self._index_loader = threading.Thread(target=self._load_entry_index, name="memory-cache-index-loader", daemon=True)
+        self._index_loader.start()
+        # A daemon thread still inside the backend's native code at interpreter exit can crash it
+        atexit.register(_stop_thread, self._entry_index_stop, self._index_loader)
+
+        # Decoded-entry LRU: entry id -> DecodedEntry, invalidated on reward updates and deletions
+        self._decoded_entries: "OrderedDict[str, DecodedEntry]" = OrderedDict()
+        self._decoded_lock = threading.Lock()
+        self._decoded_hits = 0
+        self._decoded_misses = 0
+
+        # Reward updates: _reward_lock makes each read-modify-write atomic across sessions.
+        # With write-behind enabled, _pending_rewards maps entry id -> metadata carrying the latest
+        # (not yet flushed) score; a score below SCORE_THRESHOLD_EPSILON means "evict on flush".
+        self._reward_lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._pending_rewards: Dict[str, Dict] = {}
+        self._reward_flush_interval_s = reward_flush_interval_s
+        self._reward_flush_stop = threading.Event()
+        self._reward_flusher: Optional[threading.Thread] = None
+        if reward_flush_interval_s is not None:
+            self._reward_flusher = threading.Thread(target=self._reward_flush_loop, name="memory-cache-reward-flusher", daemon=True)
+            self._reward_flusher.start()
+            self._register_close()
+
+        if max_entries is not None or max_bytes is not None or default_ttl_s is not None or self._backend.REBUILDS_IN_BACKGROUND:
+            self._ensure_maintenance()
+
+    def _load_entry_index(self):
+        """Fills the exact-match index and eviction stats from the backend; entries written since opening take precedence."""
+        started = time.perf_counter()
+        loaded = 0
         try:
-            response = self._openai_client.embeddings.create(
-                input=text,
-                model=OPENAI_EMBEDDING_MODEL
-            )
-            # OpenAI embeddings are already normalized
-            return response.data[0].embedding
+            for entry_id_str, metadata in self._backend.all_metadata():
+                if self._entry_index_stop.is_set():
+                    break
+                loaded += 1
+                with self._entry_stats_lock:
+                    if entry_id_str in self._entry_stats or entry_id_str in self._deleted_while_loading:
+                        continue # Stored, merged or deleted since the cache was opened
+                self._track_entry(entry_id_str, metadata, EMBEDDING_DIM_ESTIMATE, only_if_new=True)
+                with self._exact_index_lock:
+                    for key in _entry_exact_keys(metadata):
+                        self._exact_index.setdefault(key, entry_id_str)
+            # print(f"DEBUG: Entry index of {loaded} entries loaded in {time.perf_counter() - started:.2f}s.") # Reduced verbosity
         except Exception as e:
-            print(f"Error generating OpenAI embedding for '{text}': {e}")
+            print(f"Error loading the exact-match index and entry stats: {e}") # Keep error
+        finally:
+            with self._entry_stats_lock:
+                self._deleted_while_loading.clear()
+            self._entry_index_ready.set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until the start-up index load has finished (True) or timeout seconds passed (False)."""
+        return self._entry_index_ready.wait(timeout)
+
+    def _register_close(self):
+        if not self._close_registered:
+            self._close_registered = True
+            atexit.register(self.close)
+
+    def _ensure_maintenance(self):
+        """Starts the background maintenance worker (eviction, TTL sweep, compaction) if it is not running."""
+        if self._maintenance is not None:
+            return
+        with self._maintenance_lock:
+            if self._maintenance is None:
+                worker = CacheMaintenanceWorker(self, interval_s=self._maintenance_interval_s,
+                                                compaction_threshold=self._compaction_threshold)
+                worker.start()
+                self._maintenance = worker
+                self._register_close()
+
+    def count(self) -> int:
+        """Number of entries currently stored."""
+        return self._backend.count()
+
+    def _track_entry(self, entry_id_str: str, metadata: Dict, embedding_dim: int, only_if_new: bool = False):
+        """Adds or refreshes the eviction stats record of an entry (only_if_new: never replace an existing record)."""
+        try:
+            last_used = datetime.fromisoformat(metadata.get("updated_at_iso", "")).timestamp()
+        except (TypeError, ValueError):
+            last_used = time.time()
+        nbytes = 4 * embedding_dim + sum(len(key) + len(str(value)) for key, value in metadata.items())
+        expires_at = metadata.get("expires_at_ts")
+        if expires_at is None and self.default_ttl_s is not None:
+            try:
+                expires_at = datetime.fromisoformat(metadata.get("created_at_iso", "")).timestamp() + self.default_ttl_s
+            except (TypeError, ValueError):
+                expires_at = time.time() + self.default_ttl_s
+        stats = EntryStats(score=metadata.get("score", 0.0), last_used=last_used, nbytes=nbytes,
+                           exact_keys=_entry_exact_keys(metadata), expires_at=expires_at)
+        with self._entry_stats_lock:
+            previous = self._entry_stats.get(entry_id_str)
+            if previous is not None:
+                if only_if_new:
+                    return
+                stats.hits = previous.hits
+                self._total_bytes -= previous.nbytes
+            elif only_if_new and entry_id_str in self._deleted_while_loading:
+                return
+            else:
+                self._entry_positions[entry_id_str] = len(self._entry_ids)
+                self._entry_ids.append(entry_id_str)
+            self._entry_stats[entry_id_str] = stats
+            self._total_bytes += stats.nbytes
+
+    def _is_expired(self, entry_id_str: str, now: Optional[float] = None) -> bool:
+        stats = self._entry_stats.get(entry_id_str)
+        if stats is None or stats.expires_at is None:
+            return False
+        return stats.expires_at <= (now if now is not None else time.time())
+
+    def _record_hit(self, entry_id_str: str):
+        """Counts a lookup hit for eviction ranking; plain attribute writes, no backend I/O."""
+        stats = self._entry_stats.get(entry_id_str)
+        if stats is not None:
+            stats.hits += 1
+            stats.last_used = time.time()
+            if stats.hits > self._max_hits:
+                self._max_hits = stats.hits
+
+    def _set_tracked_score(self, entry_id_str: str, score: float):
+        stats = self._entry_stats.get(entry_id_str)
+        if stats is not None:
+            stats.score = score
+
+    def _entry_stats_snapshot(self) -> Tuple[List[str], List[EntryStats]]:
+        with self._entry_stats_lock:
+            return list(self._entry_stats.keys()), list(self._entry_stats.values())
+
+    def _entry_totals(self) -> Tuple[int, int]:
+        """(entries, estimated bytes) currently tracked, in O(1)."""
+        with self._entry_stats_lock:
+            return len(self._entry_stats), self._total_bytes
+
+    def _sample_entry_stats(self, k: int) -> Tuple[List[str], List[EntryStats]]:
+        """Up to k tracked entries chosen uniformly at random, in O(k)."""
+        with self._entry_stats_lock:
+            positions = random.sample(range(len(self._entry_ids)), min(k, len(self._entry_ids)))
+            entry_ids = [self._entry_ids[position] for position in positions]
+            return entry_ids, [self._entry_stats[entry_id_str] for entry_id_str in entry_ids]
+
+    def _untrack_entry(self, entry_id_str: str) -> Optional[EntryStats]:
+        """Drops an entry's stats record and its sampling slot. Caller holds _entry_stats_lock."""
+        stats = self._entry_stats.pop(entry_id_str, None)
+        if stats is None:
             return None
+        self._total_bytes -= stats.nbytes
+        position = self._entry_positions.pop(entry_id_str)
+        last_id = self._entry_ids.pop()
+        if last_id != entry_id_str:
+            self._entry_ids[position] = last_id
+            self._entry_positions[last_id] = position
+        return stats
+
+    def _delete_entries(self, entry_id_strs: List[str]):
+        """Deletes entries from the backend and drops them from every in-process index."""
+        if not entry_id_strs:
+            return
+        self._backend.delete(ids=entry_id_strs)
+        self._ensure_maintenance() # Deletes fragment the index; the worker compacts it
+        with self._entry_stats_lock:
+            removed = [(entry_id_str, self._untrack_entry(entry_id_str)) for entry_id_str in entry_id_strs]
+            if not self._entry_index_ready.is_set():
+                self._deleted_while_loading.update(entry_id_strs) # Keep the loader from re-adding them
+        for entry_id_str, stats in removed:
+            if stats is not None:
+                for key in stats.exact_keys:
+                    self._forget_exact(key, entry_id_str)
+        self._invalidate_decoded(entry_id_strs)
+        with self._reward_lock:
+            for entry_id_str in entry_id_strs:
+                self._pending_rewards.pop(entry_id_str, None)
+
+    def maintenance_stats(self) -> Dict[str, float]:
+        """Entry/byte totals against the capacity budget, plus maintenance worker counters."""
+        entries, total_bytes = self._entry_totals()
+        result = {"entries": entries, "bytes_estimate": total_bytes,
+                  "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+        if self._maintenance is not None:
+            result.update(self._maintenance.stats())
+        return result
+
+    def _generate_embedding(self, text: str) -> Optional[List[float]]:
+        """Helper function to generate embedding using OpenAI (memoized by the embedding service)."""
+        return self._embedder.embed(text, model=OPENAI_EMBEDDING_MODEL)
+
+    def _current_score(self, entry_id_str: str, metadata: Dict) -> float:
+        """Entry score including votes still buffered in the write-behind table."""
+        pending = self._pending_rewards.get(entry_id_str)
+        return (pending if pending is not None else metadata).get("score", 0.0)
+
+    def _decode_entry(self, entry_id_str: str, metadata: Dict) -> Optional[DecodedEntry]:
+        """Parsed actions/UUID/score for a hit, from the decoded-entry cache when possible."""
+        with self._decoded_lock:
+            decoded = self._decoded_entries.get(entry_id_str)
+            if decoded is not None:
+                self._decoded_entries.move_to_end(entry_id_str)
+                self._decoded_hits += 1
+                return decoded
+            self._decoded_misses += 1
+        try:
+            actions = decode_actions(metadata)
+        except (ValueError, zlib.error) as e:
+            print(f"Error decoding actions for entry ID {entry_id_str}: {e}. Skipping this entry.") # Keep error
+            return None
+        decoded = DecodedEntry(entry_id=uuid.UUID(entry_id_str), actions=actions, score=metadata.get("score", 0.0))
+        with self._decoded_lock:
+            self._decoded_entries[entry_id_str] = decoded
+            while len(self._decoded_entries) > DECODED_ENTRY_CACHE_MAX_ENTRIES:
+                self._decoded_entries.popitem(last=False)
+        return decoded
+
+    def _invalidate_decoded(self, entry_id_strs: Iterable[str]):
+        with self._decoded_lock:
+            for entry_id_str in entry_id_strs:
+                self._decoded_entries.pop(entry_id_str, None)
+
+    def decoded_cache_stats(self) -> Dict[str, float]:
+        """Hit/miss counters of the decoded-entry cache."""
+        with self._decoded_lock:
+            lookups = self._decoded_hits + self._decoded_misses
+            return {
+                "hits": self._decoded_hits,
+                "misses": self._decoded_misses,
+                "hit_rate": self._decoded_hits / lookups if lookups else 0.0,
+                "cached_entries": len(self._decoded_entries),
+            }
 
     def _cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
         """Calculate cosine similarity between two vectors."""
@@ -70,98 +414,179 @@ class MemoryCache:
         # For normalized vectors, cosine similarity is the dot product.
         return np.dot(np.array(vec1), np.array(vec2))
 
-    def lookup(self, prompt: str) -> Optional[LookupResult]:
+    def lookup(self, prompt: str, query_embedding: Optional[List[float]] = None) -> Optional[LookupResult]:
         """
-        Performs a similarity search in ChromaDB for the given prompt.
+        Performs a similarity search in the vector backend for the given prompt.
         If a sufficiently similar and high-scoring entry is found, 
         its ID, actions, and similarity score are returned.
+        query_embedding can be passed when the caller already has the prompt's embedding.
         """
         # print(f"DEBUG: lookup() called with prompt: '{prompt}'") # Reduced verbosity
-        query_embedding = self._generate_embedding(prompt)
+        exact_result = self.lookup_exact(prompt)
+        if exact_result is not None:
+            return exact_result
+
+        if query_embedding is None:
+            query_embedding = self._generate_embedding(prompt)
         if query_embedding is None:
             print(f"Error: Failed to generate embedding for lookup prompt: '{prompt}'.") # Keep error
             return None
 
-        if self._collection.count() == 0:
-            # print("DEBUG: ChromaDB collection is empty. Nothing to lookup.") # Reduced verbosity
-            return None
-
         try:
-            results = self._collection.query(
-                query_embeddings=[query_embedding],
-                n_results=TOP_K_RESULTS,
-                include=["metadatas", "distances"] 
-            )
+            results = self._backend.query(query_embedding, n_results=TOP_K_RESULTS)
         except Exception as e:
-            print(f"Error querying ChromaDB: {e}") # Keep error
+            print(f"Error querying vector backend: {e}") # Keep error
             return None
 
-        # print(f"DEBUG: ChromaDB query results for '{prompt}':") # Reduced verbosity
+        # print(f"DEBUG: Query results for '{prompt}':") # Reduced verbosity
 
-        if not results or not results.get('ids') or not results['ids'][0]:
-            # print("DEBUG: No results returned from ChromaDB query or results format unexpected.") # Reduced verbosity
+        if not results:
+            # print("DEBUG: No results returned from query.") # Reduced verbosity
             return None
 
-        result_ids = results['ids'][0]
-        distances = results['distances'][0]
-        metadatas = results['metadatas'][0]
-
-        for i in range(len(result_ids)):
-            entry_id_str = result_ids[i]
-            distance = distances[i]
-            metadata = metadatas[i]
-            
+        for i, (entry_id_str, distance, metadata) in enumerate(results):
             similarity = 1 - distance 
             prompt_raw = metadata.get("prompt_raw", "[prompt_raw not found]")
-            score = metadata.get("score", 0.0)
-            actions_json = metadata.get("actions_json", "[]")
+            score = self._current_score(entry_id_str, metadata)
 
             # print(f"  Candidate {i+1}: ID={entry_id_str}, Prompt='{prompt_raw}', Similarity={similarity:.4f}, Score={score:.2f}") # Reduced verbosity
 
             if similarity >= SIMILARITY_THRESHOLD_TAU:
-                if score >= SCORE_THRESHOLD_EPSILON:
+                if score >= SCORE_THRESHOLD_EPSILON and not self._is_expired(entry_id_str):
                     # print(f"    DEBUG: Potential HIT! ID={entry_id_str}. Similarity and Score meet thresholds.") # Reduced verbosity
-                    try:
-                        actions = json.loads(actions_json)
-                        # print(f"DEBUG: HIT! Prompt: '{prompt}'. Best match: '{prompt_raw}' (ID: {entry_id_str}). Similarity: {similarity:.4f}, Score: {score:.2f}") # Keep high-level HIT from demo
-                        return LookupResult(entry_id=uuid.UUID(entry_id_str), actions=actions, similarity_score=similarity)
-                    except json.JSONDecodeError as e:
-                        print(f"Error decoding actions_json for entry ID {entry_id_str}: {e}. Skipping this entry.") # Keep error
+                    decoded = self._decode_entry(entry_id_str, metadata)
+                    if decoded is None:
                         continue 
+                    # print(f"DEBUG: HIT! Prompt: '{prompt}'. Best match: '{prompt_raw}' (ID: {entry_id_str}). Similarity: {similarity:.4f}, Score: {score:.2f}") # Keep high-level HIT from demo
+                    self._record_hit(entry_id_str)
+                    return LookupResult(entry_id=decoded["entry_id"], actions=decoded["actions"], similarity_score=similarity)
                 # else:
                     # print(f"    DEBUG: MISS (Score too low). ID={entry_id_str}, Score={score:.2f} < {SCORE_THRESHOLD_EPSILON}") # Reduced verbosity
             # else:
                 # print(f"    DEBUG: MISS (Similarity too low). ID={entry_id_str}, Similarity={similarity:.4f} < {SIMILARITY_THRESHOLD_TAU}") # Reduced verbosity
         
-        # print(f"DEBUG: MISS. No entry in top {len(result_ids)} results for '{prompt}' met both similarity and score thresholds.") # Reduced verbosity
+        # print(f"DEBUG: MISS. No entry in top {len(results)} results for '{prompt}' met both similarity and score thresholds.") # Reduced verbosity
         return None
 
-    def store(self, prompt: str, actions: ActionSequence) -> Optional[uuid.UUID]:
+    def lookup_many(self, prompts: List[str]) -> List[Optional[LookupResult]]:
         """
-        Generates an embedding for the prompt and stores the entry
-        (embedding, prompt, actions, score, timestamps) in the ChromaDB collection.
-        Returns the UUID of the stored entry, or None if embedding fails.
+        Batch version of lookup() for replays and bulk evaluation. Exact repeats are answered from
+        the prompt-hash index; the rest are embedded in batched API calls and searched with one
+        multi-vector backend query. Returns a LookupResult or None per prompt, in order.
         """
-        # print(f"DEBUG: store() called with prompt: '{prompt}'") # Reduced verbosity
-        embedding = self._generate_embedding(prompt)
-        if embedding is None:
-            print(f"Error: Failed to generate embedding for prompt: '{prompt}'. Not storing.") # Keep error
+        results: List[Optional[LookupResult]] = [self.lookup_exact(prompt) for prompt in prompts]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        embeddings = self._embedder.embed_many([prompts[i] for i in pending], model=OPENAI_EMBEDDING_MODEL)
+        for i, embedding in zip(pending, embeddings):
+            if embedding is None:
+                print(f"Error: Failed to generate embedding for lookup prompt: '{prompts[i]}'.") # Keep error
+        pending = [i for i, embedding in zip(pending, embeddings) if embedding is not None]
+        query_embeddings = [embedding for embedding in embeddings if embedding is not None]
+        if not pending:
+            return results
+
+        try:
+            candidate_lists = self._backend.query_many(query_embeddings, n_results=TOP_K_RESULTS)
+        except Exception as e:
+            print(f"Error querying vector backend: {e}") # Keep error
+            return results
+
+        # τ/ε filtering on (n_prompts, TOP_K_RESULTS) matrices; missing candidates are padded out
+        similarities = np.full((len(pending), TOP_K_RESULTS), -np.inf)
+        scores = np.full((len(pending), TOP_K_RESULTS), -np.inf)
+        for row, candidates in enumerate(candidate_lists):
+            for col, (entry_id_str, distance, metadata) in enumerate(candidates[:TOP_K_RESULTS]):
+                similarities[row, col] = 1 - distance
+                score = self._current_score(entry_id_str, metadata)
+                scores[row, col] = score if isinstance(score, (int, float)) and not self._is_expired(entry_id_str) else -np.inf
+        qualifies = (similarities >= SIMILARITY_THRESHOLD_TAU) & (scores >= SCORE_THRESHOLD_EPSILON)
+
+        for row, col in zip(*np.nonzero(qualifies)):
+            i = pending[row]
+            if results[i] is not None:
+                continue # An earlier (more similar) candidate already answered this prompt
+            entry_id_str, _, metadata = candidate_lists[row][col]
+            decoded = self._decode_entry(entry_id_str, metadata)
+            if decoded is None:
+                continue
+            self._record_hit(entry_id_str)
+            results[i] = LookupResult(entry_id=decoded["entry_id"], actions=decoded["actions"], similarity_score=float(similarities[row, col]))
+        return results
+
+    def lookup_exact(self, prompt: str) -> Optional[LookupResult]:
+        """Answers repeats of a stored prompt (up to case, spacing and punctuation away from digits) without embedding it."""
+        key = _exact_match_key(prompt)
+        with self._exact_index_lock:
+            entry_id_str = self._exact_index.get(key)
+        if entry_id_str is None:
             return None
 
-        entry_id = uuid.uuid4()
-        current_time = datetime.now(timezone.utc)
-        initial_score = 1.0
+        try:
+            metadata = self._backend.get_metadata(entry_id_str)
+        except Exception as e:
+            print(f"Error reading entry ID {entry_id_str} for exact-match lookup: {e}") # Keep error
+            return None
+        if metadata is None:
+            self._forget_exact(key, entry_id_str)
+            self._invalidate_decoded([entry_id_str])
+            return None
+        if self._current_score(entry_id_str, metadata) < SCORE_THRESHOLD_EPSILON or self._is_expired(entry_id_str):
+            return None
+        decoded = self._decode_entry(entry_id_str, metadata)
+        if decoded is None:
+            return None
+        self._record_hit(entry_id_str)
+        return LookupResult(entry_id=decoded["entry_id"], actions=decoded["actions"], similarity_score=1.0)
+
+    def _forget_exact(self, key: str, entry_id_str: str):
+        """Drops key from the exact-match index if it still points at entry_id_str."""
+        with self._exact_index_lock:
+            if self._exact_index.get(key) == entry_id_str:
+                del self._exact_index[key]
 
+    def _new_entry_metadata(self, prompt: str, actions: ActionSequence, current_time: datetime,
+                            ttl_s: Optional[float] = None) -> Dict:
+        initial_score = 1.0
         metadata = {
             "prompt_raw": prompt,
-            "actions_json": json.dumps(actions), 
+            ACTIONS_FIELD: encode_actions(actions), # Compact encoding; legacy entries carry "actions_json"
             "score": initial_score,
             "created_at_iso": current_time.isoformat(),
             "updated_at_iso": current_time.isoformat()
         }
+        if ttl_s is not None:
+            metadata["expires_at_ts"] = current_time.timestamp() + ttl_s
+            self._ensure_maintenance()
+        return metadata
+
+    def store(self, prompt: str, actions: ActionSequence, embedding: Optional[List[float]] = None,
+              ttl_s: Optional[float] = None) -> Optional[uuid.UUID]:
+        """
+        Generates an embedding for the prompt (unless one is passed in) and stores the entry
+        (embedding, prompt, actions, score, timestamps) in the vector backend.
+        ttl_s overrides the cache's default_ttl_s for this entry.
+        Returns the UUID of the stored entry, or None if embedding fails.
+        """
+        # print(f"DEBUG: store() called with prompt: '{prompt}'") # Reduced verbosity
+        if embedding is None:
+            embedding = self._generate_embedding(prompt)
+        if embedding is None:
+            print(f"Error: Failed to generate embedding for prompt: '{prompt}'. Not storing.") # Keep error
+            return None
+
+        if self.merge_threshold is not None:
+            merged_entry_id = self._merge_into_neighbor(prompt, actions, embedding, ttl_s)
+            if merged_entry_id is not None:
+                return merged_entry_id
+
+        entry_id = uuid.uuid4()
+        metadata = self._new_entry_metadata(prompt, actions, datetime.now(timezone.utc), ttl_s)
 
         try:
-            self._collection.add(
+            self._backend.add(
                 ids=[str(entry_id)],
                 embeddings=[embedding],
                 metadatas=[metadata]
@@ -170,52 +595,304 @@ class MemoryCache:
             # print(f"  Prompt: '{prompt}'") # Reduced verbosity
             # print(f"  Actions: {actions}") # Reduced verbosity
             # print(f"  Metadata sent to Chroma: {metadata}") # Reduced verbosity
+            with self._exact_index_lock:
+                self._exact_index[_exact_match_key(prompt)] = str(entry_id)
+            self._track_entry(str(entry_id), metadata, len(embedding))
             return entry_id
         except Exception as e:
-            print(f"Error storing entry ID {entry_id} in ChromaDB: {e}") # Keep error
+            print(f"Error storing entry ID {entry_id} in vector backend: {e}") # Keep error
             return None
 
+    def _merge_into_neighbor(self, prompt: str, actions: ActionSequence, embedding: List[float],
+                             ttl_s: Optional[float] = None) -> Optional[uuid.UUID]:
+        """
+        Folds (prompt, actions) into the nearest entry if it is a near-duplicate with the same plan.
+        With ttl_s, the merged entry expires at the earlier of its own expiry and now + ttl_s.
+        Returns that entry's UUID, or None when store() should insert a new entry.
+        """
+        try:
+            candidates = self._backend.query(embedding, n_results=1)
+        except Exception as e:
+            print(f"Error querying vector backend: {e}") # Keep error
+            return None
+        if not candidates:
+            return None
+        entry_id_str, distance, _ = candidates[0]
+        if 1 - distance < self.merge_threshold or self._is_expired(entry_id_str):
+            return None
+
+        # Both locks: a concurrent flush() must not write back the pre-merge metadata
+        with self._flush_lock, self._reward_lock:
+            try:
+                current_metadata = self._pending_rewards.get(entry_id_str) or self._backend.get_metadata(entry_id_str)
+                if current_metadata is None or current_metadata.get("score", 0.0) < SCORE_THRESHOLD_EPSILON:
+                    return None
+                if plan_signature(decode_actions(current_metadata)) != plan_signature(actions):
+                    return None
+                representative = self._backend.get_embedding(entry_id_str)
+            except Exception as e:
+                print(f"Error reading entry ID {entry_id_str} for near-duplicate merge: {e}") # Keep error
+                return None
+            if representative is None:
+                return None
+
+            merge_count = current_metadata.get("merge_count", 1)
+            centroid = merge_count * np.asarray(representative, dtype=np.float64) + np.asarray(embedding, dtype=np.float64)
+            norm = np.linalg.norm(centroid)
+            if norm > 0:
+                centroid = centroid / norm
+
+            aliases = _alias_prompts(current_metadata)
+            known_keys = set(_entry_exact_keys(current_metadata))
+            if _exact_match_key(prompt) not in known_keys:
+                aliases = (aliases + [prompt])[-MAX_ALIAS_PROMPTS:]
+
+            initial_score = 1.0
+            updated_metadata = dict(current_metadata)
+            # The new example counts as one more observation in the pooled score
+            updated_metadata["score"] = (merge_count * current_metadata.get("score", 0.0) + initial_score) / (merge_count + 1)
+            updated_metadata["merge_count"] = merge_count + 1
+            updated_metadata["alias_prompts_json"] = json.dumps(aliases)
+            current_time = datetime.now(timezone.utc)
+            updated_metadata["updated_at_iso"] = current_time.isoformat()
+            if ttl_s is not None:
+                stats = self._entry_stats.get(entry_id_str)
+                expires_at = stats.expires_at if stats is not None else current_metadata.get("expires_at_ts")
+                new_expires_at = current_time.timestamp() + ttl_s
+                updated_metadata["expires_at_ts"] = new_expires_at if expires_at is None else min(expires_at, new_expires_at)
+                self._ensure_maintenance()
+            try:
+                self._backend.update_entry(entry_id_str, centroid.tolist(), updated_metadata)
+            except Exception as e:
+                print(f"Error merging prompt into entry ID {entry_id_str}: {e}") # Keep error
+                return None
+            self._pending_rewards.pop(entry_id_str, None)
+
+        with self._exact_index_lock:
+            for key in _entry_exact_keys(updated_metadata):
+                self._exact_index[key] = entry_id_str
+        self._track_entry(entry_id_str, updated_metadata, len(embedding))
+        self._invalidate_decoded([entry_id_str])
+        # print(f"DEBUG: Merged prompt '{prompt}' into entry {entry_id_str} (now {merge_count + 1} prompts).") # Reduced verbosity
+        return uuid.UUID(entry_id_str)
+
+    def store_many(self, entries: List[Tuple[str, ActionSequence]],
+                   entry_ids: Optional[List[uuid.UUID]] = None, ttl_s: Optional[float] = None) -> List[Optional[uuid.UUID]]:
+        """
+        Bulk version of store(): embeds all prompts with batched API calls and adds every entry in a
+        single backend call. entry_ids may be given to make re-imports idempotent: ids that are
+        already stored (checked in one backend call, before anything is embedded) are skipped and
+        keep their entry (score, hits) unchanged. Returns per entry, in order, the UUID it was
+        stored under, or None if it was skipped as already stored or its embedding failed.
+        """
+        if not entries:
+            return []
+        results: List[Optional[uuid.UUID]] = [None] * len(entries)
+        ids = entry_ids if entry_ids is not None else [uuid.uuid4() for _ in entries]
+        positions = list(range(len(entries)))
+        if entry_ids is not None:
+            existing = self.existing_ids(entry_ids)
+            positions = [position for position in positions if ids[position] not in existing]
+            if not positions:
+                return results
+        embeddings = self._embedder.embed_many([entries[position][0] for position in positions], model=OPENAI_EMBEDDING_MODEL)
+        current_time = datetime.now(timezone.utc)
+
+        add_ids, add_embeddings, add_metadatas, add_positions = [], [], [], []
+        for position, embedding in zip(positions, embeddings):
+            (prompt, actions), entry_id = entries[position], ids[position]
+            if embedding is None:
+                print(f"Error: Failed to generate embedding for prompt: '{prompt}'. Not storing.") # Keep error
+                continue
+            add_ids.append(str(entry_id))
+            add_embeddings.append(embedding)
+            add_metadatas.append(self._new_entry_metadata(prompt, actions, current_time, ttl_s))
+            add_positions.append(position)
+        if not add_ids:
+            return results
+
+        try:
+            added_ids = set(self._backend.add(ids=add_ids, embeddings=add_embeddings, metadatas=add_metadatas,
+                                              skip_existing=entry_ids is not None))
+        except Exception as e:
+            print(f"Error storing {len(add_ids)} entries in vector backend: {e}") # Keep error
+            return results
+
+        # Entries skipped as already stored keep their index and stats entries
+        with self._exact_index_lock:
+            for entry_id_str, metadata in zip(add_ids, add_metadatas):
+                if entry_id_str in added_ids:
+                    self._exact_index[_exact_match_key(metadata["prompt_raw"])] = entry_id_str
+        for entry_id_str, metadata, embedding in zip(add_ids, add_metadatas, add_embeddings):
+            if entry_id_str in added_ids:
+                self._track_entry(entry_id_str, metadata, len(embedding))
+        for position, entry_id_str in zip(add_positions, add_ids):
+            if entry_id_str in added_ids: # Others were stored concurrently after the check above
+                results[position] = ids[position]
+        return results
+
+    def existing_ids(self, entry_ids: List[uuid.UUID]) -> Set[uuid.UUID]:
+        """The subset of entry_ids that are stored, in one backend call (empty on backend errors)."""
+        if not entry_ids:
+            return set()
+        try:
+            found = self._backend.existing_ids([str(entry_id) for entry_id in entry_ids])
+        except Exception as e:
+            print(f"Error checking {len(entry_ids)} entry ids in vector backend: {e}") # Keep error
+            return set()
+        return {entry_id for entry_id in entry_ids if str(entry_id) in found}
+
+    def contains(self, entry_id: uuid.UUID) -> bool:
+        """Whether entry_id is stored in this cache."""
+        return bool(self.existing_ids([entry_id]))
+
+    @staticmethod
+    def _ema_score(entry_id_str: str, old_score, success: bool) -> float:
+        if not isinstance(old_score, (float, int)):
+            print(f"Warning: old_score for {entry_id_str} is not a number: {old_score}. Defaulting to 0.0 for EMA.") # Keep warning
+            old_score = 0.0
+        return (REWARD_ALPHA * float(success)) + ((1 - REWARD_ALPHA) * old_score)
+
     def update_reward(self, entry_id: uuid.UUID, success: bool) -> bool:
         """
-        Updates the score of a cache entry in ChromaDB based on success/failure.
-        If the score falls below a threshold, the entry is removed from ChromaDB.
+        Updates the score of a cache entry based on success/failure.
+        If the score falls below a threshold, the entry is removed from the backend
+        (at the next flush() when the write-behind reward buffer is enabled).
         """
         # print(f"DEBUG: update_reward() called for entry_id: {entry_id}, success: {success}") # Reduced verbosity
+        if self._reward_flush_interval_s is not None:
+            return self._buffer_reward(str(entry_id), success)
 
         try:
-            entry_data = self._collection.get(
-                ids=[str(entry_id)],
-                include=["metadatas"]
-            )
+            with self._reward_lock:
+                current_metadata = self._backend.get_metadata(str(entry_id))
+                if current_metadata is None:
+                    # print(f"DEBUG: update_reward: Entry ID {entry_id} not found.") # Reduced verbosity
+                    return False 
 
-            if not entry_data or not entry_data['ids'] or not entry_data['ids'][0]:
-                # print(f"DEBUG: update_reward: Entry ID {entry_id} not found in ChromaDB.") # Reduced verbosity
-                return False 
-            
-            current_metadata = entry_data['metadatas'][0]
-            old_score = current_metadata.get("score", 0.0)
-            if not isinstance(old_score, (float, int)):
-                print(f"Warning: old_score for {entry_id} is not a number: {old_score}. Defaulting to 0.0 for EMA.") # Keep warning
-                old_score = 0.0
-
-            new_score = (REWARD_ALPHA * float(success)) + ((1 - REWARD_ALPHA) * old_score)
-            # print(f"DEBUG: Entry {entry_id} score update: Old={old_score:.4f}, Success={success}, New={new_score:.4f}") # Reduced verbosity
-
-            updated_metadata = current_metadata.copy()
-            updated_metadata["score"] = new_score
-            updated_metadata["updated_at_iso"] = datetime.now(timezone.utc).isoformat()
+                new_score = self._ema_score(str(entry_id), current_metadata.get("score", 0.0), success)
+                # print(f"DEBUG: Entry {entry_id} score update: New={new_score:.4f}, Success={success}") # Reduced verbosity
 
-            if new_score < SCORE_THRESHOLD_EPSILON:
-                # print(f"DEBUG: Entry {entry_id} new score ({new_score:.4f}) is below EPSILON ({SCORE_THRESHOLD_EPSILON}). Deleting from ChromaDB.") # Reduced verbosity
-                self._collection.delete(ids=[str(entry_id)])
-            else:
-                # print(f"DEBUG: Updating entry {entry_id} in ChromaDB with new score: {new_score:.4f}") # Reduced verbosity
-                self._collection.update(
-                    ids=[str(entry_id)],
-                    metadatas=[updated_metadata]
-                )
+                updated_metadata = current_metadata.copy()
+                updated_metadata["score"] = new_score
+                updated_metadata["updated_at_iso"] = datetime.now(timezone.utc).isoformat()
+
+                if new_score < SCORE_THRESHOLD_EPSILON:
+                    # print(f"DEBUG: Entry {entry_id} new score ({new_score:.4f}) is below EPSILON ({SCORE_THRESHOLD_EPSILON}). Deleting from ChromaDB.") # Reduced verbosity
+                    self._delete_entries([str(entry_id)])
+                else:
+                    # print(f"DEBUG: Updating entry {entry_id} with new score: {new_score:.4f}") # Reduced verbosity
+                    self._backend.update_metadata(str(entry_id), updated_metadata)
+                    self._set_tracked_score(str(entry_id), new_score)
+                self._invalidate_decoded([str(entry_id)])
             return True
 
         except Exception as e:
-            print(f"Error during update_reward for entry ID {entry_id} in ChromaDB: {e}") # Keep error
-            return False 
\ No newline at end of file
+            print(f"Error during update_reward for entry ID {entry_id}: {e}") # Keep error
+            return False 
+
+    def _buffer_reward(self, entry_id_str: str, success: bool) -> bool:
+        """Write-behind update_reward: applies the EMA to the in-memory score table only."""
+        with self._reward_lock:
+            current_metadata = self._pending_rewards.get(entry_id_str)
+            if current_metadata is None:
+                try:
+                    current_metadata = self._backend.get_metadata(entry_id_str)
+                except Exception as e:
+                    print(f"Error during update_reward for entry ID {entry_id_str}: {e}") # Keep error
+                    return False
+                if current_metadata is None:
+                    return False
+            elif current_metadata.get("score", 0.0) < SCORE_THRESHOLD_EPSILON:
+                return False # Already evicted; the delete is waiting for the next flush
+
+            # A fresh dict per vote lets flush() tell whether an entry changed while it was writing
+            updated_metadata = dict(current_metadata)
+            updated_metadata["score"] = self._ema_score(entry_id_str, current_metadata.get("score", 0.0), success)
+            updated_metadata["updated_at_iso"] = datetime.now(timezone.utc).isoformat()
+            self._pending_rewards[entry_id_str] = updated_metadata
+            self._set_tracked_score(entry_id_str, updated_metadata["score"])
+            self._invalidate_decoded([entry_id_str])
+            flush_now = len(self._pending_rewards) >= REWARD_FLUSH_MAX_PENDING
+        if flush_now:
+            self.flush()
+        return True
+
+    def flush(self) -> int:
+        """
+        Writes buffered reward updates to the backend: one batched metadata update for surviving
+        entries and one delete for entries whose score fell below SCORE_THRESHOLD_EPSILON.
+        Returns the number of entries written. A no-op when the buffer is disabled or empty.
+        """
+        with self._flush_lock:
+            with self._reward_lock:
+                snapshot = dict(self._pending_rewards)
+            if not snapshot:
+                return 0
+
+            evict_ids = [entry_id_str for entry_id_str, metadata in snapshot.items() if metadata.get("score", 0.0) < SCORE_THRESHOLD_EPSILON]
+            update_ids = [entry_id_str for entry_id_str, metadata in snapshot.items() if metadata.get("score", 0.0) >= SCORE_THRESHOLD_EPSILON]
+            try:
+                if update_ids:
+                    self._backend.update_metadata_many(update_ids, [snapshot[entry_id_str] for entry_id_str in update_ids])
+                self._delete_entries(evict_ids)
+            except Exception as e:
+                print(f"Error flushing {len(snapshot)} buffered reward updates: {e}") # Keep error
+                return 0 # Entries stay buffered and are retried on the next flush
+
+            with self._reward_lock:
+                for entry_id_str, metadata in snapshot.items():
+                    # Votes that arrived during the write stay buffered for the next flush
+                    if self._pending_rewards.get(entry_id_str) is metadata:
+                        del self._pending_rewards[entry_id_str]
+            # print(f"DEBUG: Flushed {len(update_ids)} score updates and {len(evict_ids)} evictions.") # Reduced verbosity
+            return len(snapshot)
+
+    def _reward_flush_loop(self):
+        while not self._reward_flush_stop.wait(self._reward_flush_interval_s):
+            self.flush()
+
+    def close(self):
+        """Stops the background threads (index loader, reward flusher, maintenance) and writes any buffered reward updates."""
+        _stop_thread(self._entry_index_stop, self._index_loader)
+        if self._maintenance is not None:
+            self._maintenance.stop()
+        self._reward_flush_stop.set()
+        if self._reward_flusher is not None and self._reward_flusher is not threading.current_thread():
+            self._reward_flusher.join()
+        self.flush()
+
+class AsyncMemoryCache(MemoryCache):
+    """
+    MemoryCache with asyncio-native alookup/astore/aupdate_reward. Embeddings come from
+    AsyncOpenAI through the shared EmbeddingService (same memo, same counters), and backend
+    calls run in a worker thread so a single event loop can serve many sessions.
+    Results are identical to the synchronous methods.
+    """
+
+    async def _agenerate_embedding(self, text: str) -> Optional[List[float]]:
+        return await self._embedder.aembed(text, model=OPENAI_EMBEDDING_MODEL)
+
+    async def alookup(self, prompt: str, query_embedding: Optional[List[float]] = None) -> Optional[LookupResult]:
+        exact_result = await asyncio.to_thread(self.lookup_exact, prompt)
+        if exact_result is not None:
+            return exact_result
+
+        if query_embedding is None:
+            query_embedding = await self._agenerate_embedding(prompt)
+        if query_embedding is None:
+            print(f"Error: Failed to generate embedding for lookup prompt: '{prompt}'.") # Keep error
+            return None
+        return await asyncio.to_thread(self.lookup, prompt, query_embedding)
+
+    async def astore(self, prompt: str, actions: ActionSequence, embedding: Optional[List[float]] = None,
+                     ttl_s: Optional[float] = None) -> Optional[uuid.UUID]:
+        if embedding is None:
+            embedding = await self._agenerate_embedding(prompt)
+        if embedding is None:
+            print(f"Error: Failed to generate embedding for prompt: '{prompt}'. Not storing.") # Keep error
+            return None
+        return await asyncio.to_thread(self.store, prompt, actions, embedding, ttl_s)
+
+    async def aupdate_reward(self, entry_id: uuid.UUID, success: bool) -> bool:
+        return await asyncio.to_thread(self.update_reward, entry_id, success)
@@ -1,4 +1,5 @@
 from memory_cache import MemoryCache, ActionSequence
+from action_codec import format_action_step
 from dotenv import load_dotenv
 import os
 import time
@@ -31,7 +32,7 @@ def main():
 
     # Initialize MemoryCache
     cache = MemoryCache()
-    print(f"MemoryCache initialized. Initial collection count: {cache._collection.count()}")
+    print(f"MemoryCache initialized. Initial collection count: {cache.count()}")
 
     # Initialize LLM, Tools, and CapturingAgent
     llm = ChatLLM() # Uses OPENAI_API_KEY from environment
@@ -86,9 +87,7 @@ def main():
             # Convert tool_history_dicts to ActionSequence (List[str]) for caching and display
             newly_generated_action_sequence: ActionSequence = []
             for step in tool_history_dicts:
-                action_str = f"Tool: {step.get('tool_name', 'N/A')}, " \
-                             f"Input: '{step.get('tool_input', 'N/A')}', " \
-                             f"Observation: '{step.get('observation', 'N/A')}'"
+                action_str = format_action_step(step.get('tool_name', 'N/A'), step.get('tool_input', 'N/A'), step.get('observation', 'N/A'))
                 newly_generated_action_sequence.append(action_str)
             
             executed_actions_for_display = newly_generated_action_sequence
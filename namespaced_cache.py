@@ -0,0 +1,228 @@
+"""
+Namespaced MemoryCache: one shard (its own collection and index) per namespace.
+
+Plans learned for one game, tenant or agent configuration never become neighbours of another's,
+each shard's index stays as small as its own traffic, and dropping a namespace deletes one
+collection without touching the others.
+
+    cache = NamespacedMemoryCache(persist_path="./chroma_db_data")
+    cache.store("spawn a dragon", actions, namespace="game-a")
+    cache.lookup("spawn a dragon", namespace="game-a")   # routed to one shard
+    cache.lookup("spawn a dragon")                       # fans out over every shard
+    cache.drop_namespace("game-a")
+
+Shard collections are named "<collection_prefix>__<namespace>". Cross-shard lookups check every
+shard's exact-match index first, embed the prompt once and then query the shards in parallel;
+the most similar hit that passes the usual τ/ε thresholds wins.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import re
+import threading
+import uuid
+
+import chromadb
+
+from llm_module.embeddings import EmbeddingService, get_embedding_service
+from memory_cache import (MemoryCache, ActionSequence, LookupResult, DEFAULT_COLLECTION_NAME, DEFAULT_BACKEND,
+                          OPENAI_EMBEDDING_MODEL)
+
+DEFAULT_NAMESPACE = "default"
+NAMESPACE_SEPARATOR = "__" # Collection name = collection_prefix + NAMESPACE_SEPARATOR + namespace
+NAMESPACE_FANOUT_WORKERS = 8 # Threads querying shards in parallel for cross-namespace lookups
+NAMESPACE_ROUTE_CACHE_MAX_ENTRIES = 65536 # Recently returned/stored entry ids remembered for update_reward routing
+MAX_COLLECTION_NAME_LENGTH = 63 # ChromaDB limit
+
+_NAMESPACE_RE = re.compile(r"[A-Za-z0-9](?:[A-Za-z0-9_-]*[A-Za-z0-9])?")
+
+
+class NamespacedMemoryCache:
+    def __init__(self, embedding_service: Optional[EmbeddingService] = None,
+                 persist_path: Optional[str] = None, collection_prefix: str = DEFAULT_COLLECTION_NAME,
+                 backend: str = DEFAULT_BACKEND, fanout_workers: int = NAMESPACE_FANOUT_WORKERS,
+                 **cache_kwargs: Any):
+        """
+        embedding_service, persist_path, backend: as for MemoryCache, shared by every shard.
+        collection_prefix: shard collections are named "<collection_prefix>__<namespace>".
+        cache_kwargs: further MemoryCache options (reward_flush_interval_s, max_entries,
+            default_ttl_s, merge_threshold, ...) applied to each shard; budgets are per shard.
+        Persistent Chroma shards found under persist_path are opened at start-up.
+        """
+        self._embedder = embedding_service if embedding_service is not None else get_embedding_service()
+        self._persist_path = persist_path
+        self._collection_prefix = collection_prefix
+        self._backend_name = backend
+        self._cache_kwargs = cache_kwargs
+        self._shards: Dict[str, MemoryCache] = {}
+        self._shards_lock = threading.Lock()
+        self._fanout = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix="memory-cache-fanout")
+        # entry id -> namespace, so update_reward() usually needs no namespace and no shard probing
+        self._routes: "OrderedDict[str, str]" = OrderedDict()
+        self._routes_lock = threading.Lock()
+
+        if persist_path and backend == "chroma":
+            for namespace in self._persisted_namespaces():
+                self.shard(namespace)
+
+    def _collection_name(self, namespace: str) -> str:
+        if not _NAMESPACE_RE.fullmatch(namespace):
+            raise ValueError(f"Invalid namespace '{namespace}': use letters, digits, '_' and '-', starting and ending with a letter or digit")
+        name = self._collection_prefix + NAMESPACE_SEPARATOR + namespace
+        if len(name) > MAX_COLLECTION_NAME_LENGTH:
+            raise ValueError(f"Namespace '{namespace}' is too long (collection name limit is {MAX_COLLECTION_NAME_LENGTH} characters)")
+        return name
+
+    def _persisted_namespaces(self) -> List[str]:
+        prefix = self._collection_prefix + NAMESPACE_SEPARATOR
+        try:
+            names = [collection.name for collection in chromadb.PersistentClient(path=self._persist_path).list_collections()]
+        except Exception as e:
+            print(f"Error listing namespaces in '{self._persist_path}': {e}") # Keep error
+            return []
+        return sorted(name[len(prefix):] for name in names
+                      if name.startswith(prefix) and _NAMESPACE_RE.fullmatch(name[len(prefix):]))
+
+    def shard(self, namespace: str) -> MemoryCache:
+        """The MemoryCache for namespace, created on first use."""
+        cache = self._shards.get(namespace)
+        if cache is not None:
+            return cache
+        collection_name = self._collection_name(namespace)
+        with self._shards_lock:
+            cache = self._shards.get(namespace)
+            if cache is None:
+                cache = MemoryCache(embedding_service=self._embedder, persist_path=self._persist_path,
+                                    collection_name=collection_name, backend=self._backend_name, **self._cache_kwargs)
+                self._shards[namespace] = cache
+        return cache
+
+    def namespaces(self) -> List[str]:
+        with self._shards_lock:
+            return sorted(self._shards)
+
+    def count(self, namespace: Optional[str] = None) -> int:
+        """Entries in namespace, or across all namespaces."""
+        if namespace is not None:
+            cache = self._shards.get(namespace)
+            return cache.count() if cache is not None else 0
+        return sum(cache.count() for _, cache in self._targets(None))
+
+    def _targets(self, namespaces: Optional[List[str]]) -> List[Tuple[str, MemoryCache]]:
+        with self._shards_lock:
+            if namespaces is None:
+                return list(self._shards.items())
+            return [(namespace, self._shards[namespace]) for namespace in namespaces if namespace in self._shards]
+
+    def _remember_route(self, entry_id: Optional[uuid.UUID], namespace: str):
+        if entry_id is None:
+            return
+        with self._routes_lock:
+            self._routes[str(entry_id)] = namespace
+            self._routes.move_to_end(str(entry_id))
+            while len(self._routes) > NAMESPACE_ROUTE_CACHE_MAX_ENTRIES:
+                self._routes.popitem(last=False)
+
+    def _route(self, entry_id: uuid.UUID) -> Optional[str]:
+        entry_id_str = str(entry_id)
+        with self._routes_lock:
+            namespace = self._routes.get(entry_id_str)
+        if namespace is not None and namespace in self._shards:
+            return namespace
+        # Not seen recently: ask every shard in parallel (one id lookup each)
+        futures = [(namespace, self._fanout.submit(cache.contains, entry_id)) for namespace, cache in self._targets(None)]
+        for namespace, future in futures:
+            if future.result():
+                self._remember_route(entry_id, namespace)
+                return namespace
+        return None
+
+    def lookup(self, prompt: str, namespace: Optional[str] = None,
+               namespaces: Optional[List[str]] = None) -> Optional[LookupResult]:
+        """
+        Routes to one shard when namespace is given; otherwise searches the given namespaces
+        (default: all) in parallel and returns the most similar qualifying hit.
+        """
+        if namespace is not None:
+            namespaces = [namespace]
+        targets = self._targets(namespaces)
+        if not targets:
+            return None
+        if len(targets) == 1:
+            target_namespace, cache = targets[0]
+            result = cache.lookup(prompt)
+            self._remember_route(result["entry_id"] if result else None, target_namespace)
+            return result
+
+        # Exact repeats are a dict lookup per shard, so they never pay for an embedding
+        for target_namespace, cache in targets:
+            result = cache.lookup_exact(prompt)
+            if result is not None:
+                self._remember_route(result["entry_id"], target_namespace)
+                return result
+
+        query_embedding = self._embedder.embed(prompt, model=OPENAI_EMBEDDING_MODEL)
+        if query_embedding is None:
+            print(f"Error: Failed to generate embedding for lookup prompt: '{prompt}'.") # Keep error
+            return None
+        futures = [(target_namespace, self._fanout.submit(cache.lookup, prompt, query_embedding))
+                   for target_namespace, cache in targets]
+        best: Optional[LookupResult] = None
+        best_namespace = None
+        for target_namespace, future in futures:
+            result = future.result()
+            if result is not None and (best is None or result["similarity_score"] > best["similarity_score"]):
+                best, best_namespace = result, target_namespace
+        # print(f"DEBUG: Fan-out lookup over {len(targets)} namespaces, best from '{best_namespace}'.") # Reduced verbosity
+        if best is not None:
+            self._remember_route(best["entry_id"], best_namespace)
+        return best
+
+    def store(self, prompt: str, actions: ActionSequence, namespace: str = DEFAULT_NAMESPACE,
+              embedding: Optional[List[float]] = None, ttl_s: Optional[float] = None) -> Optional[uuid.UUID]:
+        entry_id = self.shard(namespace).store(prompt, actions, embedding=embedding, ttl_s=ttl_s)
+        self._remember_route(entry_id, namespace)
+        return entry_id
+
+    def store_many(self, entries: List[Tuple[str, ActionSequence]], namespace: str = DEFAULT_NAMESPACE,
+                   entry_ids: Optional[List[uuid.UUID]] = None, ttl_s: Optional[float] = None) -> List[Optional[uuid.UUID]]:
+        stored_ids = self.shard(namespace).store_many(entries, entry_ids=entry_ids, ttl_s=ttl_s)
+        for entry_id in stored_ids:
+            self._remember_route(entry_id, namespace)
+        return stored_ids
+
+    def update_reward(self, entry_id: uuid.UUID, success: bool, namespace: Optional[str] = None) -> bool:
+        """Applies the reward in the entry's namespace (looked up when not given)."""
+        if namespace is None:
+            namespace = self._route(entry_id)
+        cache = self._shards.get(namespace) if namespace is not None else None
+        if cache is None:
+            print(f"Error: Entry ID {entry_id} not found in any namespace. Cannot update reward.") # Keep error
+            return False
+        return cache.update_reward(entry_id, success)
+
+    def drop_namespace(self, namespace: str) -> bool:
+        """Deletes a namespace's shard and all its entries; other namespaces are untouched."""
+        with self._shards_lock:
+            cache = self._shards.pop(namespace, None)
+        if cache is None:
+            return False
+        cache.close()
+        try:
+            cache._backend.drop()
+        except Exception as e:
+            print(f"Error dropping namespace '{namespace}': {e}") # Keep error
+            return False
+        with self._routes_lock:
+            for entry_id_str in [key for key, value in self._routes.items() if value == namespace]:
+                del self._routes[entry_id_str]
+        print(f"MemoryCache namespace '{namespace}' dropped.")
+        return True
+
+    def flush(self) -> int:
+        return sum(cache.flush() for _, cache in self._targets(None))
+
+    def close(self):
+        for _, cache in self._targets(None):
+            cache.close()
+        self._fanout.shutdown(wait=True)
@@ -0,0 +1,157 @@
+from typing import List, Optional, Dict, TypedDict, Iterator, AsyncIterator
+import asyncio
+import queue
+import threading
+
+from memory_cache import AsyncMemoryCache, ActionSequence, LookupResult, OPENAI_EMBEDDING_MODEL
+from llm_module.capturing_agent import CapturingAgent, AgentEvent, OPENAI_EMBEDDING_MODEL_FOR_TOOLS
+from action_codec import format_action_step
+
+
+class PipelineResult(TypedDict):
+    lookup_result: Optional[LookupResult] # Set on a cache hit
+    final_answer: Optional[str] # Set when the agent ran (cache miss or use_cache=False)
+    history: List[Dict[str, str]]
+    prompt_embedding: Optional[List[float]] # Pass to cache.store(..., embedding=...) to avoid re-embedding
+
+
+class PipelineEvent(AgentEvent, total=False):
+    result: PipelineResult # Set on the final "result" event, which replaces the agent's "done" event
+
+
+def actions_from_run(final_answer: str, history: List[Dict[str, str]]) -> ActionSequence:
+    """The ActionSequence to show and cache for an agent run (shared by app.py and service.py)."""
+    if history:
+        return [format_action_step(step.get('tool_name', 'N/A'), step.get('tool_input', 'N/A'),
+                                   step.get('observation', 'N/A'), step.get('similarity_score', 'N/A'))
+                for step in history]
+    if not final_answer.startswith("Error:"):
+        return [f"Direct Answer: {final_answer}"]
+    return [f"Agent Error: {final_answer}"]
+
+
+class RequestPipeline:
+    """
+    Runs the cache lookup and the agent's miss path as overlapping stages instead of in series.
+
+    The prompt is embedded once. The cache query (in a worker thread) and the tool-similarity
+    search run concurrently, and if an existing tool matches, its tool-input generation starts
+    speculatively while the cache answer is still pending. A cache hit cancels the speculative
+    LLM call; a miss hands it to CapturingAgent.arun, so the miss path skips one full round trip.
+    """
+
+    def __init__(self, cache: AsyncMemoryCache, agent: CapturingAgent, speculate: bool = True):
+        self.cache = cache
+        self.agent = agent
+        self.speculate = speculate
+        # Event loop for the synchronous process() entry point. Async clients bind to the loop
+        # they first run on, so sync callers (e.g. Streamlit) always reuse this one.
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_lock = threading.Lock()
+
+    async def _aembed_prompt(self, prompt: str):
+        """Returns (cache embedding, tool embedding); one API call when both use the same model."""
+        if OPENAI_EMBEDDING_MODEL == OPENAI_EMBEDDING_MODEL_FOR_TOOLS:
+            embedding = await self.cache._agenerate_embedding(prompt)
+            return embedding, embedding
+        return tuple(await asyncio.gather(
+            self.cache._agenerate_embedding(prompt),
+            self.agent._embedder.aembed(prompt, model=OPENAI_EMBEDDING_MODEL_FOR_TOOLS)
+        ))
+
+    async def _alookup(self, prompt: str, exclude_tool_names: Optional[List[str]], use_cache: bool):
+        """
+        The cache stage: returns (cache hit or None, cache embedding, tool embedding, speculative
+        tool input). On a miss the rest is handed to the agent.
+        """
+        if use_cache:
+            # Exact repeats need no embedding at all
+            exact_result = await asyncio.to_thread(self.cache.lookup_exact, prompt)
+            if exact_result is not None:
+                return exact_result, None, None, None
+
+        cache_embedding, tool_embedding = await self._aembed_prompt(prompt)
+
+        lookup_task = None
+        if use_cache and cache_embedding is not None:
+            lookup_task = asyncio.create_task(self.cache.alookup(prompt, query_embedding=cache_embedding))
+
+        speculative_tool_input = None
+        if self.speculate and tool_embedding:
+            tool_match = self.agent._find_best_tool_by_embedding(tool_embedding, exclude_tool_names=exclude_tool_names)
+            if tool_match:
+                tool = tool_match[0]
+                speculative_tool_input = (tool.name, asyncio.create_task(
+                    self.agent.llm.agenerate(self.agent._tool_input_prompt(prompt, tool))
+                ))
+
+        if lookup_task is not None:
+            lookup_result = await lookup_task
+            if lookup_result is not None:
+                if speculative_tool_input:
+                    speculative_tool_input[1].cancel()
+                return lookup_result, cache_embedding, None, None
+        return None, cache_embedding, tool_embedding, speculative_tool_input
+
+    async def aprocess(self, prompt: str, exclude_tool_names: Optional[List[str]] = None, use_cache: bool = True) -> PipelineResult:
+        """Looks the prompt up in the cache and, on a miss, runs the agent. Nothing is stored."""
+        lookup_result, cache_embedding, tool_embedding, speculative_tool_input = await self._alookup(prompt, exclude_tool_names, use_cache)
+        if lookup_result is not None:
+            return PipelineResult(lookup_result=lookup_result, final_answer=None, history=[], prompt_embedding=cache_embedding)
+
+        final_answer, history = await self.agent.arun(
+            prompt, exclude_tool_names=exclude_tool_names,
+            prompt_embedding=tool_embedding, speculative_tool_input=speculative_tool_input
+        )
+        return PipelineResult(lookup_result=None, final_answer=final_answer, history=history, prompt_embedding=cache_embedding)
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="request-pipeline-loop", daemon=True).start()
+            return self._loop
+
+    def process(self, prompt: str, exclude_tool_names: Optional[List[str]] = None, use_cache: bool = True) -> PipelineResult:
+        """Synchronous wrapper around aprocess() for non-async callers such as app.py."""
+        future = asyncio.run_coroutine_threadsafe(self.aprocess(prompt, exclude_tool_names, use_cache), self._get_loop())
+        return future.result()
+
+    async def aprocess_stream(self, prompt: str, exclude_tool_names: Optional[List[str]] = None,
+                              use_cache: bool = True) -> AsyncIterator[PipelineEvent]:
+        """
+        aprocess() that yields the agent's step events (CapturingAgent.arun_stream) as they happen.
+        The last event is {"event": "result", "result": PipelineResult}; a cache hit yields only that.
+        """
+        lookup_result, cache_embedding, tool_embedding, speculative_tool_input = await self._alookup(prompt, exclude_tool_names, use_cache)
+        if lookup_result is not None:
+            yield PipelineEvent(event="result", result=PipelineResult(lookup_result=lookup_result, final_answer=None, history=[],
+                                                                      prompt_embedding=cache_embedding))
+            return
+
+        async for event in self.agent.arun_stream(prompt, exclude_tool_names=exclude_tool_names, prompt_embedding=tool_embedding,
+                                                  speculative_tool_input=speculative_tool_input):
+            if event["event"] == "done":
+                yield PipelineEvent(event="result", result=PipelineResult(lookup_result=None, final_answer=event["final_answer"],
+                                                                          history=event["history"], prompt_embedding=cache_embedding))
+            else:
+                yield event
+
+    def process_stream(self, prompt: str, exclude_tool_names: Optional[List[str]] = None, use_cache: bool = True) -> Iterator[PipelineEvent]:
+        """Synchronous wrapper around aprocess_stream(); events are handed over to the calling thread as they arrive."""
+        events: "queue.Queue[Optional[PipelineEvent]]" = queue.Queue()
+
+        async def produce():
+            try:
+                async for event in self.aprocess_stream(prompt, exclude_tool_names, use_cache):
+                    events.put(event)
+            finally:
+                events.put(None) # End of stream
+
+        future = asyncio.run_coroutine_threadsafe(produce(), self._get_loop())
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield event
+        future.result() # Re-raises an error that ended the stream early
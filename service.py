@@ -0,0 +1,308 @@
+"""
+Headless HTTP service over MemoryCache and CapturingAgent, for game servers and load balancers.
+
+A plain ASGI application (no web framework); serve it with any ASGI server:
+
+    uvicorn service:app --host 0.0.0.0 --port 8000
+    python3 -m service --port 8000
+
+Endpoints (JSON bodies and responses):
+    POST /lookup         {"prompt"}                                    cache lookup only
+    POST /store          {"prompt", "actions", "ttl_s"?}               store an ActionSequence
+    POST /reward         {"entry_id", "success"}                       reward vote for a cache entry
+    POST /run            {"prompt", "exclude_tool_names"?, "use_cache"?, "store"?}
+                         cache lookup, agent on a miss, store the new plan (RequestPipeline)
+    POST /tool-feedback  {"prompt", "tool_name", "upvoted"}           CapturingAgent tool feedback
+    GET  /health         load and cache size
+
+At most max_concurrency requests are processed at once and up to max_queued more wait for a
+slot; beyond that requests get 429 with Retry-After instead of piling up. On shutdown the service
+stops admitting requests (503), waits up to shutdown_grace_s for in-flight ones and closes the
+cache, which flushes buffered reward votes.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from memory_cache import AsyncMemoryCache, REWARD_FLUSH_INTERVAL_S, MERGE_SIMILARITY_THRESHOLD, DEFAULT_BACKEND
+from request_pipeline import RequestPipeline, actions_from_run
+
+SERVICE_MAX_CONCURRENCY = 64 # Requests processed at once
+SERVICE_MAX_QUEUED = 256 # Requests waiting for a slot before new ones get 429
+SERVICE_MAX_BODY_BYTES = 1 << 20
+SERVICE_SHUTDOWN_GRACE_S = 30.0 # Longest shutdown waits for in-flight requests
+SERVICE_RETRY_AFTER_S = 1 # Retry-After header sent with 429 responses
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Tuple[int, Dict[str, Any]]]]
+
+
+class RequestError(Exception):
+    """A client error reported as a 4xx response."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def _field(body: Dict[str, Any], name: str, expected_type, required: bool = True, default: Any = None) -> Any:
+    value = body.get(name, default)
+    if value is None:
+        if required:
+            raise RequestError(f"Missing field '{name}'")
+        return default
+    # bool is an int subclass, so true/false must not pass for numeric fields
+    if not isinstance(value, expected_type) or (isinstance(value, bool) and expected_type is not bool):
+        raise RequestError(f"Field '{name}' has the wrong type")
+    return value
+
+
+def build_pipeline() -> RequestPipeline:
+    """Cache and agent configured from the environment, as in app.py."""
+    from dotenv import load_dotenv
+    from llm_module.llm import ChatLLM
+    from llm_module.completion_cache import get_completion_cache
+    from llm_module.custom_tools import SetPlayerAttributeTool, SpawnEntityTool, ChangeSkyboxTool, PlaySoundTool
+    from llm_module.capturing_agent import CapturingAgent, DEFAULT_AGENT_PROMPT_TEMPLATE
+
+    load_dotenv()
+    max_entries = os.getenv("MEMORY_CACHE_MAX_ENTRIES")
+    ttl_s = os.getenv("MEMORY_CACHE_TTL_S")
+    cache = AsyncMemoryCache(persist_path=os.getenv("MEMORY_CACHE_PATH"), backend=os.getenv("MEMORY_CACHE_BACKEND", DEFAULT_BACKEND),
+                             reward_flush_interval_s=REWARD_FLUSH_INTERVAL_S,
+                             max_entries=int(max_entries) if max_entries else None,
+                             default_ttl_s=float(ttl_s) if ttl_s else None,
+                             merge_threshold=MERGE_SIMILARITY_THRESHOLD)
+    tools = [SetPlayerAttributeTool(), SpawnEntityTool(), ChangeSkyboxTool(), PlaySoundTool()]
+    agent = CapturingAgent(llm=ChatLLM(completion_cache=get_completion_cache()), tools=tools, prompt_template=DEFAULT_AGENT_PROMPT_TEMPLATE,
+                           structured_decision=True)
+    return RequestPipeline(cache, agent)
+
+
+class CacheService:
+    """The ASGI application. Pass a RequestPipeline to serve existing components (tests, embedding)."""
+
+    def __init__(self, pipeline: Optional[RequestPipeline] = None,
+                 max_concurrency: int = SERVICE_MAX_CONCURRENCY, max_queued: int = SERVICE_MAX_QUEUED,
+                 shutdown_grace_s: float = SERVICE_SHUTDOWN_GRACE_S):
+        self.pipeline = pipeline
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.shutdown_grace_s = shutdown_grace_s
+        self._slots: Optional[asyncio.Semaphore] = None # Created on the server's event loop
+        self._ready_lock: Optional[asyncio.Lock] = None
+        self._in_flight = 0
+        self._queued = 0
+        self._draining = False
+        self._idle: Optional[asyncio.Event] = None
+        self._counters = {"requests": 0, "rejected": 0, "errors": 0}
+        self._routes: Dict[Tuple[str, str], Handler] = {
+            ("POST", "/lookup"): self._lookup,
+            ("POST", "/store"): self._store,
+            ("POST", "/reward"): self._reward,
+            ("POST", "/run"): self._run,
+            ("POST", "/tool-feedback"): self._tool_feedback,
+        }
+
+    async def _ensure_ready(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._ready_lock = asyncio.Lock()
+            self._idle = asyncio.Event()
+            self._idle.set()
+        if self.pipeline is None:
+            async with self._ready_lock:
+                if self.pipeline is None:
+                    self.pipeline = await asyncio.to_thread(build_pipeline)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self._ensure_ready()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def shutdown(self):
+        """Stops admitting requests, waits for in-flight ones, then flushes and closes the cache."""
+        self._draining = True
+        if self._idle is not None:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=self.shutdown_grace_s)
+            except asyncio.TimeoutError:
+                print(f"Warning: Shutting down with {self._in_flight} requests still running.")
+        if self.pipeline is not None:
+            await asyncio.to_thread(self.pipeline.cache.close)
+        print("Service stopped; pending cache writes flushed.")
+
+    async def _http(self, scope, receive, send):
+        await self._ensure_ready()
+        method, path = scope["method"], scope["path"]
+        if (method, path) == ("GET", "/health"):
+            await self._respond(send, 200, await self._health())
+            return
+        handler = self._routes.get((method, path))
+        if handler is None:
+            await self._respond(send, 404, {"error": f"No route for {method} {path}"})
+            return
+        if self._draining:
+            await self._respond(send, 503, {"error": "Service is shutting down"})
+            return
+        # Backpressure: refuse instead of queueing without bound
+        if self._in_flight + self._queued >= self.max_concurrency + self.max_queued:
+            self._counters["rejected"] += 1
+            await self._respond(send, 429, {"error": "Too many requests"}, [(b"retry-after", str(SERVICE_RETRY_AFTER_S).encode())])
+            return
+
+        self._queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            status, payload = await self._dispatch(handler, receive)
+            await self._respond(send, status, payload)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+            if self._in_flight == 0:
+                self._idle.set()
+
+    async def _dispatch(self, handler: Handler, receive) -> Tuple[int, Dict[str, Any]]:
+        self._counters["requests"] += 1
+        try:
+            body = await self._read_json(receive)
+            return await handler(body)
+        except RequestError as e:
+            return e.status, {"error": str(e)}
+        except Exception as e:
+            self._counters["errors"] += 1
+            print(f"Error handling request: {e}") # Keep error
+            return 500, {"error": "Internal error"}
+
+    @staticmethod
+    async def _read_json(receive) -> Dict[str, Any]:
+        chunks: List[bytes] = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise RequestError("Client disconnected")
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > SERVICE_MAX_BODY_BYTES:
+                raise RequestError("Request body too large", status=413)
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+        try:
+            body = json.loads(b"".join(chunks) or b"{}")
+        except ValueError:
+            raise RequestError("Body is not valid JSON")
+        if not isinstance(body, dict):
+            raise RequestError("Body must be a JSON object")
+        return body
+
+    @staticmethod
+    async def _respond(send, status: int, payload: Dict[str, Any], headers: Optional[List[Tuple[bytes, bytes]]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + (headers or [])})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _health(self) -> Dict[str, Any]:
+        entries = await asyncio.to_thread(self.pipeline.cache.count)
+        return {"status": "draining" if self._draining else "ok", "in_flight": self._in_flight,
+                "queued": self._queued, "entries": entries, **self._counters}
+
+    async def _lookup(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        result = await self.pipeline.cache.alookup(_field(body, "prompt", str))
+        if result is None:
+            return 200, {"hit": False}
+        return 200, {"hit": True, "entry_id": str(result["entry_id"]), "actions": result["actions"],
+                     "similarity_score": result["similarity_score"]}
+
+    async def _store(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        actions = _field(body, "actions", list)
+        if not actions or not all(isinstance(action, str) for action in actions):
+            raise RequestError("Field 'actions' must be a non-empty list of strings")
+        ttl_s = _field(body, "ttl_s", (int, float), required=False)
+        if ttl_s is not None and not ttl_s > 0: # Also rejects NaN
+            raise RequestError("Field 'ttl_s' must be a positive number of seconds")
+        entry_id = await self.pipeline.cache.astore(_field(body, "prompt", str), actions, ttl_s=ttl_s)
+        if entry_id is None:
+            return 500, {"error": "Entry could not be stored"}
+        return 200, {"entry_id": str(entry_id)}
+
+    async def _reward(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        try:
+            entry_id = uuid.UUID(_field(body, "entry_id", str))
+        except ValueError:
+            raise RequestError("Field 'entry_id' is not a UUID")
+        updated = await self.pipeline.cache.aupdate_reward(entry_id, _field(body, "success", bool))
+        return (200 if updated else 404), {"updated": updated}
+
+    async def _run(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        prompt = _field(body, "prompt", str)
+        exclude_tool_names = _field(body, "exclude_tool_names", list, required=False)
+        if exclude_tool_names is not None and not all(isinstance(name, str) for name in exclude_tool_names):
+            raise RequestError("Field 'exclude_tool_names' must be a list of strings")
+        use_cache = _field(body, "use_cache", bool, required=False, default=True)
+        store = _field(body, "store", bool, required=False, default=True)
+        started = time.perf_counter()
+        result = await self.pipeline.aprocess(prompt, exclude_tool_names=exclude_tool_names, use_cache=use_cache)
+        lookup_result = result["lookup_result"]
+        if lookup_result is not None:
+            return 200, {"from_cache": True, "entry_id": str(lookup_result["entry_id"]), "actions": lookup_result["actions"],
+                         "similarity_score": lookup_result["similarity_score"], "seconds": time.perf_counter() - started}
+
+        final_answer = result["final_answer"]
+        actions = actions_from_run(final_answer, result["history"])
+        entry_id = None
+        # Same rule as app.py: plans from loop exhaustion are not worth caching
+        if store and not final_answer.startswith("Error: Agent reached maximum loops"):
+            entry_id = await self.pipeline.cache.astore(prompt, actions, embedding=result["prompt_embedding"])
+        return 200, {"from_cache": False, "entry_id": str(entry_id) if entry_id else None, "actions": actions,
+                     "final_answer": final_answer, "seconds": time.perf_counter() - started}
+
+    async def _tool_feedback(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        await asyncio.to_thread(self.pipeline.agent.record_tool_usage_feedback, _field(body, "prompt", str),
+                                _field(body, "tool_name", str), _field(body, "upvoted", bool))
+        return 200, {"recorded": True}
+
+
+app = CacheService()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Processes; use MEMORY_CACHE_BACKEND=mmap to share one cache")
+    args = parser.parse_args()
+    uvicorn.run("service:app", host=args.host, port=args.port, workers=args.workers,
+                timeout_graceful_shutdown=int(SERVICE_SHUTDOWN_GRACE_S))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""Shared fixtures: a deterministic hash embedder so MemoryCache tests make no OpenAI calls."""
+import hashlib
+
+import numpy as np
+import pytest
+
+DIM = 32
+
+
+class HashEmbedder:
+    """Unit vectors seeded by the text's hash: equal texts embed equally, different ones are near-orthogonal."""
+
+    def embed(self, text, model=None):
+        seed = int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16) % (2 ** 32)
+        vector = np.random.default_rng(seed).standard_normal(DIM)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_many(self, texts, model=None):
+        return [self.embed(text, model) for text in texts]
+
+
+@pytest.fixture
+def embedder():
+    return HashEmbedder()
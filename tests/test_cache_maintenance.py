@@ -0,0 +1,30 @@
+"""Capacity eviction works from running totals and a bounded sample, not a scan of every entry."""
+from memory_cache import MemoryCache
+
+
+def test_eviction_keeps_running_totals_and_drops_lowest_scores(embedder):
+    cache = MemoryCache(embedding_service=embedder, backend="numpy", collection_name="evict", max_entries=40,
+                        maintenance_interval_s=3600)
+    entry_ids = [str(cache.store(f"prompt number {i}", [f"Tool: Test, Input: '{i}'"])) for i in range(50)]
+    for i, entry_id in enumerate(entry_ids):
+        cache._set_tracked_score(entry_id, i / 50)
+
+    assert cache._maintenance.run_once()["evicted"] == 10
+    assert cache.count() == 40
+    assert sorted(cache._entry_stats) == sorted(entry_ids[10:]) # Sample covers the whole (small) cache
+    stats = cache.maintenance_stats()
+    assert stats["entries"] == 40
+    assert stats["bytes_estimate"] == sum(s.nbytes for s in cache._entry_stats.values())
+    assert sorted(cache._entry_ids) == sorted(cache._entry_stats)
+    cache.close()
+
+
+def test_eviction_samples_large_caches(embedder):
+    cache = MemoryCache(embedding_service=embedder, backend="numpy", collection_name="evict_sample", max_entries=90,
+                        maintenance_interval_s=3600)
+    cache.store_many([(f"prompt number {i}", [f"Tool: Test, Input: '{i}'"]) for i in range(100)])
+    cache._maintenance.eviction_sample_size = 20
+    cache._maintenance.max_evictions_per_tick = 4
+    assert cache._maintenance.run_once()["evicted"] == 4
+    assert cache.maintenance_stats()["entries"] == 96
+    cache.close()
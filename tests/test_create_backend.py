@@ -0,0 +1,16 @@
+"""A persist_path given to an in-memory backend is a deploy mistake that would lose every plan on restart."""
+import pytest
+
+from vector_backends import create_backend, MmapBackend
+
+
+@pytest.mark.parametrize("backend", ["numpy", "hnsw", "ivf"])
+def test_in_memory_backend_rejects_persist_path(tmp_path, backend):
+    with pytest.raises(ValueError, match="persist_path"):
+        create_backend(backend, collection_name="misconfigured", persist_path=str(tmp_path))
+
+
+def test_mmap_requires_persist_path(tmp_path):
+    with pytest.raises(ValueError, match="persist_path"):
+        create_backend("mmap", collection_name="shared")
+    assert isinstance(create_backend("mmap", collection_name="shared", persist_path=str(tmp_path)), MmapBackend)
@@ -0,0 +1,37 @@
+"""
+The exact-match path answers with similarity 1.0 and skips the similarity threshold, so prompts
+that differ only in a number's sign, decimal point or separators must never share a key.
+"""
+import pytest
+
+from memory_cache import MemoryCache, _exact_match_key
+
+
+@pytest.mark.parametrize("first, second", [
+    ("spawn at -5,0,0", "spawn at 5,0,0"),
+    ("Set health to 7.5", "Set health to 75"),
+    ("teleport to 1,20", "teleport to 12,0"),
+    ("set volume to -3", "set volume to 3"),
+])
+def test_numeric_punctuation_keeps_keys_apart(first, second):
+    assert _exact_match_key(first) != _exact_match_key(second)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("Spawn a dragon!", "spawn a   dragon"),
+    ("Set health to 75.", "set health to 75"),
+    ("what's the weather?", "whats the weather"),
+    ("spawn at -5,0,0", "Spawn at -5,0,0!"),
+])
+def test_cosmetic_differences_share_a_key(first, second):
+    assert _exact_match_key(first) == _exact_match_key(second)
+
+
+def test_lookup_exact_does_not_answer_a_different_number(embedder):
+    cache = MemoryCache(embedding_service=embedder, backend="numpy", collection_name="exact_numbers")
+    cache.store("spawn at -5,0,0", ["Tool: Spawn, Input: '-5,0,0'"])
+    cache.store("Set health to 7.5", ["Tool: SetHealth, Input: '7.5'"])
+    assert cache.lookup_exact("Spawn at -5,0,0.")["actions"] == ["Tool: Spawn, Input: '-5,0,0'"]
+    assert cache.lookup_exact("spawn at 5,0,0") is None
+    assert cache.lookup_exact("Set health to 75") is None
+    cache.close()
@@ -0,0 +1,30 @@
+"""
+Regression check: an MmapBackend whose entries only receive metadata updates (votes) must still
+compact, so its log stops growing and newly opened workers replay one record per entry.
+"""
+import os
+
+from cache_maintenance import COMPACTION_DELETED_FRACTION
+from vector_backends import MmapBackend
+
+
+def test_metadata_updates_trigger_compaction(tmp_path):
+    backend = MmapBackend("votes", str(tmp_path))
+    backend.add(["1", "2"], [[1.0, 0.0], [0.0, 1.0]], [{"score": 0}, {"score": 0}])
+    assert not backend.needs_compaction(COMPACTION_DELETED_FRACTION)
+
+    for score in range(1, 301):
+        backend.update_metadata("1", {"score": score})
+    assert backend.deleted_fraction() == 0.0
+    assert backend.needs_compaction(COMPACTION_DELETED_FRACTION)
+
+    log_path = os.path.join(str(tmp_path), "votes.mmap", "log.0.jsonl")
+    log_size = os.path.getsize(log_path)
+    assert backend.compact()
+    assert not backend.needs_compaction(COMPACTION_DELETED_FRACTION)
+    assert not backend.compact()
+    assert os.path.getsize(os.path.join(str(tmp_path), "votes.mmap", "log.1.jsonl")) < log_size / 50
+
+    reopened = MmapBackend("votes", str(tmp_path))
+    assert reopened.get_metadata("1") == {"score": 300}
+    assert [entry_id for entry_id, _, _ in reopened.query([1.0, 0.0], 2)] == ["1", "2"]
@@ -0,0 +1,84 @@
+"""Write-behind reward buffer: flush() against concurrent votes, evictions and near-duplicate merges."""
+import json
+
+import numpy as np
+
+from memory_cache import MemoryCache, REWARD_ALPHA, SCORE_THRESHOLD_EPSILON
+
+ACTIONS = ["Tool: Test, Input: 'spawn dragon'"]
+
+
+def _buffered_cache(embedder, name, **kwargs):
+    # A long interval keeps the background flusher out of the way; the tests call flush() themselves
+    return MemoryCache(embedding_service=embedder, backend="numpy", collection_name=name,
+                       reward_flush_interval_s=3600, maintenance_interval_s=3600, **kwargs)
+
+
+def _near(embedding, seed=0, scale=0.05):
+    vector = np.asarray(embedding) + scale * np.random.default_rng(seed).standard_normal(len(embedding))
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def test_vote_during_flush_stays_buffered(embedder):
+    cache = _buffered_cache(embedder, "votes")
+    entry_id = cache.store("spawn a dragon", ACTIONS)
+    assert cache.update_reward(entry_id, True)
+
+    write_metadata = cache._backend.update_metadata_many
+    def write_with_concurrent_vote(ids, metadatas):
+        write_metadata(ids, metadatas)
+        assert cache.update_reward(entry_id, False) # Lands between the snapshot and the buffer cleanup
+    cache._backend.update_metadata_many = write_with_concurrent_vote
+
+    assert cache.flush() == 1
+    cache._backend.update_metadata_many = write_metadata
+    expected = (1 - REWARD_ALPHA) * (REWARD_ALPHA + (1 - REWARD_ALPHA) * 1.0)
+    assert str(entry_id) in cache._pending_rewards
+    assert cache.flush() == 1
+    assert not cache._pending_rewards
+    assert cache._backend.get_metadata(str(entry_id))["score"] == expected
+    cache.close()
+
+
+def test_eviction_is_applied_in_the_same_flush(embedder):
+    cache = _buffered_cache(embedder, "evictions")
+    doomed = cache.store("spawn a dragon", ACTIONS)
+    kept = cache.store("change the skybox", ["Tool: Sky, Input: 'night'"])
+    while cache._pending_rewards.get(str(doomed), {}).get("score", 1.0) >= SCORE_THRESHOLD_EPSILON:
+        assert cache.update_reward(doomed, False)
+    assert cache.update_reward(kept, True)
+    assert cache.count() == 2 # Nothing reaches the backend before the flush
+    assert not cache.update_reward(doomed, True) # Already evicted, waiting for the flush
+
+    assert cache.flush() == 2
+    assert cache.count() == 1
+    assert cache._backend.get_metadata(str(doomed)) is None
+    assert str(doomed) not in cache._entry_stats
+    assert cache.lookup_exact("spawn a dragon") is None
+    assert cache._backend.get_metadata(str(kept))["score"] == 1.0
+    cache.close()
+
+
+def test_merge_during_pending_vote_keeps_aliases_and_score(embedder):
+    cache = _buffered_cache(embedder, "merges", merge_threshold=0.9)
+    embedding = embedder.embed("spawn a dragon")
+    entry_id = cache.store("spawn a dragon", ACTIONS, embedding=embedding)
+    assert cache.update_reward(entry_id, False)
+    voted_score = (1 - REWARD_ALPHA) * 1.0
+
+    merged_id = cache.store("summon a dragon", ACTIONS, embedding=_near(embedding))
+    assert merged_id == entry_id
+    pooled_score = (voted_score + 1.0) / 2 # The vote is pooled, not overwritten by the merge
+    assert cache.flush() == 0 # The merge wrote the pending vote through
+    metadata = cache._backend.get_metadata(str(entry_id))
+    assert metadata["score"] == pooled_score
+    assert json.loads(metadata["alias_prompts_json"]) == ["summon a dragon"]
+
+    assert cache.update_reward(entry_id, True) # A vote after the merge starts from the merged metadata
+    assert cache.flush() == 1
+    metadata = cache._backend.get_metadata(str(entry_id))
+    assert metadata["score"] == REWARD_ALPHA + (1 - REWARD_ALPHA) * pooled_score
+    assert metadata["merge_count"] == 2
+    assert json.loads(metadata["alias_prompts_json"]) == ["summon a dragon"]
+    assert cache.lookup_exact("summon a dragon")["entry_id"] == entry_id
+    cache.close()
@@ -0,0 +1,1179 @@
+from typing import List, Optional, Dict, Tuple, Any, Iterable, Set
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import chromadb
+
+# A query result row: (entry id, distance, metadata). Distances are squared L2, which is what a
+# default ChromaDB collection reports, so MemoryCache's `similarity = 1 - distance` means the same
+# thing whichever backend is used.
+QueryResult = Tuple[str, float, Dict[str, Any]]
+
+BACKEND_NAMES = ("chroma", "numpy", "hnsw", "ivf", "mmap")
+CHROMA_SCAN_PAGE_SIZE = 10000 # Entries fetched per page when scanning a whole collection
+INITIAL_BACKEND_CAPACITY = 1024 # Rows allocated up front by the in-process backends
+HNSW_M = 16 # Graph degree
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64 # Query-time beam width (raised to n_results if smaller)
+CHROMA_COMPACTION_SUFFIX = "__compacting" # Staging collection used while ChromaBackend.compact() copies live entries
+IVF_NPROBE = 16 # Inverted lists scanned per IVF query
+IVF_MIN_TRAIN_SIZE = 4096 # Below this many entries the IVF backend is a single flat list
+IVF_RETRAIN_GROWTH = 2.0 # Re-train IVF centroids once the entry count has grown (or shrunk) by this factor
+IVF_MAX_LISTS = 4096 # Upper bound on IVF lists (sqrt(entries) otherwise)
+IVF_KMEANS_ITERATIONS = 10
+IVF_TRAIN_SAMPLE = 65536 # Vectors sampled for k-means training
+IVF_ASSIGN_CHUNK = 16384 # Rows per distance block when assigning vectors to centroids
+MMAP_REFRESH_INTERVAL_S = 0.5 # Longest a MmapBackend reader goes without picking up other processes' writes
+MMAP_COPY_CHUNK = 65536 # Rows copied per step when MmapBackend.compact() writes a new generation
+MMAP_MIN_SUPERSEDED_RECORDS = 256 # MmapBackend compacts for log growth only once at least this many log records are superseded
+
+
+class VectorBackend:
+    """
+    Storage and nearest-neighbour search for MemoryCache entries.
+
+    Each entry is an id, an embedding and a flat metadata dict (the ChromaDB metadata layout:
+    prompt_raw, actions_json, score, timestamps).
+    """
+
+    # True for backends whose index needs periodic rebuilds (see needs_compaction); MemoryCache
+    # starts its maintenance worker up front for them.
+    REBUILDS_IN_BACKGROUND = False
+
+    def count(self) -> int:
+        raise NotImplementedError("count() method not implemented in subclass")
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]],
+            skip_existing: bool = False) -> List[str]:
+        """
+        Inserts new entries and returns the ids actually added, in order. Ids that are already
+        stored (or repeated within ids) are skipped and their entries left unchanged, so re-adding
+        is idempotent. Backends that need an extra round trip to find them (Chroma) only check when
+        skip_existing is set, i.e. when the caller supplied ids that may exist; fresh uuid4s need not.
+        """
+        raise NotImplementedError("add() method not implemented in subclass")
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        """The subset of ids that are stored, in one lookup."""
+        return {entry_id for entry_id in ids if self.get_metadata(entry_id) is not None}
+
+    def query(self, embedding: List[float], n_results: int) -> List[QueryResult]:
+        """Returns up to n_results nearest entries, closest first."""
+        raise NotImplementedError("query() method not implemented in subclass")
+
+    def query_many(self, embeddings: List[List[float]], n_results: int) -> List[List[QueryResult]]:
+        """query() for several embeddings at once; backends override this with a single batched search."""
+        return [self.query(embedding, n_results) for embedding in embeddings]
+
+    def get_metadata(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError("get_metadata() method not implemented in subclass")
+
+    def update_metadata(self, entry_id: str, metadata: Dict[str, Any]):
+        raise NotImplementedError("update_metadata() method not implemented in subclass")
+
+    def update_metadata_many(self, entry_ids: List[str], metadatas: List[Dict[str, Any]]):
+        """Replaces the metadata of several entries; backends with a batched write override this."""
+        for entry_id, metadata in zip(entry_ids, metadatas):
+            self.update_metadata(entry_id, metadata)
+
+    def get_embedding(self, entry_id: str) -> Optional[List[float]]:
+        raise NotImplementedError("get_embedding() method not implemented in subclass")
+
+    def update_entry(self, entry_id: str, embedding: List[float], metadata: Dict[str, Any]):
+        """Replaces both the vector and the metadata of an existing entry, keeping its id."""
+        raise NotImplementedError("update_entry() method not implemented in subclass")
+
+    def delete(self, ids: List[str]):
+        raise NotImplementedError("delete() method not implemented in subclass")
+
+    def all_metadata(self) -> Iterable[Tuple[str, Dict[str, Any]]]:
+        """(entry id, metadata) for every stored entry, possibly read page by page; used to rebuild in-process indexes."""
+        raise NotImplementedError("all_metadata() method not implemented in subclass")
+
+    def deleted_fraction(self) -> float:
+        """Share of the index still occupied by deleted entries; 0.0 for backends that do not fragment."""
+        return 0.0
+
+    def needs_compaction(self, deleted_fraction_threshold: float) -> bool:
+        """Whether the maintenance worker should call compact() now."""
+        return self.deleted_fraction() >= deleted_fraction_threshold
+
+    def compact(self) -> bool:
+        """Rebuilds the index from live entries only. Returns True if a rebuild happened."""
+        return False
+
+    def drop(self):
+        """Deletes every entry and the backing storage. In-process indexes are freed with the object."""
+
+
+def _new_positions(ids: List[str], existing) -> List[int]:
+    """Positions of the ids that are neither in existing nor repeated earlier in ids."""
+    seen = set()
+    positions = []
+    for position, entry_id in enumerate(ids):
+        if entry_id not in existing and entry_id not in seen:
+            seen.add(entry_id)
+            positions.append(position)
+    return positions
+
+
+class ChromaBackend(VectorBackend):
+    """The original ChromaDB collection, in-memory or persistent."""
+
+    def __init__(self, collection_name: str, persist_path: Optional[str] = None):
+        if persist_path:
+            self._chroma_client = chromadb.PersistentClient(path=persist_path)
+        else:
+            self._chroma_client = chromadb.Client() # For in-memory client
+        self._collection_name = collection_name
+        self._recover_interrupted_compaction()
+        # Writes take _write_lock and are logged while compact() copies, so the copy misses none;
+        # reads go through _reading() so compact() drops the old collection only once they finish.
+        self._write_lock = threading.RLock()
+        self._readers_changed = threading.Condition()
+        self._readers: Dict[int, int] = {} # id(collection) -> reads in flight on it
+        self._compaction_log: Optional[List[Tuple]] = None # Writes made while compact() copies
+        self._deleted_since_compaction = 0
+        self._collection = self._chroma_client.get_or_create_collection(
+            name=collection_name,
+            # Optionally, specify the embedding function if not using OpenAI's default with Chroma
+            # metadata={"hnsw:space": "cosine"} # Ensure cosine distance if needed
+        )
+
+    @contextmanager
+    def _reading(self):
+        """Yields the current collection, registered as in use until the block exits."""
+        with self._readers_changed:
+            collection = self._collection
+            self._readers[id(collection)] = self._readers.get(id(collection), 0) + 1
+        try:
+            yield collection
+        finally:
+            with self._readers_changed:
+                self._readers[id(collection)] -= 1
+                if not self._readers[id(collection)]:
+                    del self._readers[id(collection)]
+                    self._readers_changed.notify_all()
+
+    def _log_write(self, op: Tuple):
+        """Records a write for compact() to replay on its copy. Caller holds _write_lock."""
+        if self._compaction_log is not None:
+            self._compaction_log.append(op)
+
+    def count(self) -> int:
+        with self._reading() as collection:
+            return collection.count()
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]],
+            skip_existing: bool = False) -> List[str]:
+        with self._write_lock:
+            keep = _new_positions(ids, self.existing_ids(ids) if skip_existing else ())
+            if keep:
+                ids, embeddings, metadatas = [ids[i] for i in keep], [embeddings[i] for i in keep], [metadatas[i] for i in keep]
+                self._collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas)
+                self._log_write(("add", ids, embeddings, metadatas))
+                return ids
+            return []
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        with self._reading() as collection:
+            return set(collection.get(ids=list(ids), include=[])['ids']) if ids else set()
+
+    def query(self, embedding: List[float], n_results: int) -> List[QueryResult]:
+        with self._reading() as collection:
+            results = collection.query(
+                query_embeddings=[embedding],
+                n_results=n_results,
+                include=["metadatas", "distances"]
+            )
+        if not results or not results.get('ids') or not results['ids'][0]:
+            return []
+        return list(zip(results['ids'][0], results['distances'][0], results['metadatas'][0]))
+
+    def query_many(self, embeddings: List[List[float]], n_results: int) -> List[List[QueryResult]]:
+        if not embeddings:
+            return []
+        with self._reading() as collection:
+            results = collection.query(
+                query_embeddings=embeddings,
+                n_results=n_results,
+                include=["metadatas", "distances"]
+            )
+        if not results or not results.get('ids'):
+            return [[] for _ in embeddings]
+        return [list(zip(ids, distances, metadatas))
+                for ids, distances, metadatas in zip(results['ids'], results['distances'], results['metadatas'])]
+
+    def get_metadata(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        with self._reading() as collection:
+            entry_data = collection.get(ids=[entry_id], include=["metadatas"])
+        if not entry_data or not entry_data['ids']:
+            return None
+        return entry_data['metadatas'][0]
+
+    def update_metadata(self, entry_id: str, metadata: Dict[str, Any]):
+        self.update_metadata_many([entry_id], [metadata])
+
+    def update_metadata_many(self, entry_ids: List[str], metadatas: List[Dict[str, Any]]):
+        with self._write_lock:
+            self._collection.update(ids=entry_ids, metadatas=metadatas)
+            self._log_write(("update", entry_ids, None, metadatas))
+
+    def get_embedding(self, entry_id: str) -> Optional[List[float]]:
+        with self._reading() as collection:
+            entry_data = collection.get(ids=[entry_id], include=["embeddings"])
+        if not entry_data or not len(entry_data['ids']):
+            return None
+        return list(entry_data['embeddings'][0])
+
+    def update_entry(self, entry_id: str, embedding: List[float], metadata: Dict[str, Any]):
+        with self._write_lock:
+            self._collection.update(ids=[entry_id], embeddings=[embedding], metadatas=[metadata])
+            self._log_write(("update", [entry_id], [embedding], [metadata]))
+
+    def delete(self, ids: List[str]):
+        with self._write_lock:
+            self._collection.delete(ids=ids)
+            self._deleted_since_compaction += len(ids)
+            self._log_write(("delete", ids))
+
+    def all_metadata(self) -> Iterable[Tuple[str, Dict[str, Any]]]:
+        # Pages by id rather than offset, so entries deleted during the scan cannot shift later pages
+        # (and a compaction in between only swaps the collection the next page is read from)
+        with self._reading() as collection:
+            ids = collection.get(include=[])['ids']
+        for start in range(0, len(ids), CHROMA_SCAN_PAGE_SIZE):
+            with self._reading() as collection:
+                page = collection.get(ids=ids[start:start + CHROMA_SCAN_PAGE_SIZE], include=["metadatas"])
+            yield from zip(page['ids'], page['metadatas'])
+
+    def deleted_fraction(self) -> float:
+        # Chroma does not expose its tombstone count; deletes since the last compaction approximate it
+        deleted = self._deleted_since_compaction
+        return deleted / (deleted + self.count()) if deleted else 0.0
+
+    def drop(self):
+        with self._write_lock:
+            existing = {collection.name for collection in self._chroma_client.list_collections()}
+            for name in (self._collection_name, self._collection_name + CHROMA_COMPACTION_SUFFIX):
+                if name in existing:
+                    self._chroma_client.delete_collection(name)
+
+    def _recover_interrupted_compaction(self):
+        """A staging collection left by a crash is complete only if the original was already dropped."""
+        existing = {collection.name for collection in self._chroma_client.list_collections()}
+        staging_name = self._collection_name + CHROMA_COMPACTION_SUFFIX
+        if staging_name not in existing:
+            return
+        if self._collection_name in existing:
+            self._chroma_client.delete_collection(staging_name)
+        else:
+            self._chroma_client.get_collection(staging_name).modify(name=self._collection_name)
+
+    @staticmethod
+    def _replay(collection, op: Tuple):
+        if op[0] == "add":
+            collection.upsert(ids=op[1], embeddings=op[2], metadatas=op[3])
+        elif op[0] == "update":
+            if op[2] is not None:
+                collection.update(ids=op[1], embeddings=op[2], metadatas=op[3])
+            else:
+                collection.update(ids=op[1], metadatas=op[3])
+        elif op[0] == "delete":
+            collection.delete(ids=op[1])
+
+    def compact(self) -> bool:
+        """
+        Copies live entries into a fresh collection and swaps it in, dropping the old segment and
+        its deleted-entry tombstones. The copy runs page by page outside _write_lock; writes made
+        meanwhile are logged and replayed onto the copy before the swap. The old collection is
+        dropped once reads still using it have finished.
+        """
+        staging_name = self._collection_name + CHROMA_COMPACTION_SUFFIX
+        with self._write_lock:
+            old_collection = self._collection
+            ids = old_collection.get(include=[])['ids']
+            staging = self._chroma_client.get_or_create_collection(name=staging_name, metadata=old_collection.metadata)
+            self._compaction_log = []
+        try:
+            # Pages by id: entries deleted meanwhile are simply missing, later writes come from the log
+            for start in range(0, len(ids), CHROMA_SCAN_PAGE_SIZE):
+                page = old_collection.get(ids=ids[start:start + CHROMA_SCAN_PAGE_SIZE], include=["embeddings", "metadatas"])
+                if len(page['ids']):
+                    staging.add(ids=page['ids'], embeddings=page['embeddings'], metadatas=page['metadatas'])
+            with self._write_lock:
+                for op in self._compaction_log:
+                    self._replay(staging, op)
+                self._deleted_since_compaction = sum(len(op[1]) for op in self._compaction_log if op[0] == "delete")
+                self._compaction_log = None
+                with self._readers_changed:
+                    self._collection = staging
+                    self._readers_changed.wait_for(lambda: id(old_collection) not in self._readers)
+                self._chroma_client.delete_collection(self._collection_name)
+                staging.modify(name=self._collection_name)
+        except Exception:
+            with self._write_lock:
+                if self._compaction_log is not None: # Failed before the swap: the old collection stays current
+                    self._compaction_log = None
+                    self._chroma_client.delete_collection(staging_name)
+            raise
+        return True
+
+
+class NumpyFlatBackend(VectorBackend):
+    """
+    Exact in-process index: a contiguous float32 matrix scanned with one matmul per query.
+    Deletes swap the last row into the freed slot, so the matrix never fragments.
+    """
+
+    def __init__(self, initial_capacity: int = INITIAL_BACKEND_CAPACITY):
+        self._initial_capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None # (capacity, dim), allocated on first add
+        self._sq_norms = np.zeros(0, dtype=np.float32)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._metadatas: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _ensure_capacity(self, extra_rows: int, dim: int):
+        size = len(self._ids)
+        if self._matrix is not None and size + extra_rows <= self._matrix.shape[0]:
+            return
+        current = 0 if self._matrix is None else self._matrix.shape[0]
+        capacity = max(self._initial_capacity, size + extra_rows, 2 * current)
+        matrix = np.zeros((capacity, dim), dtype=np.float32)
+        sq_norms = np.zeros(capacity, dtype=np.float32)
+        if self._matrix is not None:
+            matrix[:size] = self._matrix[:size]
+            sq_norms[:size] = self._sq_norms[:size]
+        self._matrix, self._sq_norms = matrix, sq_norms
+
+    def count(self) -> int:
+        return len(self._ids)
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]],
+            skip_existing: bool = False) -> List[str]:
+        rows = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            keep = _new_positions(ids, self._rows)
+            if len(keep) < len(ids):
+                ids, rows, metadatas = [ids[i] for i in keep], rows[keep], [metadatas[i] for i in keep]
+            if not ids:
+                return []
+            self._ensure_capacity(len(ids), rows.shape[1])
+            start = len(self._ids)
+            self._matrix[start:start + len(ids)] = rows
+            self._sq_norms[start:start + len(ids)] = np.einsum("ij,ij->i", rows, rows)
+            for offset, (entry_id, metadata) in enumerate(zip(ids, metadatas)):
+                self._rows[entry_id] = start + offset
+                self._ids.append(entry_id)
+                self._metadatas[entry_id] = dict(metadata)
+        return list(ids)
+
+    def query(self, embedding: List[float], n_results: int) -> List[QueryResult]:
+        with self._lock:
+            size = len(self._ids)
+            if size == 0:
+                return []
+            query = np.asarray(embedding, dtype=np.float32)
+            # Squared L2 via |x|^2 + |q|^2 - 2 x.q
+            distances = self._sq_norms[:size] + float(query @ query) - 2.0 * (self._matrix[:size] @ query)
+            k = min(n_results, size)
+            top = np.argpartition(distances, k - 1)[:k]
+            top = top[np.argsort(distances[top])]
+            return [(self._ids[row], float(max(distances[row], 0.0)), dict(self._metadatas[self._ids[row]])) for row in top]
+
+    def query_many(self, embeddings: List[List[float]], n_results: int) -> List[List[QueryResult]]:
+        with self._lock:
+            size = len(self._ids)
+            if size == 0 or not embeddings:
+                return [[] for _ in embeddings]
+            queries = np.asarray(embeddings, dtype=np.float32)
+            # (n_queries, size) squared L2 distances from one matmul
+            distances = (self._sq_norms[:size][None, :] + np.einsum("ij,ij->i", queries, queries)[:, None]
+                         - 2.0 * (queries @ self._matrix[:size].T))
+            k = min(n_results, size)
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            top_distances = np.take_along_axis(distances, top, axis=1)
+            order = np.argsort(top_distances, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_distances = np.maximum(np.take_along_axis(top_distances, order, axis=1), 0.0)
+            return [[(self._ids[row], float(distance), dict(self._metadatas[self._ids[row]]))
+                     for row, distance in zip(rows.tolist(), row_distances.tolist())]
+                    for rows, row_distances in zip(top, top_distances)]
+
+    def get_metadata(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            metadata = self._metadatas.get(entry_id)
+            return dict(metadata) if metadata is not None else None
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        with self._lock:
+            return {entry_id for entry_id in ids if entry_id in self._metadatas}
+
+    def update_metadata(self, entry_id: str, metadata: Dict[str, Any]):
+        with self._lock:
+            if entry_id in self._metadatas:
+                self._metadatas[entry_id] = dict(metadata)
+
+    def get_embedding(self, entry_id: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._rows.get(entry_id)
+            return self._matrix[row].tolist() if row is not None else None
+
+    def update_entry(self, entry_id: str, embedding: List[float], metadata: Dict[str, Any]):
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            row = self._rows.get(entry_id)
+            if row is None:
+                return
+            self._matrix[row] = vector
+            self._sq_norms[row] = float(vector @ vector)
+            self._metadatas[entry_id] = dict(metadata)
+
+    def all_metadata(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            return [(entry_id, dict(metadata)) for entry_id, metadata in self._metadatas.items()]
+
+    def _snapshot(self) -> Tuple[List[str], np.ndarray, List[Dict[str, Any]]]:
+        """Copies of (ids, vectors, metadatas) in row order."""
+        with self._lock:
+            size = len(self._ids)
+            matrix = self._matrix[:size].copy() if self._matrix is not None else np.zeros((0, 0), dtype=np.float32)
+            return list(self._ids), matrix, [self._metadatas[entry_id] for entry_id in self._ids]
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            for entry_id in ids:
+                row = self._rows.pop(entry_id, None)
+                if row is None:
+                    continue
+                del self._metadatas[entry_id]
+                last = len(self._ids) - 1
+                if row != last:
+                    moved_id = self._ids[last]
+                    self._matrix[row] = self._matrix[last]
+                    self._sq_norms[row] = self._sq_norms[last]
+                    self._ids[row] = moved_id
+                    self._rows[moved_id] = row
+                self._ids.pop()
+
+
+class HNSWBackend(VectorBackend):
+    """
+    Approximate in-process index built on hnswlib (optional dependency: `pip install hnswlib`).
+    Deleted labels are marked and their slots reused by later adds.
+    """
+
+    def __init__(self, initial_capacity: int = INITIAL_BACKEND_CAPACITY, m: int = HNSW_M,
+                 ef_construction: int = HNSW_EF_CONSTRUCTION, ef_search: int = HNSW_EF_SEARCH):
+        try:
+            import hnswlib
+        except ImportError as e:
+            raise ImportError("The 'hnsw' MemoryCache backend requires hnswlib. Install it with `pip install hnswlib`.") from e
+        self._hnswlib = hnswlib
+        self._initial_capacity = initial_capacity
+        self._m = m
+        self._ef_construction = ef_construction
+        self._ef_search = ef_search
+        self._index = None # Created on first add, once the dimension is known
+        self._labels: Dict[str, int] = {}
+        self._ids_by_label: Dict[int, str] = {}
+        self._metadatas: Dict[str, Dict[str, Any]] = {}
+        self._next_label = 0
+        self._deleted_slots = 0 # Labels marked deleted and not yet reused by an add
+        self._mutations = 0 # Bumped by add/delete; compact() discards a rebuild that raced with one
+        self._lock = threading.Lock()
+
+    def count(self) -> int:
+        return len(self._labels)
+
+    def deleted_fraction(self) -> float:
+        with self._lock:
+            total = len(self._labels) + self._deleted_slots
+            return self._deleted_slots / total if total else 0.0
+
+    def compact(self) -> bool:
+        """Rebuilds the graph from live vectors outside the lock, then swaps it in if nothing changed meanwhile."""
+        with self._lock:
+            if self._index is None or not self._deleted_slots:
+                return False
+            mutations = self._mutations
+            entry_ids = list(self._labels.keys())
+            vectors = np.asarray(self._index.get_items([self._labels[entry_id] for entry_id in entry_ids]), dtype=np.float32) \
+                if entry_ids else np.zeros((0, self._index.dim), dtype=np.float32)
+            dim = self._index.dim
+
+        index = self._hnswlib.Index(space="l2", dim=dim)
+        index.init_index(max_elements=max(self._initial_capacity, 2 * len(entry_ids)), M=self._m,
+                         ef_construction=self._ef_construction, allow_replace_deleted=True)
+        if entry_ids:
+            index.add_items(vectors, np.arange(len(entry_ids)))
+
+        with self._lock:
+            if self._mutations != mutations:
+                return False # Retried on a later maintenance tick
+            self._index = index
+            self._labels = {entry_id: label for label, entry_id in enumerate(entry_ids)}
+            self._ids_by_label = dict(enumerate(entry_ids))
+            self._next_label = len(entry_ids)
+            self._deleted_slots = 0
+        return True
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]],
+            skip_existing: bool = False) -> List[str]:
+        rows = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            keep = _new_positions(ids, self._labels)
+            if len(keep) < len(ids):
+                ids, rows, metadatas = [ids[i] for i in keep], rows[keep], [metadatas[i] for i in keep]
+            if not ids:
+                return []
+            if self._index is None:
+                self._index = self._hnswlib.Index(space="l2", dim=rows.shape[1])
+                self._index.init_index(max_elements=max(self._initial_capacity, len(ids)), M=self._m,
+                                       ef_construction=self._ef_construction, allow_replace_deleted=True)
+            needed = len(self._labels) + len(ids)
+            if needed > self._index.get_max_elements():
+                self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+
+            labels = np.arange(self._next_label, self._next_label + len(ids))
+            self._next_label += len(ids)
+            self._index.add_items(rows, labels, replace_deleted=True)
+            self._deleted_slots = max(0, self._deleted_slots - len(ids))
+            self._mutations += 1
+            for entry_id, label, metadata in zip(ids, labels.tolist(), metadatas):
+                self._labels[entry_id] = label
+                self._ids_by_label[label] = entry_id
+                self._metadatas[entry_id] = dict(metadata)
+        return list(ids)
+
+    def query(self, embedding: List[float], n_results: int) -> List[QueryResult]:
+        with self._lock:
+            k = min(n_results, len(self._labels))
+            if self._index is None or k == 0:
+                return []
+            self._index.set_ef(max(self._ef_search, k))
+            labels, distances = self._index.knn_query(np.asarray(embedding, dtype=np.float32), k=k)
+            return self._to_results(labels[0], distances[0])
+
+    def query_many(self, embeddings: List[List[float]], n_results: int) -> List[List[QueryResult]]:
+        with self._lock:
+            k = min(n_results, len(self._labels))
+            if self._index is None or k == 0 or not embeddings:
+                return [[] for _ in embeddings]
+            self._index.set_ef(max(self._ef_search, k))
+            labels, distances = self._index.knn_query(np.asarray(embeddings, dtype=np.float32), k=k)
+            return [self._to_results(row_labels, row_distances) for row_labels, row_distances in zip(labels, distances)]
+
+    def _to_results(self, labels: np.ndarray, distances: np.ndarray) -> List[QueryResult]:
+        """Maps hnswlib labels back to entry ids. Caller holds the lock."""
+        results = []
+        for label, distance in zip(labels.tolist(), distances.tolist()):
+            entry_id = self._ids_by_label.get(label)
+            if entry_id is not None:
+                results.append((entry_id, float(distance), dict(self._metadatas[entry_id])))
+        return results
+
+    def get_metadata(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            metadata = self._metadatas.get(entry_id)
+            return dict(metadata) if metadata is not None else None
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        with self._lock:
+            return {entry_id for entry_id in ids if entry_id in self._metadatas}
+
+    def update_metadata(self, entry_id: str, metadata: Dict[str, Any]):
+        with self._lock:
+            if entry_id in self._metadatas:
+                self._metadatas[entry_id] = dict(metadata)
+
+    def get_embedding(self, entry_id: str) -> Optional[List[float]]:
+        with self._lock:
+            label = self._labels.get(entry_id)
+            return self._index.get_items([label])[0].tolist() if label is not None else None
+
+    def update_entry(self, entry_id: str, embedding: List[float], metadata: Dict[str, Any]):
+        with self._lock:
+            label = self._labels.get(entry_id)
+            if label is None:
+                return
+            # hnswlib re-links an existing label in place when it is added again
+            self._index.add_items(np.asarray([embedding], dtype=np.float32), [label])
+            self._metadatas[entry_id] = dict(metadata)
+            self._mutations += 1
+
+    def all_metadata(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            return [(entry_id, dict(metadata)) for entry_id, metadata in self._metadatas.items()]
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            for entry_id in ids:
+                label = self._labels.pop(entry_id, None)
+                if label is None:
+                    continue
+                self._index.mark_deleted(label)
+                del self._ids_by_label[label]
+                del self._metadatas[entry_id]
+                self._deleted_slots += 1
+            self._mutations += 1
+
+
+class MmapBackend(VectorBackend):
+    """
+    Exact flat index shared by several processes on one machine through files under persist_path:
+
+        <collection>.mmap/CURRENT           {"generation": g}, replaced atomically by compact()
+        <collection>.mmap/vectors.<g>.f32   float32 rows, append-only, memory-mapped read-only
+        <collection>.mmap/log.<g>.jsonl     append-only write log: add/update/delete records
+        <collection>.mmap/writer.lock       flock held by whichever process is writing
+
+    Every process maps the same vector file, so the embeddings sit once in the OS page cache no
+    matter how many workers run, and queries scan the mapping without copying it. Writes from any
+    process take the flock (one writer at a time), first replay what other writers appended, then
+    append vectors and a log record. Other processes replay new log records at most
+    MMAP_REFRESH_INTERVAL_S after they were written. Metadata is rebuilt per process from the log.
+    An updated embedding is appended as a new row and its old row becomes dead, and every metadata
+    update (a vote, a hit) leaves the previous record superseded in the log; compact() copies live
+    rows into the next generation with one log record each. Needs a POSIX system (fcntl.flock).
+    """
+
+    REBUILDS_IN_BACKGROUND = True # The log grows with every vote, so compaction is needed even without deletes
+
+    def __init__(self, collection_name: str, persist_path: str, refresh_interval_s: float = MMAP_REFRESH_INTERVAL_S):
+        try:
+            import fcntl
+        except ImportError as e:
+            raise ImportError("The 'mmap' MemoryCache backend needs fcntl.flock, which is only available on POSIX systems.") from e
+        self._fcntl = fcntl
+        self._directory = os.path.join(persist_path, collection_name + ".mmap")
+        os.makedirs(self._directory, exist_ok=True)
+        self.refresh_interval_s = refresh_interval_s
+        self._lock = threading.RLock() # In-process view of the files below
+        self._write_lock = threading.Lock() # flock is per open file, so threads also need to take turns
+        self._lock_file = open(os.path.join(self._directory, "writer.lock"), "a+")
+        self._last_refresh = 0.0
+        self._generation = -1
+        self._load_generation(self._current_generation())
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self._directory, f"vectors.{generation}.f32")
+
+    def _log_path(self, generation: int) -> str:
+        return os.path.join(self._directory, f"log.{generation}.jsonl")
+
+    def _current_generation(self) -> int:
+        try:
+            with open(os.path.join(self._directory, "CURRENT")) as f:
+                return int(json.load(f)["generation"])
+        except FileNotFoundError:
+            return 0
+
+    @contextmanager
+    def _exclusive(self):
+        with self._write_lock:
+            self._fcntl.flock(self._lock_file.fileno(), self._fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._fcntl.flock(self._lock_file.fileno(), self._fcntl.LOCK_UN)
+
+    def _load_generation(self, generation: int):
+        """Resets the in-process view and replays generation's log from the start. Caller holds _lock (or is __init__)."""
+        self._generation = generation
+        self._log_offset = 0
+        self._dim: Optional[int] = None
+        self._vectors: Optional[np.ndarray] = None # Read-only np.memmap over the mapped rows
+        self._sq_norms = np.zeros(0, dtype=np.float32)
+        self._live = np.zeros(0, dtype=bool)
+        self._row_ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._metadatas: Dict[str, Dict[str, Any]] = {}
+        self._dead_rows = 0
+        self._log_records = 0 # Records replayed from this generation's log; one per live entry right after compact()
+        self._catch_up()
+
+    def _map_rows(self, rows_needed: int):
+        """Re-maps the vector file once rows past the current mapping are referenced."""
+        mapped = 0 if self._vectors is None else self._vectors.shape[0]
+        if rows_needed <= mapped:
+            return
+        file_rows = os.path.getsize(self._vectors_path(self._generation)) // (4 * self._dim)
+        self._vectors = np.memmap(self._vectors_path(self._generation), dtype=np.float32, mode="r", shape=(file_rows, self._dim))
+        new_rows = self._vectors[mapped:file_rows]
+        self._sq_norms = np.concatenate([self._sq_norms, np.einsum("ij,ij->i", new_rows, new_rows)])
+        self._live = np.concatenate([self._live, np.zeros(file_rows - mapped, dtype=bool)])
+        self._row_ids.extend([None] * (file_rows - mapped))
+
+    def _kill_row(self, entry_id: str):
+        row = self._rows.pop(entry_id, None)
+        if row is not None:
+            self._live[row] = False
+            self._row_ids[row] = None
+            self._dead_rows += 1
+
+    def _apply(self, record: Dict[str, Any]):
+        op = record["op"]
+        entry_id = record["id"]
+        if op in ("add", "update_entry"):
+            if self._dim is None:
+                self._dim = record["dim"]
+            self._map_rows(record["row"] + 1)
+            self._kill_row(entry_id)
+            self._rows[entry_id] = record["row"]
+            self._live[record["row"]] = True
+            self._row_ids[record["row"]] = entry_id
+            self._metadatas[entry_id] = record["metadata"]
+        elif op == "update_metadata":
+            if entry_id in self._rows:
+                self._metadatas[entry_id] = record["metadata"]
+        elif op == "delete":
+            self._kill_row(entry_id)
+            self._metadatas.pop(entry_id, None)
+
+    def _catch_up(self):
+        """Applies log records appended since the last call. Caller holds _lock."""
+        try:
+            with open(self._log_path(self._generation), "rb") as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            if self._generation == self._current_generation():
+                return # Nothing written yet
+            raise
+        end = data.rfind(b"\n") + 1 # A record still being written has no newline yet
+        for line in data[:end].splitlines():
+            if line:
+                self._apply(json.loads(line))
+                self._log_records += 1
+        self._log_offset += end
+
+    def _refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_refresh < self.refresh_interval_s:
+            return
+        with self._lock:
+            self._last_refresh = now
+            generation = self._current_generation()
+            if generation != self._generation:
+                self._load_generation(generation)
+            else:
+                try:
+                    self._catch_up()
+                except FileNotFoundError:
+                    # compact() removed this generation between the two reads
+                    self._load_generation(self._current_generation())
+
+    def _write(self, records: List[Dict[str, Any]], rows: Optional[np.ndarray] = None, new_ids_only: bool = False) -> List[str]:
+        """
+        Appends rows (for the add/update_entry records, in order) and records to the shared files.
+        new_ids_only (add records only): drops records, and their rows, whose ids any process
+        already stored. Returns the ids of the records written.
+        """
+        with self._exclusive():
+            with self._lock:
+                if self._current_generation() != self._generation:
+                    self._load_generation(self._current_generation())
+                else:
+                    self._catch_up()
+                if new_ids_only:
+                    keep = _new_positions([record["id"] for record in records], self._metadatas)
+                    records = [records[i] for i in keep]
+                    rows = rows[keep] if rows is not None else None
+                    if not records:
+                        return []
+                if rows is not None and len(rows):
+                    vectors_path = self._vectors_path(self._generation)
+                    open(vectors_path, "ab").close()
+                    dim = rows.shape[1]
+                    # Rows from a writer that died before logging them are skipped, never reused
+                    start = -(-os.path.getsize(vectors_path) // (4 * dim))
+                    with open(vectors_path, "r+b") as f:
+                        f.seek(4 * dim * start)
+                        f.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+                    vector_records = (record for record in records if record["op"] in ("add", "update_entry"))
+                    for offset, record in enumerate(vector_records):
+                        record["row"] = start + offset
+                        record["dim"] = dim
+                payload = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records).encode("utf-8")
+                with open(self._log_path(self._generation), "ab") as f:
+                    f.write(payload)
+                self._catch_up()
+                self._last_refresh = time.monotonic()
+        return [record["id"] for record in records]
+
+    def count(self) -> int:
+        self._refresh()
+        return len(self._rows)
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]],
+            skip_existing: bool = False) -> List[str]:
+        rows = np.asarray(embeddings, dtype=np.float32)
+        return self._write([{"op": "add", "id": entry_id, "metadata": dict(metadata)} for entry_id, metadata in zip(ids, metadatas)],
+                           rows, new_ids_only=True)
+
+    def query(self, embedding: List[float], n_results: int) -> List[QueryResult]:
+        return self.query_many([embedding], n_results)[0]
+
+    def query_many(self, embeddings: List[List[float]], n_results: int) -> List[List[QueryResult]]:
+        self._refresh()
+        with self._lock:
+            if not self._rows or len(embeddings) == 0:
+                return [[] for _ in embeddings]
+            queries = np.asarray(embeddings, dtype=np.float32)
+            # Squared L2 via |x|^2 + |q|^2 - 2 x.q, straight off the shared mapping
+            distances = self._sq_norms[None, :] + np.einsum("ij,ij->i", queries, queries)[:, None] - 2.0 * (queries @ self._vectors.T)
+            distances[:, ~self._live] = np.inf
+            k = min(n_results, len(self._rows))
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            results = []
+            for row_distances, row_top in zip(distances, top):
+                row_top = row_top[np.argsort(row_distances[row_top])]
+                results.append([(self._row_ids[row], float(max(row_distances[row], 0.0)), dict(self._metadatas[self._row_ids[row]]))
+                                for row in row_top])
+            return results
+
+    def get_metadata(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        self._refresh()
+        with self._lock:
+            metadata = self._metadatas.get(entry_id)
+            return dict(metadata) if metadata is not None else None
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        self._refresh()
+        with self._lock:
+            return {entry_id for entry_id in ids if entry_id in self._metadatas}
+
+    def update_metadata(self, entry_id: str, metadata: Dict[str, Any]):
+        self._write([{"op": "update_metadata", "id": entry_id, "metadata": dict(metadata)}])
+
+    def update_metadata_many(self, entry_ids: List[str], metadatas: List[Dict[str, Any]]):
+        self._write([{"op": "update_metadata", "id": entry_id, "metadata": dict(metadata)} for entry_id, metadata in zip(entry_ids, metadatas)])
+
+    def get_embedding(self, entry_id: str) -> Optional[List[float]]:
+        self._refresh()
+        with self._lock:
+            row = self._rows.get(entry_id)
+            return self._vectors[row].tolist() if row is not None else None
+
+    def update_entry(self, entry_id: str, embedding: List[float], metadata: Dict[str, Any]):
+        self._write([{"op": "update_entry", "id": entry_id, "metadata": dict(metadata)}], np.asarray([embedding], dtype=np.float32))
+
+    def delete(self, ids: List[str]):
+        self._write([{"op": "delete", "id": entry_id} for entry_id in ids])
+
+    def all_metadata(self) -> List[Tuple[str, Dict[str, Any]]]:
+        self._refresh(force=True)
+        with self._lock:
+            return [(entry_id, dict(metadata)) for entry_id, metadata in self._metadatas.items()]
+
+    def deleted_fraction(self) -> float:
+        with self._lock:
+            total = len(self._rows) + self._dead_rows
+            return self._dead_rows / total if total else 0.0
+
+    def superseded_log_fraction(self) -> float:
+        """Share of the log's records that compact() would drop (overwritten metadata, updates, deletes)."""
+        with self._lock:
+            return (self._log_records - len(self._rows)) / self._log_records if self._log_records else 0.0
+
+    def needs_compaction(self, deleted_fraction_threshold: float) -> bool:
+        # Every process replays the whole log on open, so superseded records count like dead rows
+        self._refresh()
+        if self.deleted_fraction() >= deleted_fraction_threshold:
+            return True
+        with self._lock:
+            superseded = self._log_records - len(self._rows)
+        return superseded >= MMAP_MIN_SUPERSEDED_RECORDS and self.superseded_log_fraction() >= deleted_fraction_threshold
+
+    def compact(self) -> bool:
+        """
+        Writes live rows and metadata into generation g+1, points CURRENT at it and removes
+        generation g. Writers in every process wait; readers switch on their next refresh.
+        """
+        with self._exclusive():
+            with self._lock:
+                if self._current_generation() != self._generation:
+                    self._load_generation(self._current_generation())
+                else:
+                    self._catch_up()
+                if not self._dead_rows and self._log_records == len(self._rows):
+                    return False
+                new_generation = self._generation + 1
+                entries = sorted(self._rows.items(), key=lambda item: item[1])
+                with open(self._vectors_path(new_generation), "wb") as vectors_file, open(self._log_path(new_generation), "wb") as log_file:
+                    for start in range(0, len(entries), MMAP_COPY_CHUNK):
+                        chunk = entries[start:start + MMAP_COPY_CHUNK]
+                        vectors_file.write(np.ascontiguousarray(self._vectors[[row for _, row in chunk]]).tobytes())
+                        log_file.write("".join(
+                            json.dumps({"op": "add", "id": entry_id, "row": start + offset, "dim": self._dim,
+                                        "metadata": self._metadatas[entry_id]}, separators=(",", ":")) + "\n"
+                            for offset, (entry_id, _) in enumerate(chunk)
+                        ).encode("utf-8"))
+                    vectors_file.flush()
+                    os.fsync(vectors_file.fileno())
+                    log_file.flush()
+                    os.fsync(log_file.fileno())
+                self._publish_generation(new_generation)
+        return True
+
+    def _publish_generation(self, new_generation: int):
+        """Points CURRENT at new_generation and removes the files of the current one. Caller holds the flock and _lock."""
+        old_generation = self._generation
+        current_path = os.path.join(self._directory, "CURRENT")
+        with open(current_path + ".tmp", "w") as f:
+            json.dump({"generation": new_generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current_path + ".tmp", current_path)
+        self._load_generation(new_generation)
+        # Processes still mapping the old files keep them alive until they refresh
+        for path in (self._vectors_path(old_generation), self._log_path(old_generation)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def drop(self):
+        """Empties the store for every process: an empty next generation replaces the current one."""
+        with self._exclusive():
+            with self._lock:
+                self._generation = self._current_generation()
+                self._publish_generation(self._generation + 1)
+
+
+def _nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid (squared L2) for every row, in bounded-memory blocks."""
+    centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), IVF_ASSIGN_CHUNK):
+        block = vectors[start:start + IVF_ASSIGN_CHUNK]
+        # |x|^2 is the same for every centroid, so it does not affect the argmin
+        assignment[start:start + len(block)] = np.argmin(centroid_sq_norms[None, :] - 2.0 * (block @ centroids.T), axis=1)
+    return assignment
+
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int = IVF_KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means; empty clusters are re-seeded from random vectors."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignment = _nearest_centroids(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=k)
+        present = np.nonzero(counts)[0]
+        sums = np.add.reduceat(vectors[order], np.concatenate(([0], np.cumsum(counts[present])[:-1])), axis=0)
+        centroids[present] = sums / counts[present][:, None]
+        empty = np.nonzero(counts == 0)[0]
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), size=len(empty), replace=False)]
+    return centroids
+
+
+class IVFBackend(VectorBackend):
+    """
+    Two-level clustered index for very large caches: k-means centroids over the stored embeddings
+    and one inverted list (a NumpyFlatBackend) per centroid. A query scans only the nprobe lists
+    whose centroids are nearest, so its cost grows with nprobe * list size instead of the cache size.
+
+    New entries are appended to the list of their nearest centroid. Until IVF_MIN_TRAIN_SIZE
+    entries exist everything lives in one list (an exact flat scan). Training and re-training
+    (after the size changes by IVF_RETRAIN_GROWTH) happen in compact(), called by the MemoryCache
+    maintenance worker: k-means runs outside the lock, writes made meanwhile are logged and
+    replayed onto the new lists before they are swapped in.
+    """
+
+    REBUILDS_IN_BACKGROUND = True
+
+    def __init__(self, nprobe: int = IVF_NPROBE, min_train_size: int = IVF_MIN_TRAIN_SIZE):
+        self.nprobe = nprobe
+        self._min_train_size = min_train_size
+        self._centroids: Optional[np.ndarray] = None # (nlist, dim); None until trained
+        self._lists: List[NumpyFlatBackend] = [NumpyFlatBackend()]
+        self._list_of: Dict[str, int] = {}
+        self._trained_size = 0
+        self._rebuild_log: Optional[List[Tuple]] = None # Writes made while compact() trains
+        self._lock = threading.RLock()
+
+    def _assign(self, rows: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            return np.zeros(len(rows), dtype=np.int64)
+        return _nearest_centroids(rows, self._centroids)
+
+    def _apply(self, op: Tuple):
+        """Applies one write to the current lists. Caller holds the lock."""
+        kind = op[0]
+        if kind == "add":
+            _, ids, rows, metadatas = op
+            assignment = self._assign(rows)
+            for list_no in np.unique(assignment).tolist():
+                members = np.nonzero(assignment == list_no)[0].tolist()
+                member_ids = [ids[i] for i in members]
+                self._lists[list_no].add(member_ids, rows[members], [metadatas[i] for i in members])
+                for entry_id in member_ids:
+                    self._list_of[entry_id] = list_no
+        elif kind == "delete":
+            for entry_id in op[1]:
+                list_no = self._list_of.pop(entry_id, None)
+                if list_no is not None:
+                    self._lists[list_no].delete([entry_id])
+        elif kind == "update_metadata":
+            _, entry_id, metadata = op
+            list_no = self._list_of.get(entry_id)
+            if list_no is not None:
+                self._lists[list_no].update_metadata(entry_id, metadata)
+        elif kind == "update_entry":
+            # The vector moved: re-insert it under its (possibly different) nearest centroid
+            _, entry_id, row, metadata = op
+            if entry_id in self._list_of:
+                self._apply(("delete", [entry_id]))
+                self._apply(("add", [entry_id], row[None, :], [metadata]))
+
+    def _write(self, op: Tuple):
+        with self._lock:
+            self._apply(op)
+            if self._rebuild_log is not None:
+                self._rebuild_log.append(op)
+
+    def count(self) -> int:
+        return len(self._list_of)
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]],
+            skip_existing: bool = False) -> List[str]:
+        rows = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            keep = _new_positions(ids, self._list_of)
+            if not keep:
+                return []
+            new_ids = [ids[i] for i in keep]
+            self._write(("add", new_ids, rows[keep], [dict(metadatas[i]) for i in keep]))
+            return new_ids
+
+    def query(self, embedding: List[float], n_results: int) -> List[QueryResult]:
+        return self.query_many([embedding], n_results)[0]
+
+    def query_many(self, embeddings: List[List[float]], n_results: int) -> List[List[QueryResult]]:
+        with self._lock:
+            centroids, lists, size = self._centroids, self._lists, len(self._list_of)
+        if size == 0 or len(embeddings) == 0:
+            return [[] for _ in embeddings]
+        queries = np.asarray(embeddings, dtype=np.float32)
+        if centroids is None:
+            probes = np.zeros((len(queries), 1), dtype=np.int64)
+        else:
+            nprobe = min(self.nprobe, len(centroids))
+            centroid_distances = np.einsum("ij,ij->i", centroids, centroids)[None, :] - 2.0 * (queries @ centroids.T)
+            probes = np.argpartition(centroid_distances, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, list_nos in zip(queries, probes):
+            candidates: List[QueryResult] = []
+            for list_no in list_nos.tolist():
+                candidates.extend(lists[list_no].query(query, n_results))
+            candidates.sort(key=lambda result: result[1])
+            results.append(candidates[:n_results])
+        return results
+
+    def get_metadata(self, entry_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            list_no = self._list_of.get(entry_id)
+            return self._lists[list_no].get_metadata(entry_id) if list_no is not None else None
+
+    def existing_ids(self, ids: List[str]) -> Set[str]:
+        with self._lock:
+            return {entry_id for entry_id in ids if entry_id in self._list_of}
+
+    def update_metadata(self, entry_id: str, metadata: Dict[str, Any]):
+        self._write(("update_metadata", entry_id, dict(metadata)))
+
+    def get_embedding(self, entry_id: str) -> Optional[List[float]]:
+        with self._lock:
+            list_no = self._list_of.get(entry_id)
+            return self._lists[list_no].get_embedding(entry_id) if list_no is not None else None
+
+    def update_entry(self, entry_id: str, embedding: List[float], metadata: Dict[str, Any]):
+        self._write(("update_entry", entry_id, np.asarray(embedding, dtype=np.float32), dict(metadata)))
+
+    def delete(self, ids: List[str]):
+        self._write(("delete", list(ids)))
+
+    def all_metadata(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            return [entry for inverted_list in self._lists for entry in inverted_list.all_metadata()]
+
+    def needs_compaction(self, deleted_fraction_threshold: float) -> bool:
+        size = len(self._list_of)
+        if size < self._min_train_size:
+            return False
+        if self._centroids is None:
+            return True
+        return size >= IVF_RETRAIN_GROWTH * self._trained_size or size * IVF_RETRAIN_GROWTH <= self._trained_size
+
+    def compact(self) -> bool:
+        """(Re-)trains the centroids on the current entries and redistributes them into new lists."""
+        with self._lock:
+            if self._rebuild_log is not None:
+                return False # Another rebuild is running
+            snapshots = [inverted_list._snapshot() for inverted_list in self._lists]
+            self._rebuild_log = []
+        try:
+            ids = [entry_id for snapshot_ids, _, _ in snapshots for entry_id in snapshot_ids]
+            if len(ids) < self._min_train_size:
+                return False
+            vectors = np.concatenate([matrix for _, matrix, _ in snapshots if len(matrix)], axis=0)
+            metadatas = [metadata for _, _, snapshot_metadatas in snapshots for metadata in snapshot_metadatas]
+
+            nlist = int(min(max(1, round(np.sqrt(len(ids)))), IVF_MAX_LISTS))
+            rng = np.random.default_rng(len(ids))
+            sample = vectors[rng.choice(len(ids), size=min(len(ids), IVF_TRAIN_SAMPLE), replace=False)]
+            centroids = _kmeans(sample, nlist)
+            assignment = _nearest_centroids(vectors, centroids)
+
+            counts = np.bincount(assignment, minlength=nlist)
+            lists = [NumpyFlatBackend(initial_capacity=max(16, int(count))) for count in counts]
+            list_of: Dict[str, int] = {}
+            for list_no in np.nonzero(counts)[0].tolist():
+                members = np.nonzero(assignment == list_no)[0].tolist()
+                member_ids = [ids[i] for i in members]
+                lists[list_no].add(member_ids, vectors[members], [metadatas[i] for i in members])
+                for entry_id in member_ids:
+                    list_of[entry_id] = list_no
+
+            with self._lock:
+                self._centroids, self._lists, self._list_of = centroids, lists, list_of
+                self._trained_size = len(ids)
+                for op in self._rebuild_log:
+                    self._apply(op)
+            return True
+        finally:
+            with self._lock:
+                self._rebuild_log = None
+
+
+def create_backend(name: str, collection_name: str, persist_path: Optional[str] = None) -> VectorBackend:
+    """
+    Builds a backend by name: "chroma" (default, optionally persistent), "numpy" (exact), "hnsw"
+    (approximate), "ivf" (clustered) or "mmap" (exact, shared between processes; needs persist_path).
+    Raises ValueError for an unknown name or a persist_path given to an in-memory backend.
+    """
+    if name == "chroma":
+        return ChromaBackend(collection_name=collection_name, persist_path=persist_path)
+    if name == "mmap":
+        if not persist_path:
+            raise ValueError("The 'mmap' MemoryCache backend needs a persist_path shared by the worker processes.")
+        return MmapBackend(collection_name=collection_name, persist_path=persist_path)
+    if persist_path and name in BACKEND_NAMES:
+        # Silently keeping entries in memory would lose every learned plan on the next restart
+        raise ValueError(f"The '{name}' MemoryCache backend keeps entries in memory and cannot use persist_path; "
+                         f"use 'chroma' or 'mmap' for a persistent cache.")
+    if name == "numpy":
+        return NumpyFlatBackend()
+    if name == "hnsw":
+        return HNSWBackend()
+    if name == "ivf":
+        return IVFBackend()
+    raise ValueError(f"Unknown MemoryCache backend '{name}'. Expected one of {BACKEND_NAMES}.")